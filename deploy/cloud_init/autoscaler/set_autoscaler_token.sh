@@ -0,0 +1,4 @@
+kubectl apply -f http://${MANAGER_IP}:8080/autoscaler/autoscaler_rbac.yaml
+LONG_LIVED_TOKEN=$(kubectl get secret k3s-autoscaler-token -n kube-system -o jsonpath='{.data.token}' | base64 -d)
+
+echo "新获得的长期 Token (写入 src/monitoring/pusher/data/k8s_token): $LONG_LIVED_TOKEN"
@@ -22,6 +22,14 @@ deb http://security.ubuntu.com/ubuntu/ noble-security main restricted universe m
 "
 # REQUIRED_FILES 必须从 NFS 复制到家目录的文件列表
 REQUIRED_FILES=("create_node.sh" "k3s" "k3s_install.sh" "k3s_config.conf")
+# BOOTSTRAP_URL 引导服务地址 (例如 http://MANAGER_IP:8090)，设置后通过 HTTP 下载文件，不再挂载 NFS
+export BOOTSTRAP_URL="${BOOTSTRAP_URL:-}"
+# BOOTSTRAP_TICKET 引导服务签发的一次性加入票据，用于登记/获取集群 Token
+export BOOTSTRAP_TICKET="${BOOTSTRAP_TICKET:-}"
+# BOOTSTRAP_FILES 通过 HTTP 下载的文件列表 (集群 Token 由 /join 接口按节点发放)
+BOOTSTRAP_FILES=("create_node.sh" "k3s" "k3s_install.sh")
+# BOOTSTRAP_DIR 本地用于存放下载文件的目录
+BOOTSTRAP_DIR="/opt/k3s-bootstrap"
 
 # ==============================================================================
 # 全局参数设置 (Global Parameters Setup)
@@ -150,6 +158,40 @@ mount_nfs_share() {
     fi
 }
 
+download_bootstrap_files() {
+    # download_bootstrap_files 从引导服务下载 k3s 文件并校验 sha256
+    # @param BOOTSTRAP_URL: 引导服务地址 (全局变量)
+    # @param BOOTSTRAP_FILES: 需下载的文件列表 (全局变量)
+    # @param BOOTSTRAP_DIR: 下载目录 (全局变量)
+    # @note 使用 curl -C - 断点续传，中断后重新执行脚本不会重复下载已完成的部分；
+    #       下载完成后将 MOUNT_POINT 指向下载目录，后续复制流程与 NFS 方式一致。
+    # @return 成功返回 0，下载或校验失败返回 1
+    
+    echo "从引导服务 ${BOOTSTRAP_URL} 下载文件到 ${BOOTSTRAP_DIR}..."
+    mkdir -p "${BOOTSTRAP_DIR}"
+    
+    for f in "${BOOTSTRAP_FILES[@]}"; do
+        local DST="${BOOTSTRAP_DIR}/${f}"
+        local ATTEMPT
+        for ATTEMPT in 1 2; do
+            curl -fsSL --retry 5 --retry-delay 2 --retry-all-errors -C - -o "${DST}" "${BOOTSTRAP_URL}/artifacts/${f}" || true
+            if curl -fsSL --retry 5 "${BOOTSTRAP_URL}/artifacts/${f}.sha256" | (cd "${BOOTSTRAP_DIR}" && sha256sum -c --quiet -); then
+                echo "${f} 下载并校验成功。"
+                break
+            fi
+            echo "Warning: ${f} 校验失败，删除后重新下载 (第 ${ATTEMPT} 次)。" >&2
+            rm -f "${DST}"
+        done
+        if [ ! -f "${DST}" ]; then
+            echo "Error: ${f} 下载失败。" >&2
+            return 1
+        fi
+    done
+    
+    MOUNT_POINT="${BOOTSTRAP_DIR}"
+    return 0
+}
+
 copy_files_and_run_script() {
     # copy_files_and_run_script 复制共享文件到家目录并执行 create_node.sh
     # @param MOUNT_POINT: NFS 挂载点路径 (全局变量)
@@ -206,7 +248,8 @@ finalize_and_cleanup() {
     # finalize_and_cleanup 根据节点类型执行收尾工作，并输出完成信息
     # @param K3S_TYPE: 主机角色类型 (全局变量)
     # @param MOUNT_POINT: NFS 挂载点路径 (全局变量)
-    # @note control_node 需要获取 IP 和 Token 并写入配置文件。
+    # @param BOOTSTRAP_URL: 引导服务地址 (全局变量)，设置时改为向引导服务登记
+    # @note control_node 需要获取 IP 和 Token 并写入配置文件或登记到引导服务。
     # @return 成功返回 0
     
     if [ "${K3S_TYPE}" = "control_node" ]; then
@@ -215,6 +258,18 @@ finalize_and_cleanup() {
         local K3S_TOKEN
         K3S_TOKEN=$(cat /var/lib/rancher/k3s/server/token) || true
         
+        if [ -n "${BOOTSTRAP_URL}" ]; then
+            curl -fsS --retry 5 --retry-delay 2 --retry-connrefused \
+                -H "Content-Type: application/json" \
+                -d "{\"ticket\": \"${BOOTSTRAP_TICKET}\", \"master_ip\": \"${K3S_MASTER_IP_FOUND}\", \"token\": \"${K3S_TOKEN}\"}" \
+                "${BOOTSTRAP_URL}/join/control?node=$(hostname)" > /dev/null || {
+                echo "Error: 向引导服务登记 Master IP 和 Token 失败。" >&2
+                return 1
+            }
+            echo "Create Control node complete. Master IP and Token registered to bootstrap service."
+            return 0
+        fi
+        
         (
             echo "MASTER_IP=\"${K3S_MASTER_IP_FOUND}\""
             echo "TOKEN=\"${K3S_TOKEN}\""
@@ -236,8 +291,12 @@ main() {
     
     check_prerequisites        || return 1
     set_unique_hostname        || return 1
-    install_nfs_client         || return 1
-    mount_nfs_share            || return 2
+    if [ -n "${BOOTSTRAP_URL}" ]; then
+        download_bootstrap_files   || return 2
+    else
+        install_nfs_client         || return 1
+        mount_nfs_share            || return 2
+    fi
     copy_files_and_run_script  || return 3
     finalize_and_cleanup       || return 0
     
@@ -3,13 +3,18 @@
 # ==============================================================================
 # 变量定义
 # ==============================================================================
-# REGISTRY_ENDPOINT 私有镜像仓库地址，用于配置 registries.yaml
-REGISTRY_ENDPOINT="http://${MANAGER_IP}:5000"
+# REGISTRY_ENDPOINT 私有镜像仓库地址，用于配置 registries.yaml (可由按虚拟机渲染的 cloud-init 片段导出)
+REGISTRY_ENDPOINT="${REGISTRY_ENDPOINT:-http://${MANAGER_IP}:5000}"
+# NODE_IP 节点对外通告的 IP，设置时作为 --node-ip 传给 K3s
+NODE_IP="${NODE_IP:-}"
 K3S_BIN="k3s"
 INSTALL_SCRIPT="k3s_install.sh"
 REGISTRIES_CONFIG_PATH="/etc/rancher/k3s/registries.yaml"
 K3S_CONFIG_DIR="/etc/rancher/k3s"
 CONFIG_FILE="k3s_config.conf"
+# BOOTSTRAP_URL/BOOTSTRAP_TICKET 由 init.sh 导出，设置时通过引导服务获取 Master IP 和 Token
+BOOTSTRAP_URL="${BOOTSTRAP_URL:-}"
+BOOTSTRAP_TICKET="${BOOTSTRAP_TICKET:-}"
 # ==============================================================================
 
 prepare_k3s_files() {
@@ -63,10 +68,11 @@ EOF
 install_control_node() {
     # install_control_node 执行 Master 节点的安装和 Token 复制
     # @param INSTALL_SCRIPT: K3s 安装脚本文件名
+    # @param NODE_IP: (可选) 节点对外通告的 IP
     # @param CONFIG_FILE: 存储 K3s IP 和 Token 的配置文件 (位于当前 NFS 挂载点)
     # @note K3s 安装脚本的执行结果通过 $? 检查
     # @return 成功返回 0，失败返回 1
-    local INSTALL_CMD="INSTALL_K3S_SKIP_DOWNLOAD=true bash ./${INSTALL_SCRIPT}"
+    local INSTALL_CMD="INSTALL_K3S_SKIP_DOWNLOAD=true bash ./${INSTALL_SCRIPT}${NODE_IP:+ --node-ip=${NODE_IP}}"
     
     eval "${INSTALL_CMD}"
     
@@ -76,12 +82,51 @@ install_control_node() {
     fi
 }
 
+fetch_join_credentials() {
+    # fetch_join_credentials 使用加入票据从引导服务获取 Master IP 和 Token
+    # @param BOOTSTRAP_URL: 引导服务地址
+    # @param BOOTSTRAP_TICKET: 本节点的 work_node 票据
+    # @param CONFIG_FILE: 写入的配置文件，格式与 NFS 共享的 k3s_config.conf 一致
+    # @note 控制节点尚未登记 (409) 或服务暂不可用 (5xx/网络错误) 时每 10 秒重试一次，最多等待 30 分钟；
+    #       票据无效、过期或已绑定其他节点等其他 4xx 错误重试无意义，立即失败
+    # @return 成功返回 0，失败返回 1
+    echo "|fetching join credentials from ${BOOTSTRAP_URL}|"
+    local ATTEMPT
+    local HTTP_CODE
+    for ATTEMPT in $(seq 1 180); do
+        HTTP_CODE=$(curl -sS --retry 3 -o "${CONFIG_FILE}.tmp" -w "%{http_code}" \
+            "${BOOTSTRAP_URL}/join/credentials?ticket=${BOOTSTRAP_TICKET}&node=$(hostname)")
+        case "${HTTP_CODE}" in
+            200)
+                mv "${CONFIG_FILE}.tmp" "${CONFIG_FILE}"
+                return 0
+                ;;
+            409)
+                ;;
+            4??)
+                echo "Error: Bootstrap service rejected join credentials request (HTTP ${HTTP_CODE}): $(cat "${CONFIG_FILE}.tmp")"
+                rm -f "${CONFIG_FILE}.tmp"
+                return 1
+                ;;
+        esac
+        sleep 10
+    done
+    rm -f "${CONFIG_FILE}.tmp"
+    echo "Error: Failed to fetch join credentials from bootstrap service."
+    return 1
+}
+
 install_work_node() {
     # install_work_node 执行 Worker 节点的加入集群操作
     # @param INSTALL_SCRIPT: K3s 安装脚本文件名
     # @param MASTER_IP: Master 节点的 IP 地址
-    # @param CONFIG_FILE: 存储 K3s IP 和 Token 的配置文件 (位于当前 NFS 挂载点)
+    # @param NODE_IP: (可选) 节点对外通告的 IP
+    # @param CONFIG_FILE: 存储 K3s IP 和 Token 的配置文件 (位于当前 NFS 挂载点或从引导服务获取)
     # @return 成功返回 0，失败返回 1
+    if [ -n "$BOOTSTRAP_URL" ] && [ -n "$BOOTSTRAP_TICKET" ]; then
+        fetch_join_credentials || return 1
+    fi
+
     echo "|reading token from shared file: ${CONFIG_FILE}|"
     if [ ! -f "$CONFIG_FILE" ]; then
         echo "Error: Token file ${CONFIG_FILE} not found on shared drive. Ensure Master is installed first."
@@ -95,7 +140,7 @@ install_work_node() {
         exit 1
     fi
     
-    local INSTALL_CMD="INSTALL_K3S_SKIP_DOWNLOAD=true bash ./${INSTALL_SCRIPT}"
+    local INSTALL_CMD="INSTALL_K3S_SKIP_DOWNLOAD=true bash ./${INSTALL_SCRIPT}${NODE_IP:+ --node-ip=${NODE_IP}}"
 
     local FULL_INSTALL_CMD="K3S_URL=https://${MASTER_IP}:6443 K3S_TOKEN=${TOKEN} ${INSTALL_CMD}"
     eval "${FULL_INSTALL_CMD}"
@@ -0,0 +1,255 @@
+from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel
+from typing import Dict, Any, Optional
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+import uvicorn
+
+BOOTSTRAP_ARTIFACT_DIR = os.getenv("BOOTSTRAP_ARTIFACT_DIR", "/artifacts")
+BOOTSTRAP_STATE_FILE = os.getenv("BOOTSTRAP_STATE_FILE", "/app/data/bootstrap_state.json")
+BOOTSTRAP_ADMIN_TOKEN = os.getenv("BOOTSTRAP_ADMIN_TOKEN", "")
+BOOTSTRAP_TICKET_TTL = int(os.getenv("BOOTSTRAP_TICKET_TTL", "3600"))
+BOOTSTRAP_PORT = int(os.getenv("BOOTSTRAP_PORT", "8090"))
+
+# 允许下载的引导文件, 与原 NFS 共享目录中的文件一致 (k3s_config.conf 改由 /join 接口按节点发放)
+ARTIFACTS = ("k3s", "k3s_install.sh", "create_node.sh")
+ARTIFACT_CACHE_CONTROL = "public, max-age=3600"
+TICKET_ROLES = ("control_node", "work_node")
+
+app = FastAPI(title="K3s Bootstrap Service")
+
+_checksum_lock = threading.Lock()
+_checksums: Dict[str, Dict[str, Any]] = {}
+_state_lock = threading.Lock()
+
+
+class TicketRequest(BaseModel):
+    role: str = "work_node"
+    node_name: Optional[str] = None
+    ttl: Optional[int] = None
+
+
+class ControlRegistration(BaseModel):
+    ticket: str
+    master_ip: str
+    token: str
+
+
+def load_state() -> Dict[str, Any]:
+    # load_state 读取持久化的集群加入信息与票据
+    # @note 状态文件不存在或损坏时返回空状态
+    # @return 包含 master_ip、token、control_node、tickets 的字典
+    try:
+        with open(BOOTSTRAP_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"master_ip": None, "token": None, "control_node": None, "tickets": {}}
+
+
+def save_state(state: Dict[str, Any]) -> None:
+    # save_state 持久化集群加入信息与票据, 先写临时文件再原子替换
+    # @param state: load_state 返回的状态字典
+    # @return None
+    os.makedirs(os.path.dirname(BOOTSTRAP_STATE_FILE) or ".", exist_ok=True)
+    tmp_path = f"{BOOTSTRAP_STATE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, BOOTSTRAP_STATE_FILE)
+
+
+def artifact_checksum(name: str) -> Dict[str, Any]:
+    # artifact_checksum 计算引导文件的 sha256, 按文件修改时间与大小缓存
+    # @param name: 引导文件名, 必须在 ARTIFACTS 中
+    # @note k3s 二进制约 70MB, 加锁保证大量节点同时启动时只计算一次
+    # @return 包含 path、size、mtime、sha256 的字典
+    path = os.path.join(BOOTSTRAP_ARTIFACT_DIR, name)
+    stat = os.stat(path)
+    with _checksum_lock:
+        cached = _checksums.get(name)
+        if cached and cached["mtime"] == stat.st_mtime and cached["size"] == stat.st_size:
+            return cached
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+
+        cached = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+        _checksums[name] = cached
+        return cached
+
+
+def require_admin(authorization: Optional[str]) -> None:
+    # require_admin 校验管理员令牌 (Authorization: Bearer <BOOTSTRAP_ADMIN_TOKEN>)
+    # @param authorization: 请求头中的 Authorization 值
+    # @note 未配置 BOOTSTRAP_ADMIN_TOKEN 时拒绝所有管理请求
+    # @return None, 校验失败抛出 HTTPException
+    if not BOOTSTRAP_ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="BOOTSTRAP_ADMIN_TOKEN is not configured.")
+    if not authorization or not secrets.compare_digest(authorization, f"Bearer {BOOTSTRAP_ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+
+def redeem_ticket(state: Dict[str, Any], ticket: str, role: str, node_name: str) -> Dict[str, Any]:
+    # redeem_ticket 校验并使用一次性加入票据
+    # @param state: 当前状态字典 (调用方需持有 _state_lock)
+    # @param ticket: 节点提交的票据
+    # @param role: 期望的节点角色
+    # @param node_name: 节点主机名, 首次使用时与票据绑定
+    # @note 同一节点重试 (例如网络中断后重新执行引导脚本) 可重复使用票据, 其他节点不可使用
+    # @return 票据记录, 校验失败抛出 HTTPException
+    record = state["tickets"].get(ticket)
+    if record is None or record["expires_at"] < time.time():
+        raise HTTPException(status_code=403, detail="Ticket is invalid or expired.")
+    if record["role"] != role:
+        raise HTTPException(status_code=403, detail=f"Ticket is not valid for role {role}.")
+    if record.get("node_name") and record["node_name"] != node_name:
+        raise HTTPException(status_code=403, detail="Ticket is bound to another node.")
+
+    record["node_name"] = node_name
+    record["redeemed_at"] = record.get("redeemed_at") or time.time()
+    return record
+
+
+@app.get("/health")
+async def health_check():
+    # health_check 健康检查, 同时报告集群加入信息是否已由控制节点登记
+    # @return JSONResponse
+    state = load_state()
+    return JSONResponse({"status": "ok", "control_registered": bool(state.get("token"))})
+
+
+@app.get("/artifacts")
+def list_artifacts(request: Request):
+    # list_artifacts 列出可下载的引导文件及其大小与 sha256
+    # @param request: FastAPI 的 Request 对象, 用于生成下载地址
+    # @return 引导文件清单的 JSONResponse
+    manifest = {}
+    for name in ARTIFACTS:
+        if not os.path.isfile(os.path.join(BOOTSTRAP_ARTIFACT_DIR, name)):
+            continue
+        info = artifact_checksum(name)
+        manifest[name] = {
+            "size": info["size"],
+            "sha256": info["sha256"],
+            "url": str(request.url_for("get_artifact", name=name)),
+        }
+    return JSONResponse(manifest)
+
+
+@app.get("/artifacts/{name}.sha256")
+def get_artifact_checksum(name: str):
+    # get_artifact_checksum 返回 sha256sum -c 可直接校验的校验和文本
+    # @param name: 引导文件名
+    # @return PlainTextResponse
+    if name not in ARTIFACTS or not os.path.isfile(os.path.join(BOOTSTRAP_ARTIFACT_DIR, name)):
+        raise HTTPException(status_code=404, detail=f"Unknown artifact {name}.")
+    return PlainTextResponse(f"{artifact_checksum(name)['sha256']}  {name}\n")
+
+
+@app.get("/artifacts/{name}")
+def get_artifact(name: str, if_none_match: Optional[str] = Header(default=None)):
+    # get_artifact 下载引导文件
+    # @param name: 引导文件名
+    # @param if_none_match: 客户端缓存的 ETag, 与当前 sha256 一致时返回 304
+    # @note ETag 为文件的 sha256; Range/If-Range 断点续传由 FileResponse 处理
+    # @return FileResponse 或 304 Response
+    if name not in ARTIFACTS or not os.path.isfile(os.path.join(BOOTSTRAP_ARTIFACT_DIR, name)):
+        raise HTTPException(status_code=404, detail=f"Unknown artifact {name}.")
+
+    info = artifact_checksum(name)
+    etag = f'"{info["sha256"]}"'
+    headers = {
+        "etag": etag,
+        "cache-control": ARTIFACT_CACHE_CONTROL,
+        "x-checksum-sha256": info["sha256"],
+    }
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(info["path"], filename=name, headers=headers, media_type="application/octet-stream")
+
+
+@app.post("/join/tickets")
+def issue_ticket(request: TicketRequest, authorization: Optional[str] = Header(default=None)):
+    # issue_ticket 为即将创建的节点签发一次性加入票据 (需要管理员令牌)
+    # @param request: 票据参数, 包含 role、可选的 node_name 与 ttl
+    # @param authorization: 管理员令牌
+    # @note 过期票据在签发新票据时顺带清理
+    # @return 包含 ticket 与过期时间的 JSONResponse
+    require_admin(authorization)
+    if request.role not in TICKET_ROLES:
+        raise HTTPException(status_code=400, detail=f"role must be one of {TICKET_ROLES}.")
+
+    ticket = secrets.token_urlsafe(24)
+    expires_at = time.time() + (request.ttl or BOOTSTRAP_TICKET_TTL)
+    with _state_lock:
+        state = load_state()
+        now = time.time()
+        state["tickets"] = {k: v for k, v in state.get("tickets", {}).items() if v["expires_at"] >= now}
+        state["tickets"][ticket] = {"role": request.role, "node_name": request.node_name, "expires_at": expires_at}
+        save_state(state)
+
+    return JSONResponse({"ticket": ticket, "role": request.role, "expires_at": expires_at})
+
+
+@app.post("/join/control")
+def register_control(registration: ControlRegistration, node: str, force: bool = False,
+                     authorization: Optional[str] = Header(default=None)):
+    # register_control 控制节点安装完成后登记 Master IP 与集群 Token
+    # @param registration: 包含 control_node 票据、master_ip 与 token
+    # @param node: 控制节点主机名
+    # @param force: (可选) 覆盖其他控制节点已登记的信息, 需要管理员令牌
+    # @param authorization: force 时使用的管理员令牌
+    # @note 取代原来写入 NFS 共享目录 k3s_config.conf 的方式;
+    #       已登记的信息只允许同一控制节点重新登记 (例如重装后 Token 变化), 重建集群时由管理员 force 覆盖
+    # @return JSONResponse
+    if force:
+        require_admin(authorization)
+
+    with _state_lock:
+        state = load_state()
+        registered_node = state.get("control_node")
+        if state.get("token") and registered_node != node and not force:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Credentials are already registered by control node {registered_node}; use force with the admin token to replace them.",
+            )
+        redeem_ticket(state, registration.ticket, "control_node", node)
+        state["master_ip"] = registration.master_ip
+        state["token"] = registration.token
+        state["control_node"] = node
+        save_state(state)
+
+    print(f"控制节点 {node} 已登记, Master IP: {registration.master_ip}")
+    return JSONResponse({"status": "success"})
+
+
+@app.get("/join/credentials")
+def get_join_credentials(ticket: str, node: str):
+    # get_join_credentials 工作节点使用票据换取加入集群所需的 Master IP 与 Token
+    # @param ticket: work_node 票据
+    # @param node: 工作节点主机名
+    # @note 返回 shell 可直接 source 的 KEY="value" 格式, 与原 k3s_config.conf 一致
+    # @return PlainTextResponse
+    with _state_lock:
+        state = load_state()
+        if not state.get("token"):
+            raise HTTPException(status_code=409, detail="Control node has not registered yet.")
+        redeem_ticket(state, ticket, "work_node", node)
+        save_state(state)
+
+    return PlainTextResponse(
+        f'MASTER_IP="{state["master_ip"]}"\nTOKEN="{state["token"]}"\n',
+        headers={"cache-control": "no-store"},
+    )
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=BOOTSTRAP_PORT)
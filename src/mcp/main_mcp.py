@@ -2,13 +2,28 @@ import os
 import time
 import requests
 import json
-from typing import Dict, Any, Optional
+import hashlib
+import re
+import threading
+import contextvars
+import warnings
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+import anyio
+import numpy as np
 import urllib3
 from dotenv import load_dotenv
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 from fastmcp import FastMCP
+from fastmcp.server.dependencies import get_http_headers
+from fastmcp.server.middleware import Middleware, MiddlewareContext
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
 from starlette.requests import Request
 from starlette.responses import PlainTextResponse
 
@@ -54,9 +69,25 @@ class PveApiClient:
         # @param path: API 资源的路径, 例如 '/nodes'
         # @param data: (可选) 包含请求体参数的字典
         # @note 使用 API Token 通过 Authorization Header 进行认证，无需 CSRF Token。
+        #       处于 MCP 工具调用的追踪上下文中时记录一个 pve.api 子 span; 后台线程 (调度器、预热池) 的请求不记录
         # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
         """通用PVE API请求方法，使用 API Token 进行认证。"""
-        
+        if not trace.get_current_span().get_span_context().is_valid:
+            return self._send_request(method, path, data)
+
+        attributes = {"http.request.method": method.upper(), "url.path": path.split('?')[0]}
+        with tracer.start_as_current_span(f"pve.api {method.upper()}", kind=trace.SpanKind.CLIENT, attributes=attributes) as span:
+            result = self._send_request(method, path, data)
+            if isinstance(result, dict) and 'error' in result:
+                span.set_status(trace.Status(trace.StatusCode.ERROR, str(result['error'])[:200]))
+            return result
+
+    def _send_request(self, method: str, path: str, data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        # _send_request 发送 PVE API 请求 (api_request 的实现)
+        # @param method: HTTP 请求方法
+        # @param path: API 资源的路径
+        # @param data: (可选) 包含请求体参数的字典
+        # @return API 返回的 JSON 数据, 如果请求失败则返回包含 'error' 键的字典
         if not self.is_authenticated:
             return {"error": "Authentication required. PVE API Token is missing or invalid."}
 
@@ -86,6 +117,9 @@ class PveApiClient:
             try:
                 json_response = response.json()
                 error_detail = json_response.get('data', json.dumps(json_response))
+                if error_detail is None:
+                    # PVE 的参数校验错误在 'errors' 中, 其他错误 (例如 digest 不匹配) 只在状态行中
+                    error_detail = json_response.get('errors') or response.reason
             except Exception:
                 pass
             
@@ -199,6 +233,1530 @@ class PveApiClient:
         path = f"/nodes/{node}/qemu/{vmid}/status/reboot"
         return self.api_request("POST", path)
 
+    def get_vm_network_interfaces(self, node: str, vmid: int) -> Optional[Dict[str, Any]]:
+        # get_vm_network_interfaces 通过 QEMU Guest Agent 获取虚拟机内部网卡信息
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机的 ID
+        # @note 需要虚拟机内 qemu-guest-agent 已运行, 否则 PVE 返回错误
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """通过 QEMU Guest Agent 获取虚拟机内部网卡信息。"""
+        path = f"/nodes/{node}/qemu/{vmid}/agent/network-get-interfaces"
+        return self.api_request("GET", path)
+
+    def get_vm_config(self, node: str, vmid: int) -> Optional[Dict[str, Any]]:
+        # get_vm_config 获取虚拟机的当前配置
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机的 ID
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取虚拟机的当前配置。"""
+        path = f"/nodes/{node}/qemu/{vmid}/config"
+        return self.api_request("GET", path)
+
+    def convert_to_template(self, node: str, vmid: int) -> Optional[Dict[str, Any]]:
+        # convert_to_template 将已停止的虚拟机转换为模板
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机的 ID
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """将已停止的虚拟机转换为模板。"""
+        path = f"/nodes/{node}/qemu/{vmid}/template"
+        return self.api_request("POST", path)
+
+    def migrate_vm(self, node: str, vmid: int, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # migrate_vm 将虚拟机迁移到其他节点
+        # @param self: PveApiClient 实例
+        # @param node: 虚拟机当前所在节点
+        # @param vmid: 虚拟机的 ID
+        # @param payload: 迁移参数 (例如 target, online, with-local-disks, targetstorage)
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """将虚拟机迁移到其他节点。"""
+        path = f"/nodes/{node}/qemu/{vmid}/migrate"
+        return self.api_request("POST", path, data=payload)
+
+    def get_cluster_resources(self, resource_type: str) -> Optional[Dict[str, Any]]:
+        # get_cluster_resources 获取集群范围内的资源列表
+        # @param self: PveApiClient 实例
+        # @param resource_type: 资源类型, 例如 'vm'、'storage'、'node'
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取集群范围内的资源列表。"""
+        path = f"/cluster/resources?type={resource_type}"
+        return self.api_request("GET", path)
+
+    def get_node_storages(self, node: str) -> Optional[Dict[str, Any]]:
+        # get_node_storages 获取节点上的存储列表及容量信息
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取节点上的存储列表及容量信息。"""
+        path = f"/nodes/{node}/storage?enabled=1"
+        return self.api_request("GET", path)
+
+    def get_storage_definitions(self) -> Optional[Dict[str, Any]]:
+        # get_storage_definitions 获取集群的存储定义 (含存储类型与是否共享)
+        # @param self: PveApiClient 实例
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取集群的存储定义。"""
+        return self.api_request("GET", "/storage")
+
+    def get_next_vmid(self, vmid: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        # get_next_vmid 获取集群中下一个可用的 VMID
+        # @param self: PveApiClient 实例
+        # @param vmid: (可选) 检查指定的 VMID 是否可用, 可用时原样返回, 已被占用时返回错误
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取集群中下一个可用的 VMID。"""
+        path = "/cluster/nextid" if vmid is None else f"/cluster/nextid?vmid={vmid}"
+        return self.api_request("GET", path)
+
+    def get_task_status(self, node: str, upid: str) -> Optional[Dict[str, Any]]:
+        # get_task_status 获取异步任务的当前状态
+        # @param self: PveApiClient 实例
+        # @param node: 运行任务的 PVE 节点名称
+        # @param upid: 任务的唯一 ID (UPID)
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取异步任务的当前状态。"""
+        path = f"/nodes/{node}/tasks/{upid}/status"
+        return self.api_request("GET", path)
+
+    def get_node_rrddata(self, node: str, timeframe: str, cf: str = "AVERAGE") -> Optional[Dict[str, Any]]:
+        # get_node_rrddata 获取节点的 RRD 历史指标
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param timeframe: RRD 时间范围, 'hour'、'day'、'week'、'month' 或 'year'
+        # @param cf: 聚合函数, 'AVERAGE' 或 'MAX'
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取节点的 RRD 历史指标。"""
+        path = f"/nodes/{node}/rrddata?timeframe={timeframe}&cf={cf}"
+        return self.api_request("GET", path)
+
+    def get_vm_rrddata(self, node: str, vmid: int, timeframe: str, cf: str = "AVERAGE") -> Optional[Dict[str, Any]]:
+        # get_vm_rrddata 获取虚拟机的 RRD 历史指标
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param timeframe: RRD 时间范围, 'hour'、'day'、'week'、'month' 或 'year'
+        # @param cf: 聚合函数, 'AVERAGE' 或 'MAX'
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取虚拟机的 RRD 历史指标。"""
+        path = f"/nodes/{node}/qemu/{vmid}/rrddata?timeframe={timeframe}&cf={cf}"
+        return self.api_request("GET", path)
+
+    def create_vm_snapshot(self, node: str, vmid: int, snapname: str, description: str = "",
+                           vmstate: bool = False) -> Optional[Dict[str, Any]]:
+        # create_vm_snapshot 为虚拟机创建快照
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param snapname: 快照名称
+        # @param description: (可选) 快照描述
+        # @param vmstate: (可选) 是否同时保存内存状态, 仅对运行中的虚拟机有效
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """为虚拟机创建快照。"""
+        path = f"/nodes/{node}/qemu/{vmid}/snapshot"
+        payload: Dict[str, Any] = {"snapname": snapname}
+        if description:
+            payload["description"] = description
+        if vmstate:
+            payload["vmstate"] = 1
+        return self.api_request("POST", path, data=payload)
+
+    def list_vm_snapshots(self, node: str, vmid: int) -> Optional[Dict[str, Any]]:
+        # list_vm_snapshots 获取虚拟机的快照列表
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @note 列表中包含表示当前状态的 'current' 项
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """获取虚拟机的快照列表。"""
+        path = f"/nodes/{node}/qemu/{vmid}/snapshot"
+        return self.api_request("GET", path)
+
+    def rollback_vm_snapshot(self, node: str, vmid: int, snapname: str, start: bool = False) -> Optional[Dict[str, Any]]:
+        # rollback_vm_snapshot 将虚拟机回滚到指定快照
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param snapname: 快照名称
+        # @param start: (可选) 回滚完成后是否启动虚拟机
+        # @note 运行中的虚拟机会先被停止, 快照之后的磁盘与配置修改全部丢失
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """将虚拟机回滚到指定快照。"""
+        path = f"/nodes/{node}/qemu/{vmid}/snapshot/{snapname}/rollback"
+        return self.api_request("POST", path, data={"start": 1} if start else None)
+
+    def delete_vm_snapshot(self, node: str, vmid: int, snapname: str) -> Optional[Dict[str, Any]]:
+        # delete_vm_snapshot 删除虚拟机的指定快照
+        # @param self: PveApiClient 实例
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param snapname: 快照名称
+        # @return API 返回的 JSON 数据（字典类型）, 如果请求失败则返回包含 'error' 键的字典
+        """删除虚拟机的指定快照。"""
+        path = f"/nodes/{node}/qemu/{vmid}/snapshot/{snapname}"
+        return self.api_request("DELETE", path)
+
+    def wait_for_task(self, node: str, upid: str, timeout: int = 300, interval: float = 2) -> Dict[str, Any]:
+        # wait_for_task 阻塞等待异步任务结束
+        # @param self: PveApiClient 实例
+        # @param node: 运行任务的 PVE 节点名称
+        # @param upid: 任务的唯一 ID (UPID)
+        # @param timeout: (可选) 最大等待时间, 单位秒, 默认 300 秒
+        # @param interval: (可选) 轮询间隔, 单位秒, 默认 2 秒
+        # @note 超时返回最后一次查询到的任务状态, 调用方需检查 status 是否为 'stopped'
+        # @return 任务状态字典 (含 status/exitstatus), 查询失败则返回包含 'error' 键的字典
+        """阻塞等待异步任务结束，返回最后一次查询到的任务状态。"""
+        start_time = time.time()
+        task_status: Dict[str, Any] = {}
+
+        while time.time() - start_time < timeout:
+            time.sleep(interval)
+
+            response = self.get_task_status(node, upid)
+            if response is None or 'error' in response:
+                return {"error": response.get('error') if response else "result is None"}
+
+            task_status = response.get('data') or {}
+            if task_status.get('status') == 'stopped':
+                break
+
+        return task_status
+
+# --- 1.1 CLONE SCHEDULER (按存储限流的克隆调度器) ---
+
+VM_DISK_KEYS = re.compile(r'^(scsi|virtio|sata|ide|efidisk|tpmstate)\d+$')
+# 分配 VMID 时跳过已预留 ID 后最多尝试的候选数
+VMID_PROBE_LIMIT = 100
+
+
+def _parse_vm_disks(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # _parse_vm_disks 从虚拟机配置中解析磁盘及其所在存储
+    # @param config: /nodes/{node}/qemu/{vmid}/config 返回的 data 字典
+    # @note 跳过光驱与 cloud-init 盘, 它们不影响克隆的存储负载与链接克隆
+    # @return 磁盘列表, 每项包含 key、storage、format
+    """内部辅助函数：从虚拟机配置中解析磁盘及其所在存储。"""
+    disks = []
+    for key, value in (config or {}).items():
+        if not VM_DISK_KEYS.match(key) or not isinstance(value, str):
+            continue
+        if 'media=cdrom' in value or 'cloudinit' in value:
+            continue
+        volume = value.split(',')[0]
+        fmt_match = re.search(r'format=(\w+)', value)
+        fmt = fmt_match.group(1) if fmt_match else ('qcow2' if volume.endswith('.qcow2') else 'raw')
+        disks.append({"key": key, "storage": volume.split(':')[0], "format": fmt})
+    return disks
+
+
+class CloneScheduler:
+    """
+    CloneScheduler 克隆任务调度器
+    记录每个存储后端上正在进行的克隆数量并限制并发，超出的克隆请求排队等待；
+    完整克隆未指定目标存储时，按可用空间与当前负载自动选择。
+    排队中的克隆尚未在 PVE 中创建虚拟机，其 newid 由调度器预留，allocate_vmid 分配新 ID 时跳过。
+    """
+    def __init__(self, client: PveApiClient, max_per_storage: int = 2, poll_interval: float = 3):
+        # __init__ 初始化克隆调度器
+        # @param client: 已认证的 PveApiClient 实例
+        # @param max_per_storage: (可选) 每个存储后端允许同时进行的克隆数
+        # @param poll_interval: (可选) 轮询运行中克隆任务的间隔, 单位秒
+        # @return None
+        """初始化克隆调度器。"""
+        self.client = client
+        self.max_per_storage = max_per_storage
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._jobs: Dict[int, Dict[str, Any]] = {}
+        self._queue: List[int] = []
+        self._in_flight: Dict[str, int] = {}
+        self._reserved: set = set()
+        self._next_id = 1
+        self._storage_cache: Dict[str, Any] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        # start 启动后台调度线程
+        # @return None
+        """启动后台调度线程。"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="clone-scheduler", daemon=True)
+        self._thread.start()
+
+    def allocate_vmid(self) -> Dict[str, Any]:
+        # allocate_vmid 分配一个新的 VMID 并在调度器中预留
+        # @note /cluster/nextid 不预留 ID, 排队中的克隆在发起前 PVE 会重复返回同一个 ID;
+        #       跳过已预留的 ID 后, 用 /cluster/nextid?vmid= 确认候选 ID 在 PVE 中同样可用。
+        #       调用方须随后以该 ID 调用 submit, 或在放弃时调用 release_vmid; 克隆请求发出后预留自动释放
+        # @return 包含 vmid 的字典, 失败则返回包含 'error' 键的字典
+        """分配一个新的 VMID 并在调度器中预留。"""
+        result = self.client.get_next_vmid()
+        if not result or 'error' in result:
+            return {"error": f"Failed to allocate VMID: {result}"}
+
+        candidate = int(result['data'])
+        confirmed = True
+        for _ in range(VMID_PROBE_LIMIT):
+            if not confirmed:
+                check = self.client.get_next_vmid(candidate)
+                if not check or 'error' in check:
+                    candidate += 1
+                    continue
+            with self._cond:
+                if candidate not in self._reserved:
+                    self._reserved.add(candidate)
+                    return {"vmid": candidate}
+            candidate += 1
+            confirmed = False
+        return {"error": f"Failed to allocate VMID: no free VMID within {VMID_PROBE_LIMIT} IDs after the reserved ones."}
+
+    def release_vmid(self, vmid: int) -> None:
+        # release_vmid 释放 allocate_vmid 预留但未提交的 VMID
+        # @param vmid: 虚拟机 ID
+        # @return None
+        with self._cond:
+            self._reserved.discard(vmid)
+
+    def submit(self, node: str, source_vmid: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+        # submit 提交一个克隆请求到队列
+        # @param node: 源虚拟机 (模板) 所在节点
+        # @param source_vmid: 源虚拟机 (模板) 的 ID
+        # @param payload: 克隆参数 (newid, name, full, 可选 storage/target)
+        # @note 请求立即返回, 由后台线程在存储有空闲名额时发起克隆; 调用方指定的 newid 同样预留到克隆发起为止
+        # @return 任务字典的副本, 包含调度任务 id 与状态 'queued'
+        """提交一个克隆请求到队列。"""
+        with self._cond:
+            if payload.get('newid') is not None:
+                self._reserved.add(int(payload['newid']))
+            job_id = self._next_id
+            self._next_id += 1
+            self._jobs[job_id] = {
+                "id": job_id,
+                "node": node,
+                "source_vmid": source_vmid,
+                "newid": payload.get('newid'),
+                "payload": dict(payload),
+                "storage_key": None,
+                "state": "queued",
+                "upid": None,
+                "error": None,
+                "queued_at": time.time(),
+            }
+            self._queue.append(job_id)
+            self._cond.notify_all()
+            return dict(self._jobs[job_id])
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        # get 查询调度任务的当前状态
+        # @param job_id: submit 返回的调度任务 id
+        # @return 任务字典的副本, 不存在时返回 None
+        """查询调度任务的当前状态。"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: int, until: str = "started", timeout: float = 600) -> Dict[str, Any]:
+        # wait 阻塞等待调度任务到达指定阶段
+        # @param job_id: submit 返回的调度任务 id
+        # @param until: (可选) 'started' 等待克隆已发起 (拿到 UPID), 'finished' 等待克隆结束
+        # @param timeout: (可选) 最大等待时间, 单位秒
+        # @note 任务记录已被清理 (只保留最近 100 个已结束任务) 时返回 state 为 'unknown' 的字典
+        # @return 任务字典的副本; 超时返回时 state 仍为 'queued' 或 'running'
+        """阻塞等待调度任务到达指定阶段。"""
+        done_states = {"done", "failed"} if until == "finished" else {"running", "done", "failed"}
+        deadline = time.time() + timeout
+        with self._cond:
+            while job_id in self._jobs and self._jobs[job_id]['state'] not in done_states:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            job = self._jobs.get(job_id)
+            if job is None:
+                return {"id": job_id, "state": "unknown", "upid": None,
+                        "error": f"Clone job {job_id} is no longer tracked; check the PVE task log."}
+            return dict(job)
+
+    def _run(self) -> None:
+        # _run 后台线程主循环: 发起排队中的克隆并跟踪运行中的克隆
+        # @return None
+        while True:
+            try:
+                self._poll_running()
+                self._dispatch()
+            except Exception as e:
+                print(f"ERROR: Clone scheduler loop failed: {e}")
+            with self._cond:
+                self._cond.wait(self.poll_interval)
+
+    def _storage_key(self, node: str, storage: str, shared: bool) -> str:
+        # _storage_key 返回存储后端的唯一标识: 共享存储按存储 ID, 本地存储按 '节点/存储 ID'
+        return storage if shared else f"{node}/{storage}"
+
+    def _node_storages(self, node: str) -> List[Dict[str, Any]]:
+        # _node_storages 获取节点上可存放虚拟机磁盘且处于活动状态的存储
+        # @param node: PVE 节点名称
+        # @note 结果缓存一个轮询周期, 排队任务较多时不会重复查询
+        # @return 存储列表, 查询失败时返回空列表
+        cached = self._storage_cache.get(node)
+        if cached and time.time() - cached[0] < self.poll_interval:
+            return cached[1]
+        result = self.client.get_node_storages(node)
+        if not result or 'error' in result:
+            return []
+        storages = [s for s in result.get('data', []) if s.get('active') and 'images' in str(s.get('content', ''))]
+        self._storage_cache[node] = (time.time(), storages)
+        return storages
+
+    def select_storage(self, node: str) -> Optional[Dict[str, Any]]:
+        # select_storage 为完整克隆选择目标存储
+        # @param node: 克隆目标节点
+        # @note 得分 = 可用空间 / (1 + 正在进行的克隆数), 已达到并发上限的存储不参与选择
+        # @return 包含 storage 与 key 的字典, 没有可用存储时返回 None
+        """为完整克隆选择目标存储。"""
+        best, best_score = None, -1.0
+        storages = self._node_storages(node)
+        with self._cond:
+            in_flight = dict(self._in_flight)
+        for s in storages:
+            key = self._storage_key(node, s['storage'], bool(s.get('shared')))
+            load = in_flight.get(key, 0)
+            if load >= self.max_per_storage:
+                continue
+            score = s.get('avail', 0) / (1 + load)
+            if score > best_score:
+                best, best_score = {"storage": s['storage'], "key": key}, score
+        return best
+
+    def _source_storage_key(self, node: str, source_vmid: int) -> str:
+        # _source_storage_key 确定未显式指定存储的克隆会落在哪个存储后端 (即源磁盘所在存储)
+        # @param node: 源虚拟机所在节点
+        # @param source_vmid: 源虚拟机 ID
+        # @return 存储后端标识, 无法确定时退化为 '节点/unknown'
+        result = self.client.get_vm_config(node, source_vmid)
+        disks = _parse_vm_disks((result or {}).get('data')) if result and 'error' not in result else []
+        if not disks:
+            return f"{node}/unknown"
+        storage = disks[0]['storage']
+        shared = {s['storage']: bool(s.get('shared')) for s in self._node_storages(node)}
+        return self._storage_key(node, storage, shared.get(storage, False))
+
+    def _dispatch(self) -> None:
+        # _dispatch 按先进先出顺序发起存储仍有空闲名额的克隆
+        # @note 某个存储已满时, 排在后面但使用其他存储的请求仍可先行发起
+        # @return None
+        with self._cond:
+            queued = list(self._queue)
+
+        for job_id in queued:
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None or job['state'] != "queued":
+                    continue
+                payload = dict(job['payload'])
+                storage_key = job['storage_key']
+            is_full = bool(payload.get('full', 1))
+
+            # 存储查询在锁外进行, 只在写回任务字段与检查运行计数时持有锁
+            if payload.get('storage') or not is_full or payload.get('target'):
+                if storage_key is None:
+                    if payload.get('storage'):
+                        shared = {s['storage']: bool(s.get('shared')) for s in self._node_storages(job['node'])}
+                        storage_key = self._storage_key(job['node'], payload['storage'], shared.get(payload['storage'], False))
+                    else:
+                        storage_key = self._source_storage_key(job['node'], job['source_vmid'])
+                with self._cond:
+                    job['storage_key'] = storage_key
+                    if self._in_flight.get(storage_key, 0) >= self.max_per_storage:
+                        continue
+            else:
+                selected = self.select_storage(job['node'])
+                if selected is None:
+                    continue
+                with self._cond:
+                    job['payload']['storage'] = selected['storage']
+                    job['storage_key'] = selected['key']
+
+            self._start(job)
+
+    def _start(self, job: Dict[str, Any]) -> None:
+        # _start 向 PVE 发起克隆并登记到对应存储的运行计数
+        # @param job: 调度任务字典
+        # @return None
+        with self._cond:
+            payload = dict(job['payload'])
+        result = self.client.clone_vm(job['node'], job['source_vmid'], payload)
+        with self._cond:
+            self._queue.remove(job['id'])
+            # 克隆请求已发出: 成功时 PVE 中已存在该虚拟机, 失败时该 ID 可重新分配
+            if job['newid'] is not None:
+                self._reserved.discard(int(job['newid']))
+            if not result or 'error' in result:
+                job['state'] = "failed"
+                job['error'] = result.get('error') if result else "result is None"
+            else:
+                job['state'] = "running"
+                job['upid'] = result.get('data')
+                job['started_at'] = time.time()
+                self._in_flight[job['storage_key']] = self._in_flight.get(job['storage_key'], 0) + 1
+            self._cond.notify_all()
+
+    def _poll_running(self) -> None:
+        # _poll_running 检查运行中的克隆任务是否结束, 结束后释放存储名额
+        # @return None
+        with self._cond:
+            running = [job for job in self._jobs.values() if job['state'] == "running"]
+
+        for job in running:
+            response = self.client.get_task_status(job['node'], job['upid'])
+            task = (response or {}).get('data') or {}
+            if task.get('status') != 'stopped':
+                continue
+            with self._cond:
+                job['state'] = "done" if task.get('exitstatus') == 'OK' else "failed"
+                if job['state'] == "failed":
+                    job['error'] = task.get('exitstatus')
+                job['finished_at'] = time.time()
+                self._in_flight[job['storage_key']] = max(0, self._in_flight.get(job['storage_key'], 1) - 1)
+                self._cond.notify_all()
+
+        with self._cond:
+            finished = [j['id'] for j in self._jobs.values() if j['state'] in ("done", "failed")]
+            for job_id in sorted(finished)[:-100]:
+                del self._jobs[job_id]
+
+    def status(self) -> Dict[str, Any]:
+        # status 汇总调度器状态
+        # @note 只保留最近结束的 20 个任务
+        # @return 包含各存储运行数、排队任务与最近任务的字典
+        """汇总调度器状态。"""
+        with self._cond:
+            fields = ("id", "node", "source_vmid", "newid", "storage_key", "state", "upid", "error")
+            jobs = sorted(self._jobs.values(), key=lambda j: j['id'])
+            return {
+                "max_per_storage": self.max_per_storage,
+                "in_flight": {k: v for k, v in self._in_flight.items() if v},
+                "queued": [{f: j.get(f) for f in fields} for j in jobs if j['state'] == "queued"],
+                "running": [{f: j.get(f) for f in fields} for j in jobs if j['state'] == "running"],
+                "recent": [{f: j.get(f) for f in fields} for j in jobs if j['state'] in ("done", "failed")][-20:],
+            }
+
+
+# --- 1.2 TEMPLATE MANAGER (各节点模板清单与复制) ---
+
+# 支持链接克隆的存储类型; 目录类存储仅在磁盘为 qcow2 格式时支持
+LINKED_CLONE_STORAGE_TYPES = {'lvmthin', 'zfspool', 'rbd'}
+LINKED_CLONE_QCOW2_STORAGE_TYPES = {'dir', 'nfs', 'cifs', 'glusterfs', 'cephfs'}
+
+
+class TemplateManager:
+    """
+    TemplateManager 各 PVE 节点的模板管理器
+    按 '[节点名]-Template' 命名规则盘点每个节点的模板，为缺少模板的节点复制模板，
+    并根据模板磁盘所在存储判断是否可以使用链接克隆。
+    """
+    def __init__(self, client: PveApiClient, scheduler: CloneScheduler,
+                 prefer_linked: bool = False, cache_ttl: int = 300):
+        # __init__ 初始化模板管理器
+        # @param client: 已认证的 PveApiClient 实例
+        # @param scheduler: 用于发起模板复制克隆的 CloneScheduler 实例
+        # @param prefer_linked: (可选) 存储支持时是否优先使用链接克隆, 默认 False
+        # @param cache_ttl: (可选) 模板解析结果的缓存时间, 单位秒
+        # @return None
+        """初始化模板管理器。"""
+        self.client = client
+        self.scheduler = scheduler
+        self.prefer_linked = prefer_linked
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._resolved: Dict[str, Dict[str, Any]] = {}
+        self._storage_types: Dict[str, str] = {}
+        self._storage_shared: Dict[str, bool] = {}
+
+    @staticmethod
+    def template_name(node: str) -> str:
+        # template_name 返回节点模板的规范名称
+        # @param node: PVE 节点名称
+        # @return 模板名称, 例如 'pve-1-Template'
+        return f"{node}-Template"
+
+    def invalidate(self, node: Optional[str] = None) -> None:
+        # invalidate 清除模板解析缓存
+        # @param node: (可选) 只清除指定节点的缓存, 为空时清除全部
+        # @return None
+        """清除模板解析缓存。"""
+        with self._lock:
+            if node is None:
+                self._resolved.clear()
+                self._storage_types.clear()
+                self._storage_shared.clear()
+            else:
+                self._resolved.pop(node, None)
+
+    def _load_storage_types(self) -> Dict[str, str]:
+        # _load_storage_types 读取集群存储定义, 建立存储 ID 到类型的映射 (同时记录是否为共享存储)
+        # @return 形如 {'local-lvm': 'lvmthin'} 的字典
+        with self._lock:
+            if self._storage_types:
+                return self._storage_types
+        result = self.client.get_storage_definitions()
+        if not result or 'error' in result:
+            return {}
+        types = {s.get('storage'): s.get('type') for s in result.get('data', [])}
+        shared = {s.get('storage'): bool(s.get('shared')) for s in result.get('data', [])}
+        with self._lock:
+            self._storage_types = types
+            self._storage_shared = shared
+        return types
+
+    def _on_shared_storage(self, disks: List[Dict[str, Any]]) -> bool:
+        # _on_shared_storage 判断模板的所有磁盘是否都位于共享存储 (决定能否直接跨节点克隆)
+        # @param disks: _template_disks 返回的磁盘列表
+        # @return 全部位于共享存储返回 True, 否则 False
+        self._load_storage_types()
+        with self._lock:
+            return bool(disks) and all(self._storage_shared.get(d['storage']) for d in disks)
+
+    def _template_disks(self, node: str, vmid: int) -> List[Dict[str, Any]]:
+        # _template_disks 解析模板配置中的磁盘及其所在存储
+        # @param node: PVE 节点名称
+        # @param vmid: 模板 VMID
+        # @return 磁盘列表, 每项包含 key、storage、format
+        result = self.client.get_vm_config(node, vmid)
+        if not result or 'error' in result:
+            return []
+        return _parse_vm_disks(result.get('data'))
+
+    def _supports_linked_clone(self, disks: List[Dict[str, Any]]) -> bool:
+        # _supports_linked_clone 判断模板的所有磁盘是否都位于支持链接克隆的存储上
+        # @param disks: _template_disks 返回的磁盘列表
+        # @return 全部支持返回 True, 否则 False
+        if not disks:
+            return False
+        types = self._load_storage_types()
+        for disk in disks:
+            storage_type = types.get(disk['storage'])
+            if storage_type in LINKED_CLONE_STORAGE_TYPES:
+                continue
+            if storage_type in LINKED_CLONE_QCOW2_STORAGE_TYPES and disk['format'] == 'qcow2':
+                continue
+            return False
+        return True
+
+    def inventory(self) -> Dict[str, Any]:
+        # inventory 盘点集群中每个在线节点的模板
+        # @note 通过一次 /cluster/resources 调用获取全部虚拟机, 避免逐节点查询
+        # @return 包含 templates (每节点模板详情) 与 missing (缺少模板的节点) 的字典
+        """盘点集群中每个在线节点的模板。"""
+        nodes_result = self.client.get_node_list()
+        if not nodes_result or 'error' in nodes_result:
+            return {"error": f"Failed to list nodes: {nodes_result}"}
+        nodes = [n.get('node') for n in nodes_result.get('data', []) if n.get('status') == 'online']
+
+        resources = self.client.get_cluster_resources("vm")
+        if not resources or 'error' in resources:
+            return {"error": f"Failed to list cluster resources: {resources}"}
+
+        found: Dict[str, int] = {}
+        for vm in resources.get('data', []):
+            node = vm.get('node')
+            if vm.get('template') and vm.get('name') == self.template_name(node):
+                found[node] = int(vm['vmid'])
+
+        templates, missing = [], []
+        for node in sorted(nodes):
+            if node not in found:
+                missing.append(node)
+                continue
+            disks = self._template_disks(node, found[node])
+            templates.append({
+                "node": node,
+                "vmid": found[node],
+                "name": self.template_name(node),
+                "disks": disks,
+                "linked_clone_supported": self._supports_linked_clone(disks),
+            })
+        return {"templates": templates, "missing": missing}
+
+    def resolve(self, node: str) -> Optional[Dict[str, Any]]:
+        # resolve 解析节点本地的模板及推荐的克隆方式
+        # @param node: PVE 节点名称
+        # @note 结果会缓存 cache_ttl 秒, 频繁克隆时不会重复查询模板配置
+        # @return 包含 vmid 与 linked (是否使用链接克隆) 的字典, 节点没有模板时返回 None
+        """解析节点本地的模板及推荐的克隆方式。"""
+        with self._lock:
+            cached = self._resolved.get(node)
+            if cached and time.time() - cached['resolved_at'] < self.cache_ttl:
+                return cached
+
+        result = self.client.get_vm_list_by_node(node)
+        if not result or 'error' in result:
+            return None
+        vmid = None
+        for vm in result.get('data', []):
+            if vm.get('template') and vm.get('name') == self.template_name(node):
+                vmid = int(vm['vmid'])
+                break
+        if vmid is None:
+            return None
+
+        disks = self._template_disks(node, vmid)
+        resolved = {
+            "vmid": vmid,
+            "disks": disks,
+            "linked": self.prefer_linked and self._supports_linked_clone(disks),
+            "resolved_at": time.time(),
+        }
+        with self._lock:
+            self._resolved[node] = resolved
+        return resolved
+
+    def replicate(self, target_node: str, source_node: str, source_vmid: int,
+                  storage: Optional[str] = None, timeout: int = 1800) -> Dict[str, Any]:
+        # replicate 将源节点的模板完整克隆到目标节点并转换为模板
+        # @param target_node: 缺少模板的目标节点
+        # @param source_node: 源模板所在节点
+        # @param source_vmid: 源模板 VMID
+        # @param storage: (可选) 目标节点上的存储 ID, 为空时沿用源磁盘存储
+        # @param timeout: (可选) 等待克隆与迁移完成的最大时间, 单位秒
+        # @note PVE 仅允许源模板位于共享存储时跨节点克隆 (target 参数); 位于本地存储时
+        #       先在源节点完整克隆为普通虚拟机, 离线迁移 (含本地磁盘) 到目标节点后再转换为模板
+        # @return 包含新模板 vmid 的字典, 失败则返回包含 'error' 键的字典
+        """将源节点的模板完整克隆到目标节点并转换为模板。"""
+        allocated = self.scheduler.allocate_vmid()
+        if 'error' in allocated:
+            return allocated
+        new_vmid = allocated['vmid']
+        shared = self._on_shared_storage(self._template_disks(source_node, source_vmid))
+
+        payload = {
+            'newid': new_vmid,
+            'name': self.template_name(target_node),
+            'full': 1,
+        }
+        if shared:
+            payload['target'] = target_node
+            if storage:
+                payload['storage'] = storage
+
+        job = self.scheduler.submit(source_node, source_vmid, payload)
+        job = self.scheduler.wait(job['id'], until="finished", timeout=timeout)
+        if job['state'] != "done":
+            return {"error": f"Clone to node {target_node} did not finish successfully (state={job['state']}, upid={job['upid']}): {job['error']}"}
+
+        if not shared:
+            migrate = {'target': target_node, 'online': 0, 'with-local-disks': 1}
+            if storage:
+                migrate['targetstorage'] = storage
+            result = self.client.migrate_vm(source_node, new_vmid, migrate)
+            task = self.client.wait_for_task(source_node, result.get('data'), timeout=timeout) \
+                if result and 'error' not in result else {"error": (result or {}).get('error', 'result is None')}
+            if task.get('exitstatus') != 'OK':
+                # 迁移失败时删除源节点上的中间虚拟机, 避免留下同名的普通虚拟机
+                self.client.delete_vm(source_node, new_vmid)
+                return {"error": f"VM {new_vmid} cloned on {source_node} but migration to {target_node} failed: {task.get('error') or task.get('exitstatus') or 'timeout'}"}
+
+        result = self.client.convert_to_template(target_node, new_vmid)
+        if not result or 'error' in result:
+            return {"error": f"VM {new_vmid} cloned but conversion to template failed: {result}"}
+
+        self.invalidate(target_node)
+        return {"node": target_node, "vmid": new_vmid, "source": f"{source_node}/{source_vmid}"}
+
+    def sync(self, source_node: Optional[str] = None, nodes: Optional[List[str]] = None,
+             refresh: bool = False, storage: Optional[str] = None) -> List[Dict[str, Any]]:
+        # sync 为缺少模板的节点复制模板, 或强制刷新已有模板
+        # @param source_node: (可选) 源模板所在节点, 为空时取第一个拥有模板的节点
+        # @param nodes: (可选) 需要处理的节点列表, 为空时处理所有在线节点
+        # @param refresh: (可选) 为 True 时重新复制模板, 新模板就绪后再删除目标节点上的旧模板
+        # @param storage: (可选) 目标节点上的存储 ID
+        # @note 逐节点顺序执行, 避免多个完整克隆同时占满存储带宽; 复制失败时旧模板保持不变
+        # @return 每个节点的处理结果列表
+        """为缺少模板的节点复制模板，或强制刷新已有模板。"""
+        inventory = self.inventory()
+        if 'error' in inventory:
+            return [inventory]
+
+        by_node = {t['node']: t for t in inventory['templates']}
+        if source_node is None:
+            if not by_node:
+                return [{"error": "No node has a template to replicate from."}]
+            source_node = sorted(by_node)[0]
+        if source_node not in by_node:
+            return [{"error": f"Source node {source_node} has no template '{self.template_name(source_node)}'."}]
+        source_vmid = by_node[source_node]['vmid']
+
+        targets = nodes or (list(by_node) + inventory['missing'])
+        results = []
+        for node in sorted(set(targets)):
+            if node == source_node:
+                continue
+            if node in by_node and not refresh:
+                results.append({"node": node, "vmid": by_node[node]['vmid'], "action": "skipped (template present)"})
+                continue
+            outcome = self.replicate(node, source_node, source_vmid, storage)
+            outcome.setdefault("node", node)
+            outcome["action"] = "refreshed" if node in by_node else "replicated"
+            if node in by_node and 'error' not in outcome:
+                outcome.update(self._retire_template(node, by_node[node]['vmid']))
+            results.append(outcome)
+        return results
+
+    def _retire_template(self, node: str, old_vmid: int) -> Dict[str, Any]:
+        # _retire_template 新模板就绪后删除节点上的旧模板
+        # @param node: PVE 节点名称
+        # @param old_vmid: 旧模板 VMID
+        # @note 删除失败 (例如仍有链接克隆依赖) 时将旧模板改名, 保证按名称只能解析到新模板
+        # @return 包含 old_vmid 与处理结果 (old_template) 的字典
+        deleted = self.client.delete_vm(node, old_vmid)
+        if deleted and 'error' not in deleted:
+            task = self.client.wait_for_task(node, deleted.get('data'))
+            if task.get('exitstatus') == 'OK':
+                self.invalidate(node)
+                return {"old_vmid": old_vmid, "old_template": "deleted"}
+            error = task.get('error') or task.get('exitstatus') or "timeout"
+        else:
+            error = (deleted or {}).get('error', 'result is None')
+
+        renamed = self.client.update_vm_config(node, old_vmid, {'name': f"{self.template_name(node)}-old-{old_vmid}"})
+        self.invalidate(node)
+        state = "renamed" if renamed and 'error' not in renamed else "left in place (rename failed)"
+        return {"old_vmid": old_vmid, "old_template": f"{state}; delete failed (linked clones may still use it): {error}"}
+
+
+# --- 1.3 WARM POOL MANAGER (k3s 工作节点预热池) ---
+
+class WarmPoolManager:
+    """
+    WarmPoolManager k3s 工作节点预热池
+    为每个 PVE 节点预先从本节点模板克隆若干台处于停止状态的虚拟机，并在后台线程中持续补充。
+    扩容时只需设置 ipconfig0/cicustom、重命名并启动，省去克隆耗时。
+    """
+    def __init__(self, client: PveApiClient, templates: TemplateManager, scheduler: CloneScheduler,
+                 config_cache: 'VmConfigCache', size: int, name_prefix: str = "warm", interval: int = 60,
+                 nodes: Optional[List[str]] = None):
+        # __init__ 初始化预热池管理器
+        # @param client: 已认证的 PveApiClient 实例
+        # @param templates: 用于解析节点本地模板的 TemplateManager 实例
+        # @param scheduler: 用于排队发起克隆的 CloneScheduler 实例
+        # @param config_cache: 领取时写入配置使用的 VmConfigCache 实例
+        # @param size: 每个 PVE 节点需要保持的预热虚拟机数量
+        # @param name_prefix: (可选) 预热虚拟机名称前缀, 完整名称为 '[前缀]-[节点名]-[VMID]'
+        # @param interval: (可选) 后台补充检查的间隔, 单位秒
+        # @param nodes: (可选) 参与预热的节点列表, 为空时使用所有在线节点
+        # @return None
+        """初始化预热池管理器。"""
+        self.client = client
+        self.templates = templates
+        self.scheduler = scheduler
+        self.config_cache = config_cache
+        self.size = size
+        self.name_prefix = name_prefix
+        self.interval = interval
+        self.nodes = nodes or []
+        self._lock = threading.Lock()
+        self._claimed: set = set()
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._last_error: Dict[str, str] = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        # start 启动后台补充线程
+        # @note 线程为守护线程, 随进程退出
+        # @return None
+        """启动后台补充线程。"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="warm-pool", daemon=True)
+        self._thread.start()
+        print(f"INFO: Warm pool started (size={self.size} per node, prefix='{self.name_prefix}').")
+
+    def stop(self) -> None:
+        # stop 停止后台补充线程
+        # @return None
+        """停止后台补充线程。"""
+        self._stopped.set()
+        self._wakeup.set()
+
+    def trigger(self) -> None:
+        # trigger 立即唤醒后台线程执行一次补充
+        # @return None
+        """立即唤醒后台线程执行一次补充。"""
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        # _run 后台线程主循环: 周期性补充各节点的预热虚拟机
+        # @note 单次补充失败只记录错误, 不会终止线程
+        # @return None
+        while not self._stopped.is_set():
+            try:
+                self.replenish_once()
+            except Exception as e:
+                print(f"ERROR: Warm pool replenish failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _target_nodes(self) -> List[str]:
+        # _target_nodes 获取参与预热的节点列表
+        # @return 节点名称列表, 查询失败时返回空列表
+        if self.nodes:
+            return list(self.nodes)
+        result = self.client.get_node_list()
+        if not result or 'error' in result:
+            return []
+        return [n.get('node') for n in result.get('data', []) if n.get('status') == 'online']
+
+    def _pool_prefix(self, node: str) -> str:
+        # _pool_prefix 返回节点预热虚拟机的名称前缀, 例如 'warm-pve-1-'
+        return f"{self.name_prefix}-{node}-"
+
+    def list_ready(self, node: str) -> List[Dict[str, Any]]:
+        # list_ready 列出节点上可被领取的预热虚拟机
+        # @param node: PVE 节点名称
+        # @note 可领取的条件: 名称匹配前缀、已停止、无锁 (克隆中的虚拟机带 'clone' 锁)、未被领取;
+        #       PVE 查询不持有 self._lock, 只在过滤已领取的虚拟机时短暂加锁
+        # @return 按 VMID 升序排列的虚拟机列表
+        """列出节点上可被领取的预热虚拟机。"""
+        result = self.client.get_vm_list_by_node(node)
+        if not result or 'error' in result:
+            return []
+        prefix = self._pool_prefix(node)
+        stopped = [
+            vm for vm in result.get('data', [])
+            if str(vm.get('name', '')).startswith(prefix)
+            and not vm.get('template')
+            and vm.get('status') == 'stopped'
+            and not vm.get('lock')
+        ]
+        with self._lock:
+            ready = [vm for vm in stopped if int(vm['vmid']) not in self._claimed]
+        return sorted(ready, key=lambda vm: int(vm['vmid']))
+
+    def _reap_pending(self, node: str) -> None:
+        # _reap_pending 清理节点上已结束的克隆任务
+        # @param node: PVE 节点名称
+        # @return None
+        with self._lock:
+            still_running = []
+            for pending in self._pending.get(node, []):
+                job = self.scheduler.get(pending['job_id'])
+                if job is None or job['state'] in ("done", "failed"):
+                    if job and job['state'] == "failed":
+                        self._last_error[node] = f"Clone of VM {pending['vmid']} failed: {job['error']}"
+                    continue
+                still_running.append(pending)
+            self._pending[node] = still_running
+
+    def _set_error(self, node: str, message: Optional[str]) -> None:
+        # _set_error 记录或清除节点的最近错误
+        # @param node: PVE 节点名称
+        # @param message: 错误信息, 为 None 时清除
+        # @return None
+        with self._lock:
+            if message is None:
+                self._last_error.pop(node, None)
+            else:
+                self._last_error[node] = message
+
+    def replenish_once(self) -> None:
+        # replenish_once 为每个节点补充预热虚拟机到目标数量
+        # @note 每个节点同一时间最多只有一个克隆任务, 避免克隆占满共享存储带宽
+        # @return None
+        """为每个节点补充预热虚拟机到目标数量。"""
+        for node in self._target_nodes():
+            self._reap_pending(node)
+            with self._lock:
+                if self._pending.get(node):
+                    continue
+            if len(self.list_ready(node)) >= self.size:
+                continue
+            self._clone_one(node)
+
+    def _clone_one(self, node: str) -> None:
+        # _clone_one 从节点本地模板克隆一台预热虚拟机
+        # @param node: PVE 节点名称
+        # @note 存储支持时使用链接克隆, 否则完整克隆
+        # @return None
+        template = self.templates.resolve(node)
+        if template is None:
+            self._set_error(node, f"Template '{TemplateManager.template_name(node)}' not found.")
+            return
+        template_vmid = template['vmid']
+
+        allocated = self.scheduler.allocate_vmid()
+        if 'error' in allocated:
+            self._set_error(node, allocated['error'])
+            return
+        new_vmid = allocated['vmid']
+
+        payload = {
+            'newid': new_vmid,
+            'name': f"{self._pool_prefix(node)}{new_vmid}",
+            'full': 0 if template['linked'] else 1,
+        }
+        job = self.scheduler.submit(node, template_vmid, payload)
+        with self._lock:
+            self._pending.setdefault(node, []).append({'vmid': new_vmid, 'job_id': job['id']})
+            self._last_error.pop(node, None)
+        print(f"INFO: Warm pool queued clone of VM {new_vmid} on node {node} from template {template_vmid}.")
+
+    def claim(self, node: str, new_name: str, ipconfig0: str, cicustom: str, start: bool = True) -> Dict[str, Any]:
+        # claim 从预热池领取一台虚拟机并完成个性化配置
+        # @param node: PVE 节点名称
+        # @param new_name: 虚拟机的新名称
+        # @param ipconfig0: cloud-init 网络配置, 例如 'ip=dhcp'
+        # @param cicustom: cloud-init 自定义片段, 例如 'user=cloud-init:snippets/work_node.yaml'
+        # @param start: (可选) 配置完成后是否立即启动, 默认 True
+        # @note 配置经 VmConfigCache 只写入变化的键并携带 digest; 配置失败时虚拟机会归还到预热池; 领取后立即唤醒后台线程补充
+        # @return 包含 vmid 与启动任务 UPID 的字典, 失败则返回包含 'error' 键的字典
+        """从预热池领取一台虚拟机并完成个性化配置。"""
+        ready = self.list_ready(node)
+        with self._lock:
+            # 查询期间其他调用可能已领取部分虚拟机, 加锁后重新过滤再占用
+            vmid = next((int(vm['vmid']) for vm in ready if int(vm['vmid']) not in self._claimed), None)
+            if vmid is None:
+                return {"error": f"No warm VM available on node {node}."}
+            self._claimed.add(vmid)
+
+        try:
+            updates = {'name': new_name, 'ipconfig0': ipconfig0, 'cicustom': cicustom}
+            applied = self.config_cache.apply(node, vmid, updates)
+            error = applied.get('error') or (applied.get('result') or {}).get('error')
+            if error:
+                return {"error": f"Failed to configure warm VM {vmid}: {error}"}
+
+            claimed = {"vmid": vmid, "name": new_name, "node": node}
+            if start:
+                result = self.client.start_vm(node, vmid)
+                if not result or 'error' in result:
+                    claimed["error"] = f"VM {vmid} configured but failed to start: {result}"
+                else:
+                    claimed["upid"] = result.get('data')
+            return claimed
+        finally:
+            # 重命名成功后该虚拟机已不再匹配预热前缀; 失败时归还到池中
+            with self._lock:
+                self._claimed.discard(vmid)
+            self.trigger()
+
+    def status(self) -> List[Dict[str, Any]]:
+        # status 汇总各节点的预热池状态
+        # @return 每个节点的可领取数量、克隆中数量与最近错误
+        """汇总各节点的预热池状态。"""
+        summary = []
+        for node in self._target_nodes():
+            ready = self.list_ready(node)
+            with self._lock:
+                cloning = [job['vmid'] for job in self._pending.get(node, [])]
+                last_error = self._last_error.get(node)
+            summary.append({
+                "node": node,
+                "target_size": self.size,
+                "ready": [int(vm['vmid']) for vm in ready],
+                "cloning": cloning,
+                "last_error": last_error,
+            })
+        return summary
+
+
+# --- 1.4 SNIPPET RENDERER (按虚拟机渲染 cloud-init 片段) ---
+
+SNIPPET_ROLE_TEMPLATES = {'control_node': 'control_node.yaml', 'work_node': 'work_node.yaml'}
+SNIPPET_ROLE_ALIASES = {
+    'master': 'control_node', 'control': 'control_node', 'control-node': 'control_node', 'control_node': 'control_node',
+    'work': 'work_node', 'worker': 'work_node', 'work-node': 'work_node', 'work_node': 'work_node',
+}
+SNIPPET_MANAGER_IP_LINE = re.compile(r'^(\s*)export MANAGER_IP=.*$', re.MULTILINE)
+# 缓存的加入票据剩余有效期低于该值 (秒) 时重新签发, 留出虚拟机启动并执行引导脚本的时间
+SNIPPET_TICKET_MIN_TTL = 900
+# 渲染出的片段文件名 k3s-{角色}-{VMID}-{内容哈希}.yaml, 用于按虚拟机回收
+SNIPPET_FILE_PATTERN = re.compile(r'^k3s-(?:control_node|work_node)-(\d+)-[0-9a-f]{16}\.yaml$')
+# 片段文件写入后至少保留该时间 (秒) 才会被回收, 避免删除刚渲染、尚未写入虚拟机配置的片段
+SNIPPET_GC_MIN_AGE = 600
+
+
+class SnippetRenderer:
+    """
+    SnippetRenderer cloud-init 片段渲染器
+    以 snippets 目录中的 control_node.yaml/work_node.yaml 为模板，注入每台虚拟机的变量
+    (管理机 IP、镜像仓库、引导服务地址与加入票据、节点 IP)，按 VMID 与内容哈希命名写入 PVE 的 snippets 存储。
+    变量未变化时不会重复渲染；被替换的片段与已删除虚拟机的片段由 discard_superseded/collect_garbage 回收。
+    """
+    def __init__(self, template_dir: str, output_dir: str, storage: str, manager_ip: Optional[str],
+                 registry_endpoint: Optional[str], bootstrap_url: Optional[str], bootstrap_admin_url: Optional[str],
+                 bootstrap_token: Optional[str]):
+        # __init__ 初始化片段渲染器
+        # @param template_dir: 片段模板目录 (deploy/k3s_deployment/snippets)
+        # @param output_dir: 渲染结果写入的目录, 即 PVE 存储 storage 的 snippets 子目录
+        # @param storage: cicustom 中引用的 PVE 存储 ID, 例如 'cloud-init'
+        # @param manager_ip: 管理机 IP, 替换模板中的 MANAGER_IP
+        # @param registry_endpoint: (可选) 私有镜像仓库地址
+        # @param bootstrap_url: (可选) 虚拟机访问的引导服务地址, 设置后节点通过 HTTP 引导
+        # @param bootstrap_admin_url: (可选) 本服务签发票据使用的引导服务地址, 默认与 bootstrap_url 相同
+        # @param bootstrap_token: (可选) 引导服务管理员令牌, 用于为每台虚拟机签发加入票据
+        # @return None
+        """初始化片段渲染器。"""
+        self.template_dir = template_dir
+        self.output_dir = output_dir
+        self.storage = storage
+        self.manager_ip = manager_ip
+        self.registry_endpoint = registry_endpoint
+        self.bootstrap_url = bootstrap_url.rstrip('/') if bootstrap_url else None
+        self.bootstrap_admin_url = (bootstrap_admin_url or bootstrap_url or '').rstrip('/') or None
+        self.bootstrap_token = bootstrap_token
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Any] = {}
+        self._rendered: Dict[Any, str] = {}
+        self._written: set = set()
+        self._tickets: Dict[Any, Dict[str, Any]] = {}
+
+    @staticmethod
+    def normalize_role(role: str) -> Optional[str]:
+        # normalize_role 将用户输入的节点类型映射为模板角色
+        # @param role: 节点类型, 例如 'master'、'work'、'control_node'
+        # @return 'control_node'、'work_node', 无法识别时返回 None
+        return SNIPPET_ROLE_ALIASES.get(role.strip().lower())
+
+    def _template(self, role: str) -> Dict[str, Any]:
+        # _template 读取角色对应的模板, 按文件修改时间缓存
+        # @param role: 模板角色
+        # @return 包含 text 与 mtime 的字典
+        path = os.path.join(self.template_dir, SNIPPET_ROLE_TEMPLATES[role])
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            cached = self._templates.get(role)
+            if cached and cached['mtime'] == mtime:
+                return cached
+        with open(path, "r", encoding="utf-8") as f:
+            cached = {"text": f.read(), "mtime": mtime}
+        with self._lock:
+            self._templates[role] = cached
+        return cached
+
+    def _ticket(self, node: str, vmid: int, role: str) -> Optional[str]:
+        # _ticket 为虚拟机签发引导服务加入票据, 同一虚拟机重复调用返回同一票据
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param role: 模板角色
+        # @note 缓存票据保证重试时渲染结果不变, 从而不会产生新的片段文件;
+        #       票据剩余有效期不足 SNIPPET_TICKET_MIN_TTL 时重新签发, 过期的缓存顺带清理
+        # @return 票据, 未配置引导服务或签发失败时返回 None
+        if not self.bootstrap_url or not self.bootstrap_admin_url or not self.bootstrap_token:
+            return None
+        key = (node, vmid, role)
+        now = time.time()
+        with self._lock:
+            self._tickets = {k: v for k, v in self._tickets.items() if v['expires_at'] > now}
+            cached = self._tickets.get(key)
+            if cached and cached['expires_at'] - now >= SNIPPET_TICKET_MIN_TTL:
+                return cached['ticket']
+        try:
+            response = requests.post(
+                f"{self.bootstrap_admin_url}/join/tickets",
+                json={"role": role},
+                headers={"Authorization": f"Bearer {self.bootstrap_token}"},
+                timeout=10,
+            )
+            response.raise_for_status()
+            issued = response.json()
+            ticket = issued["ticket"]
+            expires_at = float(issued["expires_at"])
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            print(f"WARNING: Failed to issue bootstrap ticket for VM {vmid}: {e}")
+            return None
+        with self._lock:
+            self._tickets[key] = {'ticket': ticket, 'expires_at': expires_at}
+        return ticket
+
+    def variables(self, node: str, vmid: int, role: str, ipconfig0: str) -> Dict[str, str]:
+        # variables 计算虚拟机片段需要注入的环境变量
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param role: 模板角色
+        # @param ipconfig0: 虚拟机的 ipconfig0, 静态 IP 时提取节点 IP
+        # @return 变量名到值的字典, 只包含有值的变量
+        ip_match = re.search(r'ip=([0-9.]+)/', ipconfig0 or '')
+        values = {
+            "MANAGER_IP": self.manager_ip,
+            "REGISTRY_ENDPOINT": self.registry_endpoint,
+            "BOOTSTRAP_URL": self.bootstrap_url,
+            "BOOTSTRAP_TICKET": self._ticket(node, vmid, role),
+            "NODE_IP": ip_match.group(1) if ip_match else None,
+        }
+        return {k: v for k, v in values.items() if v}
+
+    def render(self, role: str, variables: Dict[str, str]) -> str:
+        # render 将变量注入模板 runcmd 中 'export MANAGER_IP=...' 所在位置
+        # @param role: 模板角色
+        # @param variables: variables 返回的变量字典
+        # @note 模板中的 MANAGER_IP 行被替换 (未配置 MANAGER_IP 时保留原值), 其余变量以相同缩进追加在其后
+        # @return 渲染后的片段文本
+        """将变量注入模板并返回渲染后的片段文本。"""
+        text = self._template(role)['text']
+
+        def _inject(match: re.Match) -> str:
+            indent = match.group(1)
+            lines = [] if 'MANAGER_IP' in variables else [match.group(0).rstrip()]
+            lines += [f'{indent}export {key}="{value}"' for key, value in variables.items()]
+            return "\n".join(lines)
+
+        if not SNIPPET_MANAGER_IP_LINE.search(text):
+            raise ValueError(f"Template {SNIPPET_ROLE_TEMPLATES[role]} has no 'export MANAGER_IP=' line in runcmd.")
+        return SNIPPET_MANAGER_IP_LINE.sub(_inject, text, count=1)
+
+    def materialize(self, node: str, vmid: int, role: str, ipconfig0: str) -> Dict[str, Any]:
+        # materialize 渲染并写入虚拟机片段, 返回可直接使用的 cicustom 值
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param role: 模板角色
+        # @param ipconfig0: 虚拟机的 ipconfig0
+        # @note 渲染结果按 (角色, VMID, 变量, 模板修改时间) 缓存; 文件以 VMID 与内容 sha256 命名, 已存在则不再写入
+        # @return 包含 cicustom、snippet 文件名与 written (本次是否写入文件) 的字典
+        """渲染并写入虚拟机片段，返回可直接使用的 cicustom 值。"""
+        variables = self.variables(node, vmid, role, ipconfig0)
+        cache_key = (role, vmid, self._template(role)['mtime'], tuple(sorted(variables.items())))
+
+        with self._lock:
+            filename = self._rendered.get(cache_key)
+        if filename is None:
+            text = self.render(role, variables)
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+            filename = f"k3s-{role}-{vmid}-{digest}.yaml"
+            with self._lock:
+                self._rendered[cache_key] = filename
+        else:
+            text = None
+
+        written = False
+        path = os.path.join(self.output_dir, filename)
+        with self._lock:
+            exists = filename in self._written or os.path.exists(path)
+        if not exists:
+            if text is None:
+                text = self.render(role, variables)
+            os.makedirs(self.output_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            written = True
+        with self._lock:
+            self._written.add(filename)
+
+        return {
+            "cicustom": f"user={self.storage}:snippets/{filename}",
+            "snippet": filename,
+            "written": written,
+        }
+
+    def _remove(self, filenames: List[str], min_age: float = 0) -> List[str]:
+        # _remove 删除片段文件并清理对应的渲染缓存
+        # @param filenames: 要删除的片段文件名
+        # @param min_age: (可选) 写入时间不足该秒数的文件跳过, 留给下一次回收
+        # @return 实际删除的文件名列表
+        removed = []
+        now = time.time()
+        for filename in filenames:
+            path = os.path.join(self.output_dir, filename)
+            try:
+                if min_age and now - os.stat(path).st_mtime < min_age:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            removed.append(filename)
+        if removed:
+            gone = set(removed)
+            with self._lock:
+                self._written -= gone
+                self._rendered = {k: v for k, v in self._rendered.items() if v not in gone}
+        return removed
+
+    def _snippet_files(self) -> Dict[str, int]:
+        # _snippet_files 列出输出目录中由本渲染器生成的片段文件
+        # @return 文件名到 VMID 的字典, 目录不存在时返回空字典
+        try:
+            names = os.listdir(self.output_dir)
+        except OSError:
+            return {}
+        return {name: int(match.group(1)) for name in names if (match := SNIPPET_FILE_PATTERN.match(name))}
+
+    def discard_superseded(self, vmid: int, keep: str) -> List[str]:
+        # discard_superseded 删除虚拟机被新片段替换掉的旧片段
+        # @param vmid: 虚拟机 ID
+        # @param keep: 虚拟机当前 cicustom 引用的片段文件名
+        # @note 应在新的 cicustom 写入虚拟机配置之后调用
+        # @return 删除的文件名列表
+        return self._remove([name for name, owner in self._snippet_files().items() if owner == vmid and name != keep])
+
+    def collect_garbage(self, live_vmids: set) -> List[str]:
+        # collect_garbage 删除已不存在的虚拟机的片段, 并清理其缓存的加入票据
+        # @param live_vmids: 集群中现存的全部 VMID (含模板)
+        # @note 写入不足 SNIPPET_GC_MIN_AGE 秒的片段保留, 其虚拟机可能是在查询 VMID 之后才创建的
+        # @return 删除的文件名列表
+        with self._lock:
+            self._tickets = {k: v for k, v in self._tickets.items() if k[1] in live_vmids}
+        stale = [name for name, owner in self._snippet_files().items() if owner not in live_vmids]
+        return self._remove(stale, SNIPPET_GC_MIN_AGE)
+
+
+# --- 1.5 VM CONFIG CACHE (配置差异计算与乐观并发写入) ---
+
+VM_CONFIG_DIGEST_ERRORS = ("digest", "modified configuration")
+
+
+class VmConfigCache:
+    """
+    VmConfigCache 虚拟机配置缓存
+    缓存 /nodes/{node}/qemu/{vmid}/config 的读取结果 (含 digest)，写入前计算与当前配置的真实差异，
+    只提交发生变化的键并携带 digest 实现乐观并发；配置已被其他操作修改时重新读取并重试一次。
+    """
+    def __init__(self, client: PveApiClient, ttl: float = 30):
+        # __init__ 初始化配置缓存
+        # @param client: 已认证的 PveApiClient 实例
+        # @param ttl: 配置缓存时间 (秒)
+        # @return None
+        """初始化配置缓存。"""
+        self.client = client
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._configs: Dict[Any, Dict[str, Any]] = {}
+
+    def get(self, node: str, vmid: int, refresh: bool = False) -> Dict[str, Any]:
+        # get 读取虚拟机配置, 缓存未过期时直接返回
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param refresh: 是否忽略缓存重新读取
+        # @return 配置字典 (包含 'digest'), 失败时返回包含 'error' 的字典
+        """读取虚拟机配置 (带缓存)。"""
+        key = (node, vmid)
+        with self._lock:
+            cached = self._configs.get(key)
+            if cached and not refresh and time.time() - cached['fetched_at'] < self.ttl:
+                return cached['config']
+
+        result = self.client.get_vm_config(node, vmid)
+        if not result or 'error' in result:
+            return {'error': (result or {}).get('error', 'Empty response')}
+        config = result.get('data') or {}
+        with self._lock:
+            self._configs[key] = {'config': config, 'fetched_at': time.time()}
+        return config
+
+    def is_cached(self, node: str, vmid: int) -> bool:
+        # is_cached 判断 get 是否会直接返回缓存的配置
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @return 缓存存在且未过期时返回 True
+        with self._lock:
+            cached = self._configs.get((node, vmid))
+            return bool(cached) and time.time() - cached['fetched_at'] < self.ttl
+
+    def invalidate(self, node: str, vmid: int) -> None:
+        # invalidate 清除虚拟机的配置缓存
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @return None
+        with self._lock:
+            self._configs.pop((node, vmid), None)
+
+    @staticmethod
+    def _normalize(value: Any) -> str:
+        # _normalize 将配置值规范化为字符串以便比较 (PVE 返回的数值与布尔值均为字符串形式)
+        # @param value: 配置值
+        # @return 规范化后的字符串
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        return str(value).strip()
+
+    @staticmethod
+    def diff(current: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str, Any]:
+        # diff 计算需要真正写入的配置
+        # @param current: 当前配置
+        # @param updates: 期望的配置, 可包含 PVE 的 'delete' 键 (逗号分隔的待删除键)
+        # @note 'delete' 中不存在于当前配置的键会被去掉
+        # @return 只包含发生变化的键的字典
+        changes = {
+            key: value for key, value in updates.items()
+            if key != 'delete' and VmConfigCache._normalize(current.get(key, '')) != VmConfigCache._normalize(value)
+        }
+        if updates.get('delete'):
+            deletes = [k.strip() for k in str(updates['delete']).split(',') if k.strip() in current]
+            if deletes:
+                changes['delete'] = ",".join(deletes)
+        return changes
+
+    def apply(self, node: str, vmid: int, updates: Dict[str, Any]) -> Dict[str, Any]:
+        # apply 只写入发生变化的配置, 携带 digest 防止覆盖并发修改
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param updates: 期望的配置
+        # @note 缓存的配置显示无需修改时重新读取一次再确认, 避免依据过期缓存跳过写入;
+        #       digest 不匹配 (配置在读取后被修改) 时重新读取配置并重试一次; 每次写入后清除缓存
+        # @return 包含 changed (写入的键)、unchanged (跳过的键) 与 result (API 结果, 无变化时为 None) 的字典,
+        #         读取配置失败时包含 'error'
+        """计算配置差异并只写入变化的键。"""
+        refresh = False
+        for attempt in range(2):
+            refresh = refresh or not self.is_cached(node, vmid)
+            current = self.get(node, vmid, refresh=refresh)
+            if 'error' in current:
+                return {'error': current['error']}
+
+            changes = self.diff(current, updates)
+            if not changes and not refresh:
+                refresh = True
+                current = self.get(node, vmid, refresh=True)
+                if 'error' in current:
+                    return {'error': current['error']}
+                changes = self.diff(current, updates)
+
+            unchanged = [key for key in updates if key not in changes]
+            if not changes:
+                return {'changed': [], 'unchanged': unchanged, 'result': None}
+
+            payload = dict(changes)
+            if current.get('digest'):
+                payload['digest'] = current['digest']
+            result = self.client.update_vm_config(node, vmid, payload)
+            self.invalidate(node, vmid)
+
+            error = str((result or {}).get('error', ''))
+            if attempt == 0 and any(marker in error for marker in VM_CONFIG_DIGEST_ERRORS):
+                print(f"INFO: VM {vmid} config changed concurrently, retrying with a fresh digest.")
+                refresh = True
+                continue
+            return {'changed': list(changes), 'unchanged': unchanged, 'result': result}
+
+
+# --- 1.6 SNAPSHOT COORDINATOR (按节点与存储限流的批量快照) ---
+
+class SnapshotCoordinator:
+    """
+    SnapshotCoordinator 批量快照协调器
+    对一组虚拟机并发执行快照的创建、回滚或删除，限制每个节点与每个存储后端上同时运行的快照任务数；
+    每个任务通过 UPID 等待结束后才释放名额，单次调用的总耗时约等于最忙的节点或存储上的任务耗时之和。
+    """
+    def __init__(self, client: PveApiClient, max_per_node: int = 2, max_per_storage: int = 2,
+                 max_workers: int = 16, task_timeout: int = 600):
+        # __init__ 初始化快照协调器
+        # @param client: 已认证的 PveApiClient 实例
+        # @param max_per_node: (可选) 每个节点允许同时运行的快照任务数
+        # @param max_per_storage: (可选) 每个存储后端允许同时运行的快照任务数
+        # @param max_workers: (可选) 单次调用的最大线程数
+        # @param task_timeout: (可选) 等待单个快照任务结束的最长时间, 单位秒
+        # @note 名额在多次并发的工具调用之间共享
+        # @return None
+        """初始化快照协调器。"""
+        self.client = client
+        self.max_per_node = max_per_node
+        self.max_per_storage = max_per_storage
+        self.max_workers = max_workers
+        self.task_timeout = task_timeout
+        self._cond = threading.Condition()
+        self._in_flight: Dict[str, int] = {}
+
+    def _shared_storages(self) -> Dict[str, bool]:
+        # _shared_storages 读取集群存储定义中各存储是否为共享存储
+        # @return 存储 ID -> 是否共享, 查询失败时返回空字典 (全部按本地存储计)
+        result = self.client.get_storage_definitions()
+        if not result or 'error' in result:
+            return {}
+        return {s['storage']: bool(s.get('shared')) for s in result.get('data') or []}
+
+    def _slot_keys(self, node: str, vmid: int, shared: Dict[str, bool], vmstate: bool = False) -> List[str]:
+        # _slot_keys 确定快照任务需要占用的名额: 所在节点与虚拟机磁盘所在的每个存储后端
+        # @param node: PVE 节点名称
+        # @param vmid: 虚拟机 ID
+        # @param shared: _shared_storages 的结果
+        # @param vmstate: (可选) 任务是否可能读写内存状态, 为 True 时同时占用 vmstatestorage 的名额
+        # @note 存储标识与 CloneScheduler 一致: 共享存储按存储 ID, 本地存储按 '节点/存储 ID';
+        #       未设置 vmstatestorage 时 PVE 将内存状态写入虚拟机某个磁盘所在的存储, 已包含在磁盘存储中
+        # @return 名额标识列表
+        result = self.client.get_vm_config(node, vmid)
+        config = (result.get('data') or {}) if result and 'error' not in result else {}
+        names = {d['storage'] for d in _parse_vm_disks(config)} if config else set()
+        if vmstate and config.get('vmstatestorage'):
+            names.add(config['vmstatestorage'])
+        storages = {name if shared.get(name) else f"{node}/{name}" for name in names}
+        return [f"node:{node}"] + sorted(storages)
+
+    def _limit(self, key: str) -> int:
+        return self.max_per_node if key.startswith("node:") else self.max_per_storage
+
+    def _acquire(self, keys: List[str]) -> None:
+        # _acquire 等待所有名额同时空闲后一次性占用, 避免逐个占用导致的互相等待
+        # @param keys: 名额标识列表
+        # @return None
+        with self._cond:
+            self._cond.wait_for(lambda: all(self._in_flight.get(k, 0) < self._limit(k) for k in keys))
+            for key in keys:
+                self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def _release(self, keys: List[str]) -> None:
+        # _release 释放名额并唤醒等待中的任务
+        # @param keys: 名额标识列表
+        # @return None
+        with self._cond:
+            for key in keys:
+                self._in_flight[key] = max(0, self._in_flight.get(key, 1) - 1)
+            self._cond.notify_all()
+
+    def _run_one(self, vm: Dict[str, Any], start_task, shared: Dict[str, bool], vmstate: bool) -> Dict[str, Any]:
+        # _run_one 在名额允许时发起一台虚拟机的快照任务并等待其结束
+        # @param vm: 虚拟机字典, 包含 node、vmid、name
+        # @param start_task: 发起任务的函数, 参数为 (node, vmid), 返回 PVE API 结果
+        # @param shared: _shared_storages 的结果
+        # @param vmstate: 任务是否可能读写内存状态
+        # @return 结果字典, status 为 'done'、'failed' 或 'timeout'
+        node, vmid = vm['node'], int(vm['vmid'])
+        entry: Dict[str, Any] = {"node": node, "vmid": vmid, "name": vm.get('name')}
+        keys = self._slot_keys(node, vmid, shared, vmstate)
+        self._acquire(keys)
+        started = time.time()
+        try:
+            result = start_task(node, vmid)
+            if not result or 'error' in result:
+                return {**entry, "status": "failed", "error": result.get('error') if result else "result is None"}
+
+            upid = result.get('data')
+            if isinstance(upid, str) and upid.startswith('UPID'):
+                entry['upid'] = upid
+                task = self.client.wait_for_task(node, upid, timeout=self.task_timeout, interval=1)
+                if 'error' in task:
+                    return {**entry, "status": "failed", "error": task['error']}
+                if task.get('status') != 'stopped':
+                    return {**entry, "status": "timeout", "error": f"Task still running after {self.task_timeout}s."}
+                if task.get('exitstatus') != 'OK':
+                    return {**entry, "status": "failed", "error": task.get('exitstatus')}
+            return {**entry, "status": "done", "seconds": round(time.time() - started, 1)}
+        finally:
+            self._release(keys)
+
+    def run(self, vms: List[Dict[str, Any]], start_task, vmstate: bool = False) -> List[Dict[str, Any]]:
+        # run 对一组虚拟机并发执行快照任务
+        # @param vms: 虚拟机列表, 每项包含 node、vmid、name
+        # @param start_task: 发起任务的函数, 参数为 (node, vmid), 返回 PVE API 结果
+        # @param vmstate: (可选) 任务是否可能读写内存状态 (含内存的快照, 以及回滚与删除)
+        # @return 与 vms 顺序一致的结果列表
+        """对一组虚拟机并发执行快照任务。"""
+        shared = self._shared_storages()
+        with ThreadPoolExecutor(max_workers=min(len(vms), self.max_workers)) as executor:
+            return list(executor.map(_in_context(lambda vm: self._run_one(vm, start_task, shared, vmstate)), vms))
+
+    def status(self) -> Dict[str, Any]:
+        # status 返回各节点与存储上正在运行的快照任务数
+        # @return 状态字典
+        with self._cond:
+            return {
+                "max_per_node": self.max_per_node,
+                "max_per_storage": self.max_per_storage,
+                "in_flight": {k: v for k, v in self._in_flight.items() if v},
+            }
+
+
 # --- 2. GLOBAL CONFIGURATION & INITIALIZATION ---
 
 # load_dotenv()
@@ -216,12 +1774,157 @@ if not PVE_HOST or not PVE_TOKEN_SECRET:
 
 PVE_API_URL = f"https://{PVE_HOST}:{PVE_PORT}/api2/json"
 
+# Guest Agent IP 探测: 指数退避的初始/最大间隔 (秒) 与最大并发数
+GUEST_AGENT_INITIAL_DELAY = 1.0
+GUEST_AGENT_MAX_DELAY = 15.0
+GUEST_AGENT_MAX_WORKERS = 8
+
+# 克隆调度配置: 每个存储后端允许的并发克隆数, 以及 clone_vm 等待排队的最长时间 (秒)
+CLONE_MAX_PER_STORAGE = int(os.getenv("CLONE_MAX_PER_STORAGE", "2"))
+CLONE_QUEUE_TIMEOUT = int(os.getenv("CLONE_QUEUE_TIMEOUT", "600"))
+
+# 模板配置: 存储支持时是否优先使用链接克隆, 以及模板解析结果的缓存时间 (秒)
+TEMPLATE_PREFER_LINKED = os.getenv("TEMPLATE_PREFER_LINKED", "false").lower() == "true"
+TEMPLATE_CACHE_TTL = int(os.getenv("TEMPLATE_CACHE_TTL", "300"))
+
+# 预热池配置: WARM_POOL_SIZE 为每个节点保持的预热虚拟机数量, 0 表示禁用
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "0"))
+WARM_POOL_PREFIX = os.getenv("WARM_POOL_PREFIX", "warm")
+WARM_POOL_INTERVAL = int(os.getenv("WARM_POOL_INTERVAL", "60"))
+WARM_POOL_NODES = [n.strip() for n in os.getenv("WARM_POOL_NODES", "").split(",") if n.strip()]
+
+# 虚拟机配置缓存时间 (秒), 用于 update_vm_config 计算配置差异
+VM_CONFIG_CACHE_TTL = int(os.getenv("VM_CONFIG_CACHE_TTL", "30"))
+VM_CONFIG_MAX_WORKERS = 8
+
+# 批量快照配置: 每个节点与每个存储后端允许同时运行的快照任务数, 单次调用的最大线程数与单个任务的最长等待时间 (秒)
+SNAPSHOT_MAX_PER_NODE = int(os.getenv("SNAPSHOT_MAX_PER_NODE", "2"))
+SNAPSHOT_MAX_PER_STORAGE = int(os.getenv("SNAPSHOT_MAX_PER_STORAGE", "2"))
+SNAPSHOT_MAX_WORKERS = 16
+SNAPSHOT_TASK_TIMEOUT = int(os.getenv("SNAPSHOT_TASK_TIMEOUT", "600"))
+# PVE 快照名称规则: 以字母开头, 只包含字母、数字、'_' 与 '-', 最长 40 个字符
+SNAPSHOT_NAME_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9_\-]{1,39}$')
+
+# cloud-init 片段渲染配置: 模板目录、渲染结果目录 (PVE 存储 SNIPPET_STORAGE 的 snippets 子目录) 与注入的变量
+SNIPPET_TEMPLATE_DIR = os.getenv("SNIPPET_TEMPLATE_DIR", "/app/snippets")
+SNIPPET_OUTPUT_DIR = os.getenv("SNIPPET_OUTPUT_DIR", SNIPPET_TEMPLATE_DIR)
+SNIPPET_STORAGE = os.getenv("SNIPPET_STORAGE", "cloud-init")
+SNIPPET_MAX_WORKERS = 8
+MANAGER_IP = os.getenv("MANAGER_IP")
+REGISTRY_ENDPOINT = os.getenv("REGISTRY_ENDPOINT")
+BOOTSTRAP_URL = os.getenv("BOOTSTRAP_URL")
+BOOTSTRAP_ADMIN_URL = os.getenv("BOOTSTRAP_ADMIN_URL")
+BOOTSTRAP_ADMIN_TOKEN = os.getenv("BOOTSTRAP_ADMIN_TOKEN")
+
+# RRD 历史指标配置: 时间范围及其覆盖的分钟数 (由短到长, 选择能覆盖窗口的最短范围), 并发数与异常点的 z-score 阈值
+RRD_TIMEFRAMES = [("hour", 60), ("day", 1440), ("week", 10080), ("month", 43200), ("year", 525600)]
+RRD_MAX_WORKERS = 8
+RRD_ANOMALY_Z = 3.0
+# 汇总的指标: 名称 -> 由 RRD 原始列计算指标的函数 (CPU/内存换算为百分比)
+VM_RRD_METRICS = {
+    "cpu_pct": lambda c: c["cpu"] * 100,
+    "mem_pct": lambda c: c["mem"] / c["maxmem"] * 100,
+    "netin": lambda c: c["netin"],
+    "netout": lambda c: c["netout"],
+    "diskread": lambda c: c["diskread"],
+    "diskwrite": lambda c: c["diskwrite"],
+}
+NODE_RRD_METRICS = {
+    "cpu_pct": lambda c: c["cpu"] * 100,
+    "mem_pct": lambda c: c["memused"] / c["memtotal"] * 100,
+    "iowait_pct": lambda c: c["iowait"] * 100,
+    "loadavg": lambda c: c["loadavg"],
+    "netin": lambda c: c["netin"],
+    "netout": lambda c: c["netout"],
+}
+
+# 追踪配置: span 以 JSON Lines (OpenTelemetry span JSON) 追加写入 TRACE_EXPORT_PATH, 为空时只传播不导出
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SERVICE_NAME = "pve-mcp"
+
+
+def setup_tracing(service_name: str, export_path: str) -> trace.Tracer:
+    # setup_tracing 初始化 OpenTelemetry TracerProvider
+    # @param service_name: 写入 span resource 的 service.name
+    # @param export_path: JSON Lines 导出文件路径, 为空时不导出
+    # @note 使用默认的 ParentBased 采样, 跟随上游 traceparent 的采样标记
+    # @return 本服务使用的 Tracer
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if export_path:
+        os.makedirs(os.path.dirname(export_path) or ".", exist_ok=True)
+        exporter = ConsoleSpanExporter(
+            out=open(export_path, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer(service_name)
+
+
+class TracingMiddleware(Middleware):
+    """
+    TracingMiddleware MCP 工具调用追踪中间件
+    从 HTTP 请求头或 MCP 调用 _meta 中读取 W3C traceparent，为每次工具调用创建 mcp.tool span，
+    工具内部的 PVE API 请求作为其子 span 记录。
+    """
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        # on_call_tool 在追踪上下文中执行工具调用
+        # @param context: fastmcp 中间件上下文, message 为 CallToolRequestParams
+        # @param call_next: 下一个处理器
+        # @note 同步工具在事件循环线程中执行, 因此可直接继承当前 span
+        # @return 工具调用结果
+        carrier = dict(get_http_headers())
+        try:
+            meta = context.fastmcp_context.request_context.meta
+        except (AttributeError, LookupError, ValueError):
+            meta = None
+        if meta is not None and getattr(meta, "traceparent", None):
+            carrier.setdefault("traceparent", meta.traceparent)
+
+        name = context.message.name
+        with tracer.start_as_current_span(f"mcp.tool {name}", context=propagate.extract(carrier),
+                                          kind=trace.SpanKind.SERVER, attributes={"mcp.tool.name": name}) as span:
+            result = await call_next(context)
+            text = getattr((getattr(result, "content", None) or [None])[0], "text", "") or ""
+            if text.startswith(("ERROR", "API ERROR")):
+                span.set_status(trace.Status(trace.StatusCode.ERROR, text[:200]))
+            return result
+
+
+tracer = setup_tracing(TRACE_SERVICE_NAME, TRACE_EXPORT_PATH)
+
 mcp = FastMCP(name="pve-management-agent")
+mcp.add_middleware(TracingMiddleware())
 pve_client: Optional[PveApiClient] = None 
+clone_scheduler: Optional[CloneScheduler] = None
+template_manager: Optional[TemplateManager] = None
+warm_pool: Optional[WarmPoolManager] = None
+snippet_renderer: Optional[SnippetRenderer] = None
+vm_config_cache: Optional[VmConfigCache] = None
+snapshot_coordinator: Optional[SnapshotCoordinator] = None
 
 
 # --- 3. HELPER FUNCTIONS AND MCP TOOLS ---
 
+def _in_context(fn):
+    # _in_context 让线程池中执行的函数继承当前上下文 (包括追踪 span)
+    # @param fn: 要在线程池中执行的函数
+    # @note ThreadPoolExecutor 的工作线程不会继承 contextvars, PVE API 的 span 需要据此找到父 span
+    # @return 包装后的函数
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+async def _to_thread(fn, *args):
+    # _to_thread 在工作线程中执行阻塞的 PVE 操作
+    # @param fn: 阻塞函数
+    # @param args: 传给 fn 的参数
+    # @note FastMCP 直接在事件循环中调用同步工具; 会长时间等待的工具需声明为 async 并通过此函数执行,
+    #       否则等待期间整个 MCP 服务 (其他工具调用、ping、/health) 都会被阻塞
+    # @return fn 的返回值
+    return await anyio.to_thread.run_sync(_in_context(fn), *args)
+
+
 def _handle_response(result: Optional[Dict[str, Any]], success_message: str) -> str:
     # _handle_response 格式化 API 响应或错误信息
     # @param result: PVE API 请求返回的原始字典结果, 可能为 None
@@ -250,6 +1953,312 @@ def _handle_response(result: Optional[Dict[str, Any]], success_message: str) ->
     return f"ERROR: API call failed with unexpected response structure. Response details: {result}"
 
 
+def _extract_guest_ips(result: Dict[str, Any]) -> Dict[str, Any]:
+    # _extract_guest_ips 从 Guest Agent 的 network-get-interfaces 结果中提取可用 IP
+    # @param result: get_vm_network_interfaces 返回的原始字典
+    # @note 忽略回环网卡 (lo) 与 IPv6 链路本地地址 (fe80::/10)
+    # @return 包含 ipv4、ipv6 列表及按网卡分组详情的字典
+    """内部辅助函数：从 Guest Agent 网卡信息中提取可用 IP 地址。"""
+    data = result.get('data') or {}
+    interfaces = data.get('result', []) if isinstance(data, dict) else []
+
+    ipv4, ipv6, details = [], [], []
+    for iface in interfaces:
+        name = iface.get('name')
+        if name == 'lo':
+            continue
+        addresses = []
+        for addr in iface.get('ip-addresses') or []:
+            ip = addr.get('ip-address')
+            ip_type = addr.get('ip-address-type')
+            if not ip:
+                continue
+            if ip_type == 'ipv4' and not ip.startswith('127.'):
+                ipv4.append(ip)
+            elif ip_type == 'ipv6' and not ip.lower().startswith('fe80') and ip != '::1':
+                ipv6.append(ip)
+            else:
+                continue
+            addresses.append(f"{ip}/{addr.get('prefix')}")
+        if addresses:
+            details.append({
+                "name": name,
+                "mac": iface.get('hardware-address'),
+                "addresses": addresses,
+            })
+
+    return {"ipv4": ipv4, "ipv6": ipv6, "interfaces": details}
+
+
+def _wait_for_guest_ip(node: str, vmid: int, timeout: int) -> Dict[str, Any]:
+    # _wait_for_guest_ip 以指数退避方式轮询 Guest Agent, 直到虚拟机上报 IPv4 地址
+    # @param node: PVE 节点名称
+    # @param vmid: 虚拟机的 ID
+    # @param timeout: 最大等待时间, 单位秒
+    # @note 虚拟机刚启动时 Guest Agent 尚未就绪, PVE 会返回错误, 此时继续重试而非立即失败
+    # @return 包含 vmid、状态 (ready/timeout)、IP 列表与耗时的字典
+    """内部辅助函数：带指数退避地等待虚拟机通过 Guest Agent 上报 IP。"""
+    start_time = time.time()
+    delay = GUEST_AGENT_INITIAL_DELAY
+    last_error = None
+
+    while True:
+        result = pve_client.get_vm_network_interfaces(node, vmid)
+
+        if result and 'error' not in result:
+            ips = _extract_guest_ips(result)
+            if ips['ipv4']:
+                return {
+                    "vmid": vmid,
+                    "node": node,
+                    "status": "ready",
+                    **ips,
+                    "elapsed_seconds": round(time.time() - start_time, 1),
+                }
+            last_error = "Guest agent is running but no IPv4 address is assigned yet."
+        else:
+            last_error = result.get('error') if result else "result is None"
+
+        remaining = timeout - (time.time() - start_time)
+        if remaining <= 0:
+            return {
+                "vmid": vmid,
+                "node": node,
+                "status": "timeout",
+                "last_error": last_error,
+                "elapsed_seconds": round(time.time() - start_time, 1),
+            }
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, GUEST_AGENT_MAX_DELAY)
+
+
+def _rrd_timeframe(window_minutes: int) -> str:
+    # _rrd_timeframe 选择能覆盖时间窗口的最短 RRD 时间范围
+    # @param window_minutes: 时间窗口, 单位分钟
+    # @note 范围越短分辨率越高 (hour 为 1 分钟, day 为 30 分钟), 超出一年时使用 year
+    # @return RRD 时间范围名称
+    for timeframe, minutes in RRD_TIMEFRAMES:
+        if window_minutes <= minutes:
+            return timeframe
+    return RRD_TIMEFRAMES[-1][0]
+
+
+def _summarize_rrd(points: List[Dict[str, Any]], metrics: Dict[str, Any], window_minutes: int) -> Dict[str, Any]:
+    # _summarize_rrd 将 RRD 数据点汇总为每个指标的统计值
+    # @param points: rrddata 接口返回的数据点列表, 每项包含 time 与各指标列
+    # @param metrics: VM_RRD_METRICS 或 NODE_RRD_METRICS
+    # @param window_minutes: 时间窗口, 只统计最后一个数据点之前该窗口内的数据
+    # @note 所有指标组成 (指标数, 数据点数) 矩阵按行向量化计算; 缺失值 (离线或未上报) 为 NaN 并被忽略。
+    #       slope_per_hour 为最小二乘斜率, anomalies 为 |z-score| 超过 RRD_ANOMALY_Z 的数据点数
+    # @return 包含数据点数量与每个指标 mean/p95/max/last/slope_per_hour/anomalies/last_is_anomaly 的字典
+    if not points:
+        return {"points": 0, "metrics": {}}
+
+    times = np.array([p.get("time", 0) for p in points], dtype=float)
+    in_window = times >= times.max() - window_minutes * 60
+    times = times[in_window]
+    columns = {}
+    for point_key in {key for p in points for key in p}:
+        values = [p.get(point_key) for p in points]
+        columns[point_key] = np.array([v if isinstance(v, (int, float)) else np.nan for v in values], dtype=float)[in_window]
+    columns = defaultdict(lambda: np.full(times.shape, np.nan), columns)
+
+    names = list(metrics)
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        matrix = np.vstack([metrics[name](columns) for name in names])
+        matrix[~np.isfinite(matrix)] = np.nan
+        valid = ~np.isnan(matrix)
+        counts = valid.sum(axis=1)
+
+        mean = np.nanmean(matrix, axis=1)
+        p95 = np.nanpercentile(matrix, 95, axis=1)
+        peak = np.nanmax(matrix, axis=1)
+        last_index = matrix.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+        last = matrix[np.arange(len(names)), last_index]
+
+        hours = (times - times.min()) / 3600 if times.size else times
+        x_mean = (hours * valid).sum(axis=1) / counts
+        dx = (hours - x_mean[:, None]) * valid
+        slope = np.nansum(dx * (matrix - mean[:, None]), axis=1) / (dx ** 2).sum(axis=1)
+
+        std = np.nanstd(matrix, axis=1)
+        z = np.abs(matrix - mean[:, None]) / np.where(std > 0, std, np.nan)[:, None]
+        outliers = np.nan_to_num(z) > RRD_ANOMALY_Z
+        anomalies = outliers.sum(axis=1)
+        last_is_anomaly = outliers[np.arange(len(names)), last_index]
+
+    def _round(value: float) -> Optional[float]:
+        return None if np.isnan(value) else round(float(value), 2)
+
+    summary = {}
+    for i, name in enumerate(names):
+        if counts[i] == 0:
+            continue
+        summary[name] = {
+            "mean": _round(mean[i]),
+            "p95": _round(p95[i]),
+            "max": _round(peak[i]),
+            "last": _round(last[i]),
+            "slope_per_hour": _round(slope[i]),
+            "anomalies": int(anomalies[i]),
+            "last_is_anomaly": bool(last_is_anomaly[i]),
+        }
+    return {"points": int(times.size), "metrics": summary}
+
+
+def _fetch_rrd_summary(node: str, vmid: Optional[int], window_minutes: int, cf: str) -> Dict[str, Any]:
+    # _fetch_rrd_summary 获取单个节点或虚拟机的 RRD 数据并汇总
+    # @param node: PVE 节点名称
+    # @param vmid: 虚拟机 ID, 为 None 时获取节点本身的指标
+    # @param window_minutes: 时间窗口, 单位分钟
+    # @param cf: 聚合函数, 'AVERAGE' 或 'MAX'
+    # @return 汇总结果字典, 失败时包含 'error'
+    timeframe = _rrd_timeframe(window_minutes)
+    target = {"node": node} if vmid is None else {"node": node, "vmid": vmid}
+    if vmid is None:
+        result = pve_client.get_node_rrddata(node, timeframe, cf)
+    else:
+        result = pve_client.get_vm_rrddata(node, vmid, timeframe, cf)
+    if not result or 'error' in result:
+        return {**target, "error": (result or {}).get('error', 'Empty response')}
+
+    metrics = NODE_RRD_METRICS if vmid is None else VM_RRD_METRICS
+    summary = _summarize_rrd(result.get('data') or [], metrics, window_minutes)
+    return {**target, "timeframe": timeframe, "cf": cf, "window_minutes": window_minutes, **summary}
+
+
+def _submit_clone(node: str, source_vmid: int, payload: Dict[str, Any], success_message: str) -> str:
+    # _submit_clone 通过克隆调度器提交克隆, 并等待其真正发起
+    # @param node: 源虚拟机 (模板) 所在节点
+    # @param source_vmid: 源虚拟机 (模板) 的 ID
+    # @param payload: 克隆参数
+    # @param success_message: 成功时返回字符串中的描述性消息
+    # @note 最多等待 CLONE_QUEUE_TIMEOUT 秒; 仍在排队时返回调度任务 id 而不是 UPID
+    # @return 与 _handle_response 相同格式的状态字符串
+    """内部辅助函数：通过克隆调度器提交克隆，并等待其真正发起。"""
+    job = clone_scheduler.submit(node, source_vmid, payload)
+    job = clone_scheduler.wait(job['id'], until="started", timeout=CLONE_QUEUE_TIMEOUT)
+
+    if job['state'] == "queued":
+        return (f"SUCCESS: {success_message} queued as clone job {job['id']} (storage busy). "
+                f"Use get_clone_queue_status to see when it starts and obtain its UPID.")
+    if job['state'] == "failed" and not job['upid']:
+        return f"API ERROR: {job['error']}"
+
+    result = {'data': job['upid']} if job['upid'] else {'error': job['error']}
+    return _handle_response(result, success_message)
+
+
+def _format_config_update(applied: Dict[str, Any]) -> str:
+    # _format_config_update 格式化 VmConfigCache.apply 的结果
+    # @param applied: VmConfigCache.apply 返回的字典
+    # @return 格式化后的状态字符串, 无变化时返回 SUCCESS 且不写入配置
+    if 'error' in applied:
+        return f"API ERROR: {applied['error']}"
+    if not applied['changed']:
+        return f"SUCCESS: VM config already up to date, nothing written (unchanged: {', '.join(applied['unchanged'])})."
+    return _handle_response(applied['result'], f"VM config update ({', '.join(applied['changed'])})")
+
+
+def _apply_vm_snippet(node: str, vmid: int, role: str, ipconfig0: str) -> Dict[str, Any]:
+    # _apply_vm_snippet 渲染虚拟机的 cloud-init 片段并写入 cicustom 与 ipconfig0
+    # @param node: PVE 节点名称
+    # @param vmid: 虚拟机 ID
+    # @param role: 节点类型 (master/work 或 control_node/work_node)
+    # @param ipconfig0: cloud-init 网络配置
+    # @return 包含 vmid、cicustom、snippet、written 的字典, 失败时包含 'error'
+    template_role = SnippetRenderer.normalize_role(role)
+    if not template_role:
+        return {"vmid": vmid, "error": f"Unknown role '{role}'. Use 'master' or 'work'."}
+    try:
+        rendered = snippet_renderer.materialize(node, vmid, template_role, ipconfig0)
+    except (OSError, ValueError) as e:
+        return {"vmid": vmid, "error": f"Failed to render snippet: {e}"}
+
+    applied = vm_config_cache.apply(node, vmid, {"cicustom": rendered["cicustom"], "ipconfig0": ipconfig0})
+    error = applied.get('error') or (applied.get('result') or {}).get('error')
+    if error:
+        return {"vmid": vmid, "error": error, **rendered}
+    snippet_renderer.discard_superseded(vmid, rendered["snippet"])
+    return {"vmid": vmid, **rendered, "changed": applied['changed']}
+
+
+def _collect_snippet_garbage() -> None:
+    # _collect_snippet_garbage 回收已删除虚拟机的片段文件
+    # @note 通过一次 /cluster/resources 调用获取现存 VMID; 查询失败时跳过, 不影响片段渲染
+    # @return None
+    result = pve_client.get_cluster_resources('vm')
+    if not result or 'error' in result:
+        return
+    live_vmids = {int(r['vmid']) for r in result.get('data') or [] if 'vmid' in r}
+    removed = snippet_renderer.collect_garbage(live_vmids)
+    if removed:
+        print(f"INFO: Removed {len(removed)} snippet(s) of deleted VMs: {', '.join(removed)}")
+
+
+def _select_vms(vmids: Optional[List[int]], name_pattern: Optional[str], nodes: Optional[List[str]]) -> Dict[str, Any]:
+    # _select_vms 按 VMID、名称正则与节点筛选集群中的虚拟机 (不含模板)
+    # @param vmids: (可选) 虚拟机 ID 列表
+    # @param name_pattern: (可选) 虚拟机名称的正则表达式 (re.search 匹配)
+    # @param nodes: (可选) 节点名称列表
+    # @note 多个条件同时给出时取交集; 至少需要一个条件, 避免误操作整个集群; 指定的 VMID 不存在时报错
+    # @return 包含 'vms' (按节点与 VMID 排序) 的字典, 失败时返回包含 'error' 的字典
+    if not vmids and not name_pattern and not nodes:
+        return {"error": "Provide at least one selector: vmids, name_pattern or nodes."}
+    try:
+        name_regex = re.compile(name_pattern) if name_pattern else None
+    except re.error as e:
+        return {"error": f"Invalid name_pattern: {e}"}
+
+    result = pve_client.get_cluster_resources('vm')
+    if not result or 'error' in result:
+        return {"error": f"Failed to list VMs. Details: {result}"}
+    vms = [r for r in result.get('data') or [] if r.get('type') == 'qemu' and not r.get('template')]
+
+    if vmids:
+        wanted = {int(v) for v in vmids}
+        missing = wanted - {int(r['vmid']) for r in vms}
+        if missing:
+            return {"error": f"VMs not found (or are templates): {sorted(missing)}"}
+        vms = [r for r in vms if int(r['vmid']) in wanted]
+    if nodes:
+        vms = [r for r in vms if r.get('node') in nodes]
+    if name_regex:
+        vms = [r for r in vms if name_regex.search(r.get('name') or '')]
+    if not vms:
+        return {"error": "No VMs match the selector."}
+
+    selected = [{"node": r['node'], "vmid": int(r['vmid']), "name": r.get('name'), "status": r.get('status')} for r in vms]
+    return {"vms": sorted(selected, key=lambda v: (v['node'], v['vmid']))}
+
+
+async def _run_snapshot_action(vms: List[Dict[str, Any]], snapname: str, start_task, vmstate: bool = False) -> str:
+    # _run_snapshot_action 通过 SnapshotCoordinator 执行批量快照任务并汇总结果
+    # @param vms: _select_vms 选出的虚拟机列表
+    # @param snapname: 快照名称
+    # @param start_task: 发起任务的函数, 参数为 (node, vmid)
+    # @param vmstate: (可选) 任务是否可能读写内存状态, 决定是否占用 vmstatestorage 的名额
+    # @note 等待任务结束可能需要数分钟, 在工作线程中执行以免阻塞事件循环;
+    #       快照与回滚都会修改虚拟机配置 (parent 与 digest), 结束后清除这些虚拟机的配置缓存
+    # @return 汇总结果的 JSON 字符串
+    started = time.time()
+    results = await _to_thread(snapshot_coordinator.run, vms, start_task, vmstate)
+    for vm in vms:
+        vm_config_cache.invalidate(vm['node'], vm['vmid'])
+
+    done = sum(1 for r in results if r['status'] == "done")
+    return json.dumps({
+        "snapname": snapname,
+        "total": len(results),
+        "succeeded": done,
+        "failed": len(results) - done,
+        "elapsed_seconds": round(time.time() - started, 1),
+        "results": results,
+    }, indent=2)
+
+
 @mcp.custom_route("/health", methods=["GET"])
 async def health_check(request: Request) -> PlainTextResponse:
     # health_check 提供一个健康检查路由
@@ -262,7 +2271,7 @@ async def health_check(request: Request) -> PlainTextResponse:
 
 
 @mcp.tool
-def monitor_pve_task(node: str, upid: str, timeout: int = 300) -> str:
+async def monitor_pve_task(node: str, upid: str, timeout: int = 300) -> str:
     # monitor_pve_task 监控一个异步 Proxmox VE 任务直到它完成
     # @param node: 运行任务的 PVE 节点名称 (例如 'pve')
     # @param upid: 异步操作返回的唯一任务 ID (UPID)
@@ -276,30 +2285,20 @@ def monitor_pve_task(node: str, upid: str, timeout: int = 300) -> str:
     if not pve_client or not pve_client.is_authenticated:
         return "ERROR: PVE client is not initialized or authenticated."
 
-    start_time = time.time()
-    task_path = f"/nodes/{node}/tasks/{upid}/status"
-    
-    while time.time() - start_time < timeout:
-        time.sleep(2)
-        
-        response = pve_client.api_request("GET", task_path)
+    result = await _to_thread(pve_client.wait_for_task, node, upid, timeout)
 
-        if response is None or (isinstance(response, dict) and 'error' in response):
-            return f"ERROR: Failed to fetch task status for {upid}. Details: {response}"
+    if 'error' in result:
+        return f"ERROR: Failed to fetch task status for {upid}. Details: {result['error']}"
+
+    status = result.get('status')
+    exitstatus = result.get('exitstatus', 'N/A')
+
+    if status == 'stopped':
+        if exitstatus == 'OK':
+            return f"SUCCESS: Task {upid} completed successfully. Exit status: {exitstatus}"
+        else:
+            return f"FAILURE: Task {upid} finished with error. Exit status: {exitstatus}. Check PVE task log for details."
 
-        task_status = response.get('data', {})
-        status = task_status.get('status')
-        exitstatus = task_status.get('exitstatus', 'N/A')
-        
-        if status == 'stopped':
-            if exitstatus == 'OK':
-                return f"SUCCESS: Task {upid} completed successfully. Exit status: {exitstatus}"
-            else:
-                return f"FAILURE: Task {upid} finished with error. Exit status: {exitstatus}. Check PVE task log for details."
-        
-        if time.time() - start_time > timeout:
-             return f"ERROR: Task {upid} timed out after {timeout} seconds. Current status: {status}"
-        
     return f"ERROR: Task {upid} timed out after {timeout} seconds. Current status: {status}"
 
 
@@ -482,13 +2481,16 @@ def reboot_vm(node: str, vmid: int) -> str:
 
 
 @mcp.tool
-def clone_vm(node: str, source_vmid: int, new_vmid: int, new_name: str, full_clone: bool = True) -> str:
+async def clone_vm(node: str, source_vmid: int, new_vmid: int, new_name: str, full_clone: bool = True,
+                   storage: Optional[str] = None) -> str:
     # clone_vm 克隆现有虚拟机 (模板) 到新的 ID 和名称
     # @param node: PVE 节点名称
     # @param source_vmid: 源虚拟机 (模板) 的 ID
     # @param new_vmid: 克隆机器的唯一 ID
     # @param new_name: 克隆机器的名称
     # @param full_clone: (可选) 是否执行完整克隆 (True) 或链接克隆 (False), 默认为 True
+    # @param storage: (可选) 完整克隆的目标存储, 为空时由调度器按可用空间与负载选择
+    # @note 克隆请求经 CloneScheduler 排队, 存储并发已满时会等待空闲名额
     # @return 任务 UPID 或错误消息
     """
     克隆现有的虚拟机或模板，创建新的虚拟机实例。
@@ -501,6 +2503,7 @@ def clone_vm(node: str, source_vmid: int, new_vmid: int, new_name: str, full_clo
         new_vmid: 新虚拟机的唯一ID，例如 101
         new_name: 新虚拟机的名称，例如 'worker-node-01'
         full_clone: 是否执行完整克隆（True）或链接克隆（False），默认为True
+        storage: 完整克隆的目标存储ID，例如 'local-lvm'；为空时自动选择可用空间大、负载低的存储
     
     克隆类型说明:
         - 完整克隆 (full_clone=True): 创建独立的磁盘副本，性能更好，但占用更多存储空间
@@ -521,6 +2524,7 @@ def clone_vm(node: str, source_vmid: int, new_vmid: int, new_name: str, full_clo
         2. 新虚拟机ID必须在集群中唯一
         3. 完整克隆需要足够的磁盘空间
         4. 克隆完成后通常需要配置网络和启动虚拟机
+        5. 同一存储上同时进行的克隆数量受限，超出的请求会排队，返回排队信息时可用 get_clone_queue_status 查看
         
     典型工作流程:
         1. 克隆模板: clone_vm('pve', 9000, 101, 'master')
@@ -534,8 +2538,9 @@ def clone_vm(node: str, source_vmid: int, new_vmid: int, new_name: str, full_clo
         'name': new_name,
         'full': 1 if full_clone else 0
     }
-    result = pve_client.clone_vm(node, source_vmid, payload)
-    return _handle_response(result, "VM clone")
+    if storage and full_clone:
+        payload['storage'] = storage
+    return await _to_thread(_submit_clone, node, source_vmid, payload, "VM clone")
 
 
 @mcp.tool
@@ -554,7 +2559,7 @@ def delete_vm(node: str, vmid: int) -> str:
 
 
 @mcp.tool
-def update_vm_config(node: str, vmid: int, updates: Dict[str, Any]) -> str:
+async def update_vm_config(node: str, vmid: int, updates: Dict[str, Any]) -> str:
     # update_vm_config 更新虚拟机的配置
     # @param node: PVE 节点名称
     # @param vmid: 要更新的虚拟机的 ID
@@ -598,14 +2603,500 @@ def update_vm_config(node: str, vmid: int, updates: Dict[str, Any]) -> str:
         })
     
     注意:
+        - 只会写入与当前配置不同的键，配置已是目标值时不会产生写入
         - 某些配置修改需要虚拟机处于停止状态
         - 可以一次更新多个配置参数
         - 对于复杂的配置值（如ipconfig0），需要按照Proxmox的格式提供字符串
         - 使用前最好检查虚拟机的当前状态
     """
     if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
-    result = pve_client.update_vm_config(node, vmid, updates)
-    return _handle_response(result, "VM config update")
+    return _format_config_update(await _to_thread(vm_config_cache.apply, node, vmid, updates))
+
+
+@mcp.tool
+async def bulk_update_vm_config(targets: List[Dict[str, Any]], updates: Dict[str, Any]) -> str:
+    # bulk_update_vm_config 将同一组配置应用到多台虚拟机
+    # @param targets: 虚拟机列表, 每项包含 node 与 vmid
+    # @param updates: 要应用的配置键值对
+    # @note 每台虚拟机只写入发生变化的键, 已是目标值的虚拟机不会产生写入; 多台虚拟机在工作线程中并发处理
+    # @return 每台虚拟机结果的 JSON 字符串
+    """
+    Applies the same config patch to many VMs in one call, e.g. setting cicustom or
+    memory on all workers. Like update_vm_config, only keys whose value actually
+    differs are written, so VMs already in the desired state are skipped.
+
+    Example:
+        bulk_update_vm_config([{'node': 'pve-1', 'vmid': 103}, {'node': 'pve-2', 'vmid': 104}],
+                              {'memory': 4096})
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not targets:
+        return "ERROR: targets must contain at least one VM."
+    if not updates:
+        return "ERROR: updates must not be empty."
+    invalid = [t for t in targets if not t.get('node') or not t.get('vmid')]
+    if invalid:
+        return f"ERROR: Each target needs 'node' and 'vmid'. Invalid entries: {invalid}"
+
+    def _apply(target: Dict[str, Any]) -> Dict[str, Any]:
+        applied = vm_config_cache.apply(target['node'], int(target['vmid']), updates)
+        return {"node": target['node'], "vmid": int(target['vmid']), "status": _format_config_update(applied)}
+
+    def _apply_all() -> List[Dict[str, Any]]:
+        with ThreadPoolExecutor(max_workers=min(len(targets), VM_CONFIG_MAX_WORKERS)) as executor:
+            return list(executor.map(_in_context(_apply), targets))
+
+    results = await _to_thread(_apply_all)
+    return json.dumps(results, indent=2)
+
+
+@mcp.tool
+async def wait_for_vm_ip(node: str, vmids: List[int], timeout: int = 180) -> str:
+    # wait_for_vm_ip 等待一台或多台虚拟机通过 QEMU Guest Agent 上报 IP 地址
+    # @param node: PVE 节点名称
+    # @param vmids: 虚拟机 ID 列表, 可只包含一个 ID
+    # @param timeout: (可选) 每台虚拟机的最大等待时间, 单位秒, 默认 180 秒
+    # @note 多台虚拟机并发等待, 总耗时约等于最慢的一台, 而不是逐台相加; 等待在工作线程中进行
+    # @return 包含每台虚拟机 IP 地址或超时信息的 JSON 字符串
+    """
+    Waits until the QEMU guest agent of each VM reports an IPv4 address and returns it.
+
+    Use this after start_vm, especially when ipconfig0 is 'ip=dhcp', instead of
+    polling get_vm_status (which does not contain the IP). Multiple VMs on the
+    same node are waited for concurrently with exponential backoff.
+
+    Example:
+        wait_for_vm_ip('pve-1', [101, 102])
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not vmids:
+        return "ERROR: vmids must contain at least one VM ID."
+
+    def _wait_all() -> List[Dict[str, Any]]:
+        with ThreadPoolExecutor(max_workers=min(len(vmids), GUEST_AGENT_MAX_WORKERS)) as executor:
+            return list(executor.map(_in_context(lambda vmid: _wait_for_guest_ip(node, vmid, timeout)), vmids))
+
+    results = await _to_thread(_wait_all)
+    return json.dumps(results, indent=2)
+
+
+@mcp.tool
+async def clone_from_template(node: str, new_name: str, new_vmid: Optional[int] = None) -> str:
+    # clone_from_template 从节点本地模板克隆新虚拟机, 自动选择链接克隆或完整克隆
+    # @param node: PVE 节点名称
+    # @param new_name: 克隆机器的名称, 必须符合命名规范
+    # @param new_vmid: (可选) 克隆机器的唯一 ID, 为空时自动分配下一个可用 ID
+    # @note 自动查找名为 '[节点名]-Template' 的本地模板, 无需传入源 VMID
+    # @return 任务 UPID 或错误消息
+    """
+    Clones a new VM from the node-local template '[node]-Template'. The template VMID
+    is looked up automatically. A full clone is made, or a linked clone when
+    TEMPLATE_PREFER_LINKED is enabled and the template's storage supports it.
+    Prefer this over clone_vm.
+
+    If new_vmid is omitted the next free VMID is allocated; it is included in the result.
+    If the node has no template, run sync_templates first.
+
+    Example:
+        clone_from_template('pve-1', 'pve-1-k3s-work2', 105)
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+
+    def _clone(vmid: Optional[int]) -> str:
+        template = template_manager.resolve(node)
+        if template is None:
+            return f"ERROR: Node {node} has no template '{TemplateManager.template_name(node)}'. Run sync_templates first."
+
+        if vmid is None:
+            allocated = clone_scheduler.allocate_vmid()
+            if 'error' in allocated:
+                return f"API ERROR: {allocated['error']}"
+            vmid = allocated['vmid']
+
+        payload = {
+            'newid': vmid,
+            'name': new_name,
+            'full': 0 if template['linked'] else 1,
+        }
+        clone_type = "linked" if template['linked'] else "full"
+        return _submit_clone(node, template['vmid'], payload, f"VM {clone_type} clone from template {template['vmid']} to VMID {vmid}")
+
+    return await _to_thread(_clone, new_vmid)
+
+
+@mcp.tool
+def get_clone_queue_status() -> str:
+    # get_clone_queue_status 查询克隆调度器的排队与运行情况
+    # @return 包含各存储运行中克隆数、排队任务与最近完成任务的 JSON 字符串
+    """
+    Shows the clone scheduler state: running clones per storage backend, queued clone
+    requests waiting for a free slot, and recently finished clones with their UPIDs.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    return json.dumps(clone_scheduler.status(), indent=2)
+
+
+@mcp.tool
+def list_templates() -> str:
+    # list_templates 盘点每个节点的模板及其是否支持链接克隆
+    # @return 包含各节点模板详情和缺少模板的节点列表的 JSON 字符串
+    """
+    Lists the '[node]-Template' template of every online node, the storages of its
+    disks and whether linked clones are supported, plus the nodes missing a template.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    inventory = template_manager.inventory()
+    if 'error' in inventory:
+        return f"API ERROR: {inventory['error']}"
+    return json.dumps(inventory, indent=2)
+
+
+@mcp.tool
+async def sync_templates(source_node: Optional[str] = None, nodes: Optional[List[str]] = None,
+                         refresh: bool = False, storage: Optional[str] = None) -> str:
+    # sync_templates 将模板复制到缺少模板的节点, 或强制刷新已有模板
+    # @param source_node: (可选) 源模板所在节点, 为空时自动选择
+    # @param nodes: (可选) 需要处理的节点列表, 为空时处理所有在线节点
+    # @param refresh: (可选) 为 True 时重新复制目标节点上的模板, 新模板就绪后再删除旧模板
+    # @param storage: (可选) 目标节点上的存储 ID
+    # @note 操作为同步执行, 完整克隆可能耗时数分钟; 源模板位于本地存储时先克隆再离线迁移到目标节点
+    # @return 每个节点处理结果的 JSON 字符串
+    """
+    Replicates the '[node]-Template' template to every node that lacks one (or to the
+    given nodes), so that cloning is always node-local. With refresh=True a fresh copy
+    is replicated first and the old template is deleted only after that succeeded.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    results = await _to_thread(template_manager.sync, source_node, nodes, refresh, storage)
+    return json.dumps(results, indent=2)
+
+
+@mcp.tool
+async def claim_warm_vm(node: str, new_name: str, ipconfig0: str = "ip=dhcp",
+                        cicustom: str = "user=cloud-init:snippets/work_node.yaml", start: bool = True) -> str:
+    # claim_warm_vm 从预热池领取一台已克隆好的虚拟机, 配置后立即启动
+    # @param node: PVE 节点名称
+    # @param new_name: 虚拟机的新名称, 必须符合命名规范
+    # @param ipconfig0: (可选) cloud-init 网络配置, 默认 'ip=dhcp'
+    # @param cicustom: (可选) cloud-init 自定义片段, 默认工作节点片段
+    # @param start: (可选) 是否立即启动, 为 False 时可先调用 apply_vm_snippet 再 start_vm
+    # @note 预热池为空或未启用时返回错误, 此时应回退到 clone_vm 流程
+    # @return 包含 vmid 与启动任务 UPID 的 JSON 字符串或错误消息
+    """
+    Claims a pre-cloned, stopped VM from the warm pool of the given node, applies
+    name/ipconfig0/cicustom and starts it. This replaces clone_vm + update_vm_config
+    + start_vm for k3s worker scale-out and takes seconds instead of minutes.
+
+    If no warm VM is available, fall back to the normal clone_vm workflow.
+    Pass start=False to run apply_vm_snippet on the claimed VM before start_vm.
+
+    Example:
+        claim_warm_vm('pve-1', 'pve-1-k3s-work3')
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not warm_pool:
+        return "ERROR: Warm pool is disabled (WARM_POOL_SIZE=0). Use clone_vm instead."
+
+    result = await _to_thread(warm_pool.claim, node, new_name, ipconfig0, cicustom, start)
+    if 'error' in result and 'vmid' not in result:
+        return f"ERROR: {result['error']} Use clone_vm instead."
+    return json.dumps(result, indent=2)
+
+
+@mcp.tool
+async def get_warm_pool_status() -> str:
+    # get_warm_pool_status 查询各节点预热池的状态
+    # @return 包含各节点可领取 VMID、克隆中 VMID 与最近错误的 JSON 字符串
+    """
+    Shows, per PVE node, which warm VMs are ready to be claimed and which are still cloning.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not warm_pool:
+        return "ERROR: Warm pool is disabled (WARM_POOL_SIZE=0)."
+    return json.dumps(await _to_thread(warm_pool.status), indent=2)
+
+
+@mcp.tool
+async def apply_vm_snippet(node: str, vmid: int, role: str, ipconfig0: str = "ip=dhcp") -> str:
+    # apply_vm_snippet 为单台虚拟机渲染专属 cloud-init 片段并配置 cicustom 与 ipconfig0
+    # @param node: PVE 节点名称
+    # @param vmid: 虚拟机 ID
+    # @param role: 节点类型, 'master' 或 'work'
+    # @param ipconfig0: (可选) cloud-init 网络配置, 默认 'ip=dhcp'
+    # @return 包含 cicustom 与片段文件名的 JSON 字符串或错误消息
+    """
+    Renders a per-VM cloud-init snippet (manager IP, registry, bootstrap URL and a
+    per-VM join ticket, node IP from a static ipconfig0) from the control/work node
+    template, stores it on the snippets storage and sets cicustom + ipconfig0 on the VM.
+
+    Use this instead of update_vm_config with a static cicustom value. The VM must be
+    stopped; start it afterwards with start_vm. Snippets replaced by a new render and
+    snippets of deleted VMs are removed automatically.
+
+    Example:
+        apply_vm_snippet('pve-1', 103, 'work', 'ip=192.168.10.103/24,gw=192.168.10.1')
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    await _to_thread(_collect_snippet_garbage)
+    result = await _to_thread(_apply_vm_snippet, node, vmid, role, ipconfig0)
+    if 'error' in result:
+        return f"ERROR: {result['error']}"
+    return json.dumps(result, indent=2)
+
+
+@mcp.tool
+async def apply_vm_snippets(vms: List[Dict[str, Any]]) -> str:
+    # apply_vm_snippets 批量为多台虚拟机渲染 cloud-init 片段并配置 cicustom
+    # @param vms: 虚拟机列表, 每项包含 node、vmid、role 与可选的 ipconfig0
+    # @note 未变化的片段不会重复渲染或写入; 执行前回收已删除虚拟机的片段
+    # @return 每台虚拟机结果的 JSON 字符串
+    """
+    Bulk version of apply_vm_snippet for provisioning many VMs at once.
+
+    Each item: {'node': 'pve-1', 'vmid': 103, 'role': 'work', 'ipconfig0': 'ip=dhcp'}
+    ('ipconfig0' is optional and defaults to 'ip=dhcp'). Unchanged snippets are not
+    rendered or written again.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not vms:
+        return "ERROR: vms must contain at least one VM."
+    invalid = [vm for vm in vms if not vm.get('node') or not vm.get('vmid') or not vm.get('role')]
+    if invalid:
+        return f"ERROR: Each VM needs 'node', 'vmid' and 'role'. Invalid entries: {invalid}"
+
+    def _apply(vm: Dict[str, Any]) -> Dict[str, Any]:
+        return _apply_vm_snippet(vm['node'], int(vm['vmid']), vm['role'], vm.get('ipconfig0') or "ip=dhcp")
+
+    def _apply_all() -> List[Dict[str, Any]]:
+        _collect_snippet_garbage()
+        with ThreadPoolExecutor(max_workers=min(len(vms), SNIPPET_MAX_WORKERS)) as executor:
+            return list(executor.map(_in_context(_apply), vms))
+
+    results = await _to_thread(_apply_all)
+    return json.dumps(results, indent=2)
+
+
+@mcp.tool
+async def get_vm_metrics_history(node: str, vmids: List[int], window_minutes: int = 60, cf: str = "AVERAGE") -> str:
+    # get_vm_metrics_history 汇总一台或多台虚拟机在时间窗口内的历史指标
+    # @param node: PVE 节点名称
+    # @param vmids: 虚拟机 ID 列表
+    # @param window_minutes: (可选) 时间窗口, 单位分钟, 默认 60
+    # @param cf: (可选) RRD 聚合函数, 'AVERAGE' (默认) 或 'MAX'
+    # @note 多台虚拟机在工作线程中并发获取, 返回统计值而不是原始数据点
+    # @return 每台虚拟机指标统计的 JSON 字符串
+    """
+    Summarizes the RRD history of VMs over the last `window_minutes`, so you can tell
+    a short spike from a sustained trend (e.g. while handling an alert).
+
+    For each metric (cpu_pct, mem_pct, netin, netout, diskread, diskwrite; network and
+    disk in bytes/s) it returns mean, p95, max, last, slope_per_hour (positive = rising)
+    and anomalies (number of points more than 3 standard deviations from the mean).
+    The RRD resolution is picked automatically: 1 minute up to 60 minutes, 30 minutes
+    up to a day, coarser beyond that.
+
+    Example:
+        get_vm_metrics_history('pve-1', [101, 102], window_minutes=180)
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not vmids:
+        return "ERROR: vmids must contain at least one VM ID."
+    if cf not in ("AVERAGE", "MAX"):
+        return "ERROR: cf must be 'AVERAGE' or 'MAX'."
+
+    def _fetch_all() -> List[Dict[str, Any]]:
+        with ThreadPoolExecutor(max_workers=min(len(vmids), RRD_MAX_WORKERS)) as executor:
+            return list(executor.map(_in_context(lambda vmid: _fetch_rrd_summary(node, vmid, window_minutes, cf)), vmids))
+
+    results = await _to_thread(_fetch_all)
+    return json.dumps(results, indent=2)
+
+
+@mcp.tool
+async def get_node_metrics_history(nodes: Optional[List[str]] = None, window_minutes: int = 60,
+                                   cf: str = "AVERAGE") -> str:
+    # get_node_metrics_history 汇总 PVE 节点在时间窗口内的历史指标
+    # @param nodes: (可选) 节点名称列表, 默认集群内所有节点
+    # @param window_minutes: (可选) 时间窗口, 单位分钟, 默认 60
+    # @param cf: (可选) RRD 聚合函数, 'AVERAGE' (默认) 或 'MAX'
+    # @return 每个节点指标统计的 JSON 字符串
+    """
+    Summarizes the RRD history of PVE nodes (cpu_pct, mem_pct, iowait_pct, loadavg,
+    netin, netout) over the last `window_minutes`, with the same statistics as
+    get_vm_metrics_history. All nodes are queried when `nodes` is omitted.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if cf not in ("AVERAGE", "MAX"):
+        return "ERROR: cf must be 'AVERAGE' or 'MAX'."
+    if not nodes:
+        result = await _to_thread(pve_client.get_node_list)
+        if not result or 'error' in result:
+            return f"ERROR: Failed to retrieve node list. Details: {result}"
+        nodes = [n['node'] for n in result.get('data') or [] if n.get('status') == 'online']
+        if not nodes:
+            return "ERROR: No online nodes found."
+
+    def _fetch_all() -> List[Dict[str, Any]]:
+        with ThreadPoolExecutor(max_workers=min(len(nodes), RRD_MAX_WORKERS)) as executor:
+            return list(executor.map(_in_context(lambda node: _fetch_rrd_summary(node, None, window_minutes, cf)), nodes))
+
+    results = await _to_thread(_fetch_all)
+    return json.dumps(results, indent=2)
+
+
+@mcp.tool
+async def snapshot_vms(snapname: str, vmids: Optional[List[int]] = None, name_pattern: Optional[str] = None,
+                       nodes: Optional[List[str]] = None, description: str = "", include_ram: bool = False) -> str:
+    # snapshot_vms 为选中的一组虚拟机创建同名快照
+    # @param snapname: 快照名称, 以字母开头, 只包含字母、数字、'_' 与 '-'
+    # @param vmids: (可选) 虚拟机 ID 列表
+    # @param name_pattern: (可选) 虚拟机名称的正则表达式
+    # @param nodes: (可选) 节点名称列表
+    # @param description: (可选) 快照描述
+    # @param include_ram: (可选) 是否保存运行中虚拟机的内存状态, 默认否
+    # @note 并发执行, 每个节点与每个存储后端上同时运行的任务数受 SNAPSHOT_MAX_PER_NODE / SNAPSHOT_MAX_PER_STORAGE 限制
+    # @return 汇总结果的 JSON 字符串
+    """
+    Takes a snapshot named `snapname` of every selected VM in one call. Use it as a
+    safety net BEFORE risky bulk changes (bulk_update_vm_config, k3s upgrades), so the
+    whole group can be restored with rollback_vms_to_snapshot.
+
+    Select VMs with any combination of `vmids`, `name_pattern` (regex searched in the
+    VM name) and `nodes`; combined selectors are intersected. Snapshots run in
+    parallel with per-node and per-storage limits, and each PVE task is awaited.
+
+    Example:
+        snapshot_vms('pre-upgrade', name_pattern='^k3s-', description='before k3s 1.31')
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not SNAPSHOT_NAME_PATTERN.match(snapname or ''):
+        return "ERROR: snapname must start with a letter and contain only letters, digits, '_' or '-' (2-40 chars)."
+    selection = await _to_thread(_select_vms, vmids, name_pattern, nodes)
+    if 'error' in selection:
+        return f"ERROR: {selection['error']}"
+
+    return await _run_snapshot_action(
+        selection['vms'], snapname,
+        lambda node, vmid: pve_client.create_vm_snapshot(node, vmid, snapname, description, include_ram),
+        include_ram,
+    )
+
+
+@mcp.tool
+async def list_vm_snapshots(vmids: Optional[List[int]] = None, name_pattern: Optional[str] = None,
+                            nodes: Optional[List[str]] = None) -> str:
+    # list_vm_snapshots 列出选中虚拟机的快照
+    # @param vmids: (可选) 虚拟机 ID 列表
+    # @param name_pattern: (可选) 虚拟机名称的正则表达式
+    # @param nodes: (可选) 节点名称列表
+    # @return 每台虚拟机快照列表的 JSON 字符串
+    """
+    Lists the snapshots (name, description, creation time, parent, whether RAM was
+    saved) of the selected VMs. Uses the same selectors as snapshot_vms.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    selection = await _to_thread(_select_vms, vmids, name_pattern, nodes)
+    if 'error' in selection:
+        return f"ERROR: {selection['error']}"
+
+    def _list(vm: Dict[str, Any]) -> Dict[str, Any]:
+        result = pve_client.list_vm_snapshots(vm['node'], vm['vmid'])
+        if not result or 'error' in result:
+            return {**vm, "error": result.get('error') if result else "result is None"}
+        snapshots = [
+            {
+                "name": s.get('name'),
+                "description": s.get('description', ''),
+                "snaptime": s.get('snaptime'),
+                "parent": s.get('parent'),
+                "vmstate": bool(s.get('vmstate')),
+            }
+            for s in result.get('data') or [] if s.get('name') != 'current'
+        ]
+        return {**vm, "snapshots": sorted(snapshots, key=lambda s: s['snaptime'] or 0)}
+
+    def _list_all(vms: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with ThreadPoolExecutor(max_workers=min(len(vms), SNAPSHOT_MAX_WORKERS)) as executor:
+            return list(executor.map(_in_context(_list), vms))
+
+    results = await _to_thread(_list_all, selection['vms'])
+    return json.dumps(results, indent=2)
+
+
+@mcp.tool
+async def rollback_vms_to_snapshot(snapname: str, vmids: Optional[List[int]] = None, name_pattern: Optional[str] = None,
+                                   nodes: Optional[List[str]] = None, start: bool = False) -> str:
+    # rollback_vms_to_snapshot 将选中的一组虚拟机回滚到同名快照
+    # @param snapname: 快照名称
+    # @param vmids: (可选) 虚拟机 ID 列表
+    # @param name_pattern: (可选) 虚拟机名称的正则表达式
+    # @param nodes: (可选) 节点名称列表
+    # @param start: (可选) 回滚完成后是否启动虚拟机, 默认否
+    # @note 运行中的虚拟机会被停止, 快照之后的修改全部丢失; 没有该快照的虚拟机会在结果中报告失败
+    # @return 汇总结果的 JSON 字符串
+    """
+    Rolls every selected VM back to snapshot `snapname` in one call, in parallel.
+    USE WITH CAUTION: running VMs are stopped and all changes made after the
+    snapshot are lost. Set start=True to boot the VMs again after the rollback.
+    Uses the same selectors as snapshot_vms; VMs without that snapshot are
+    reported as failed.
+
+    Example:
+        rollback_vms_to_snapshot('pre-upgrade', name_pattern='^k3s-', start=True)
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not SNAPSHOT_NAME_PATTERN.match(snapname or ''):
+        return "ERROR: Invalid snapname."
+    selection = await _to_thread(_select_vms, vmids, name_pattern, nodes)
+    if 'error' in selection:
+        return f"ERROR: {selection['error']}"
+
+    # 快照可能包含内存状态, 回滚时会读取 vmstatestorage
+    return await _run_snapshot_action(
+        selection['vms'], snapname,
+        lambda node, vmid: pve_client.rollback_vm_snapshot(node, vmid, snapname, start),
+        True,
+    )
+
+
+@mcp.tool
+async def delete_vm_snapshots(snapname: str, vmids: Optional[List[int]] = None, name_pattern: Optional[str] = None,
+                              nodes: Optional[List[str]] = None) -> str:
+    # delete_vm_snapshots 删除选中虚拟机的同名快照
+    # @param snapname: 快照名称
+    # @param vmids: (可选) 虚拟机 ID 列表
+    # @param name_pattern: (可选) 虚拟机名称的正则表达式
+    # @param nodes: (可选) 节点名称列表
+    # @return 汇总结果的 JSON 字符串
+    """
+    Deletes snapshot `snapname` from every selected VM, in parallel. Use it to clean
+    up once a bulk change has been verified. Uses the same selectors as snapshot_vms.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    if not SNAPSHOT_NAME_PATTERN.match(snapname or ''):
+        return "ERROR: Invalid snapname."
+    selection = await _to_thread(_select_vms, vmids, name_pattern, nodes)
+    if 'error' in selection:
+        return f"ERROR: {selection['error']}"
+
+    # 快照可能包含内存状态, 删除时同时删除 vmstatestorage 上的状态卷
+    return await _run_snapshot_action(
+        selection['vms'], snapname,
+        lambda node, vmid: pve_client.delete_vm_snapshot(node, vmid, snapname),
+        True,
+    )
+
+
+@mcp.tool
+def get_snapshot_queue_status() -> str:
+    # get_snapshot_queue_status 查看各节点与存储上正在运行的快照任务数
+    # @return 状态的 JSON 字符串
+    """
+    Shows how many snapshot tasks are currently running per node and per storage,
+    and the configured limits.
+    """
+    if not pve_client or not pve_client.is_authenticated: return "ERROR: PVE client is not authenticated."
+    return json.dumps(snapshot_coordinator.status(), indent=2)
 
 
 # --- 4. MAIN EXECUTION BLOCK ---
@@ -616,6 +3107,12 @@ def initialize_pve_agent():
     # @note 创建 PveApiClient 实例并尝试进行 API Token 认证。
     # @return None
     global pve_client
+    global clone_scheduler
+    global template_manager
+    global warm_pool
+    global snippet_renderer
+    global vm_config_cache
+    global snapshot_coordinator
     
     print("-" * 50)
     print(f"INFO: PVE Host: {PVE_HOST}")
@@ -631,6 +3128,54 @@ def initialize_pve_agent():
     
     if not pve_client.authenticate():
         print("WARNING: Failed to initialize PVE API Token client.")
+        return
+
+    clone_scheduler = CloneScheduler(
+        client=pve_client,
+        max_per_storage=CLONE_MAX_PER_STORAGE,
+    )
+    clone_scheduler.start()
+
+    template_manager = TemplateManager(
+        client=pve_client,
+        scheduler=clone_scheduler,
+        prefer_linked=TEMPLATE_PREFER_LINKED,
+        cache_ttl=TEMPLATE_CACHE_TTL,
+    )
+
+    vm_config_cache = VmConfigCache(client=pve_client, ttl=VM_CONFIG_CACHE_TTL)
+
+    snapshot_coordinator = SnapshotCoordinator(
+        client=pve_client,
+        max_per_node=SNAPSHOT_MAX_PER_NODE,
+        max_per_storage=SNAPSHOT_MAX_PER_STORAGE,
+        max_workers=SNAPSHOT_MAX_WORKERS,
+        task_timeout=SNAPSHOT_TASK_TIMEOUT,
+    )
+
+    snippet_renderer = SnippetRenderer(
+        template_dir=SNIPPET_TEMPLATE_DIR,
+        output_dir=SNIPPET_OUTPUT_DIR,
+        storage=SNIPPET_STORAGE,
+        manager_ip=MANAGER_IP,
+        registry_endpoint=REGISTRY_ENDPOINT,
+        bootstrap_url=BOOTSTRAP_URL,
+        bootstrap_admin_url=BOOTSTRAP_ADMIN_URL,
+        bootstrap_token=BOOTSTRAP_ADMIN_TOKEN,
+    )
+
+    if WARM_POOL_SIZE > 0:
+        warm_pool = WarmPoolManager(
+            client=pve_client,
+            templates=template_manager,
+            scheduler=clone_scheduler,
+            config_cache=vm_config_cache,
+            size=WARM_POOL_SIZE,
+            name_prefix=WARM_POOL_PREFIX,
+            interval=WARM_POOL_INTERVAL,
+            nodes=WARM_POOL_NODES,
+        )
+        warm_pool.start()
 
 
 if __name__ == "__main__":
@@ -2,30 +2,93 @@ from langgraph.checkpoint.memory import InMemorySaver
 from langchain.agents import create_agent
 from langchain.agents.structured_output import ToolStrategy
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain.agents.middleware import HumanInTheLoopMiddleware
+from langchain.agents.middleware import AgentMiddleware, HumanInTheLoopMiddleware, ModelRequest
 from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.config import get_config
+from mcp.types import CallToolResult, TextContent
 from pydantic import BaseModel
+import anyio
 import asyncio
+import httpx
 import os
 import time
 import json
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from typing import Generator, List, Dict, Any, Optional
 from dotenv import load_dotenv
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
 
 # 加载 .env 文件
 load_dotenv()
 
 
 # --- 全局变量 ---
-agent_instance = None
-mcp_client = None
+supervisor = None
+dashboard = None
 MONITOR_QUEUES: List[asyncio.Queue] = []
 
+# 追踪配置: span 以 JSON Lines (OpenTelemetry span JSON) 追加写入 TRACE_EXPORT_PATH, 为空时只传播不导出
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SERVICE_NAME = "pve-agent"
+
+
+def setup_tracing(service_name: str, export_path: str) -> trace.Tracer:
+    """初始化 OpenTelemetry TracerProvider，设置 export_path 时将 span 写入 JSON Lines 文件。"""
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if export_path:
+        os.makedirs(os.path.dirname(export_path) or ".", exist_ok=True)
+        exporter = ConsoleSpanExporter(
+            out=open(export_path, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer(service_name)
+
+
+tracer = setup_tracing(TRACE_SERVICE_NAME, TRACE_EXPORT_PATH)
+
+# 上下文预算配置: 每次模型调用的 token 预算、保留原文的最近工具结果数、较早工具结果压缩后的最大字符数
+AGENT_CONTEXT_BUDGET = int(os.getenv("AGENT_CONTEXT_BUDGET", "24000"))
+AGENT_KEEP_TOOL_RESULTS = int(os.getenv("AGENT_KEEP_TOOL_RESULTS", "3"))
+AGENT_TOOL_RESULT_MAX_CHARS = int(os.getenv("AGENT_TOOL_RESULT_MAX_CHARS", "1500"))
+# 中英文混合内容按每 token 约 2 个字符估算 (纯英文约 4 个)
+CONTEXT_CHARS_PER_TOKEN = 2.0
+CONTEXT_DROPPED_PLACEHOLDER = "[tool result omitted to stay within the context budget]"
+
+# MCP 连接守护配置: 心跳间隔与超时、重连退避的初始/最大间隔 (秒)，以及 /chat 等待冷启动连接的最长时间
+AGENT_MCP_PING_INTERVAL = float(os.getenv("AGENT_MCP_PING_INTERVAL", "15"))
+AGENT_MCP_PING_TIMEOUT = 5.0
+AGENT_MCP_RETRY_INITIAL_DELAY = 1.0
+AGENT_MCP_RETRY_MAX_DELAY = float(os.getenv("AGENT_MCP_RETRY_MAX_DELAY", "60"))
+AGENT_MCP_CONNECT_TIMEOUT = float(os.getenv("AGENT_MCP_CONNECT_TIMEOUT", "10"))
+PROMPT_PATH = "prompt.txt"
+
+# 监控面板配置: 有 panel.html 订阅时每 DASHBOARD_INTERVAL 秒查询一次 Prometheus，结果缓存并以增量推送给所有订阅者
+PROMETHEUS_URL = os.getenv("PROMETHEUS_URL", "http://prometheus:9090")
+DASHBOARD_INTERVAL = float(os.getenv("DASHBOARD_INTERVAL", "2"))
+DASHBOARD_QUEUE_SIZE = 16
+DASHBOARD_QUERIES = {
+    "up": 'up',
+    "cpu": '100 - (avg by(instance) (irate(node_cpu_seconds_total{mode="idle"}[1m])) * 100)',
+    "memory": '(1 - (node_memory_MemAvailable_bytes / node_memory_MemTotal_bytes)) * 100',
+}
+# 详情图表的区间查询 (instance 由请求参数填入) 与各时间范围 (分钟) 对应的采样步长 (秒)
+DASHBOARD_HISTORY_QUERIES = {
+    "cpu": '100 - (avg by(instance) (irate(node_cpu_seconds_total{{mode="idle", instance="{instance}"}}[1m])) * 100)',
+    "memory": '(1 - (node_memory_MemAvailable_bytes{{instance="{instance}"}} / node_memory_MemTotal_bytes{{instance="{instance}"}})) * 100',
+}
+DASHBOARD_HISTORY_STEPS = {1: 2, 5: 10, 30: 30}
+
 async def broadcast_event(event_data: Dict[str, Any]):
     """向所有监控客户端广播事件"""
     for q in MONITOR_QUEUES:
@@ -41,26 +104,613 @@ class ChatRequest(BaseModel):
     message: str
     thread_id: int = 1
 
-def SetAgent(model: str, tools: list, response_format: type, checkpointer: InMemorySaver, system_prompt: str):
+async def trace_tool_call(request, handler):
+    """
+    MCP 工具调用拦截器：为每次工具调用创建 agent.tool_call span，
+    并通过 traceparent 请求头把追踪上下文传给 MCP 服务。
+    父 span 来自 agent.astream 的 configurable.traceparent。
+    """
+    config = getattr(request.runtime, "config", None) or {}
+    traceparent = config.get("configurable", {}).get("traceparent")
+    parent = propagate.extract({"traceparent": traceparent}) if traceparent else None
+
+    with tracer.start_as_current_span(f"agent.tool_call {request.name}", context=parent,
+                                      kind=trace.SpanKind.CLIENT, attributes={"mcp.tool.name": request.name}):
+        headers = {}
+        propagate.inject(headers)
+        return await handler(request.override(headers={**(request.headers or {}), **headers}))
+
+class ContextBudgetMiddleware(AgentMiddleware):
+    """
+    上下文预算中间件。
+    每次调用模型前：
+    1. 工具列表按名称排序，与 System Prompt 一起构成固定前缀，提高模型服务端的前缀缓存 (prompt cache) 命中率；
+    2. 除最近 keep_recent 条外，较早的工具结果确定性地压缩 (JSON 列表只保留前几项，长文本保留首尾)，
+       同一条消息每轮压缩结果相同，不会破坏已缓存的前缀；
+    3. 仍超出 budget_tokens 时，从最早的工具结果开始替换为占位文本，直到满足预算；
+    4. 每轮广播上下文大小 (压缩前/后的估算 token 数与模型返回的实际用量)。
+    只修改发给模型的消息，不修改 checkpointer 中保存的历史。
+    """
+
+    def __init__(self, budget_tokens: int, keep_recent: int, max_tool_chars: int):
+        super().__init__()
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.max_tool_chars = max_tool_chars
+        self._prefix_tokens: Dict[Any, int] = {}
+
+    @staticmethod
+    def _tool_name(tool: Any) -> str:
+        if isinstance(tool, dict):
+            return tool.get("name") or tool.get("function", {}).get("name", "")
+        return getattr(tool, "name", "")
+
+    @staticmethod
+    def _count(messages: list) -> int:
+        return count_tokens_approximately(messages, chars_per_token=CONTEXT_CHARS_PER_TOKEN)
+
+    def _prefix_size(self, request: ModelRequest, tools: list) -> int:
+        """System Prompt 与工具定义的估算 token 数，前缀不变时只计算一次。"""
+        system_text = request.system_message.text if request.system_message else ""
+        key = (hash(system_text), tuple(self._tool_name(t) for t in tools))
+        if key not in self._prefix_tokens:
+            schemas = json.dumps([convert_to_openai_tool(t) for t in tools], ensure_ascii=False, default=str)
+            self._prefix_tokens[key] = int((len(system_text) + len(schemas)) / CONTEXT_CHARS_PER_TOKEN)
+        return self._prefix_tokens[key]
+
+    def _compact(self, content: str) -> str:
+        """确定性地压缩一条工具结果。"""
+        if len(content) <= self.max_tool_chars:
+            return content
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            kept = []
+            for item in data:
+                if len(json.dumps(kept + [item], ensure_ascii=False)) > self.max_tool_chars:
+                    break
+                kept.append(item)
+            return (f"[compacted: first {len(kept)} of {len(data)} items]\n"
+                    f"{json.dumps(kept, ensure_ascii=False)}")
+        half = self.max_tool_chars // 2
+        return f"{content[:half]}\n...[compacted: {len(content) - 2 * half} chars omitted]...\n{content[-half:]}"
+
+    def _compact_content(self, content: Any) -> Any:
+        """压缩工具结果的 content：字符串直接压缩；MCP 工具返回的内容块列表逐个压缩其中的文本块，其他块原样保留。"""
+        if isinstance(content, str):
+            return self._compact(content)
+        if not isinstance(content, list):
+            return content
+        blocks = []
+        for block in content:
+            if isinstance(block, str):
+                block = self._compact(block)
+            elif isinstance(block, dict) and block.get("type") == "text" and isinstance(block.get("text"), str):
+                block = {**block, "text": self._compact(block["text"])}
+            blocks.append(block)
+        return blocks
+
+    def _prepare(self, request: ModelRequest):
+        """返回调整后的请求与本轮的上下文统计。"""
+        tools = sorted(request.tools, key=self._tool_name)
+        messages = list(request.messages)
+        prefix_tokens = self._prefix_size(request, tools)
+        tokens_before = prefix_tokens + self._count(messages)
+
+        tool_indexes = [i for i, m in enumerate(messages) if isinstance(m, ToolMessage)]
+        old_indexes = tool_indexes[:-self.keep_recent] if self.keep_recent else tool_indexes
+        compacted_count = 0
+        for i in old_indexes:
+            compacted = self._compact_content(messages[i].content)
+            if compacted != messages[i].content:
+                messages[i] = messages[i].model_copy(update={"content": compacted})
+                compacted_count += 1
+
+        dropped = 0
+        tokens_after = prefix_tokens + self._count(messages)
+        for i in tool_indexes[:-1]:
+            if tokens_after <= self.budget_tokens:
+                break
+            messages[i] = messages[i].model_copy(update={"content": CONTEXT_DROPPED_PLACEHOLDER})
+            dropped += 1
+            tokens_after = prefix_tokens + self._count(messages)
+
+        stats = {
+            "messages": len(messages),
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "prefix_tokens": prefix_tokens,
+            "compacted": compacted_count,
+            "dropped": dropped,
+            "budget": self.budget_tokens,
+        }
+        return request.override(messages=messages, tools=tools), stats
+
+    @staticmethod
+    def _usage(response: Any) -> Optional[Dict[str, Any]]:
+        """从模型响应中取出实际的 token 用量 (含前缀缓存命中数)。"""
+        result = getattr(response, "result", None) or []
+        usage = getattr(result[0], "usage_metadata", None) if result else None
+        if not usage:
+            return None
+        return {
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+            "cache_read": (usage.get("input_token_details") or {}).get("cache_read"),
+        }
+
+    def wrap_model_call(self, request: ModelRequest, handler):
+        request, stats = self._prepare(request)
+        response = handler(request)
+        print(f"上下文大小: {stats} 实际用量: {self._usage(response)}")
+        return response
+
+    async def awrap_model_call(self, request: ModelRequest, handler):
+        request, stats = self._prepare(request)
+        response = await handler(request)
+        stats["usage"] = self._usage(response)
+
+        try:
+            configurable = get_config().get("configurable", {})
+        except RuntimeError:
+            configurable = {}
+        traceparent = configurable.get("traceparent") or ""
+        await broadcast_event({
+            "timestamp": time.time(),
+            "thread_id": configurable.get("thread_id"),
+            "trace_id": traceparent.split("-")[1] if traceparent.count("-") == 3 else None,
+            "type": "context",
+            "content": f"上下文约 {stats['tokens_after']} tokens (压缩前 {stats['tokens_before']}, 预算 {self.budget_tokens})",
+            **stats,
+        })
+        return response
+
+def SetAgent(model: str, tools: list, response_format: type, checkpointer: InMemorySaver, system_prompt: str,
+             middleware: Optional[list] = None):
     agent = create_agent(
         model=model,
         tools=tools,
         response_format=ToolStrategy(response_format),
         checkpointer=checkpointer,
         system_prompt=system_prompt,
+        middleware=middleware or [],
     )
     return agent
 
-async def sse_generator(agent, msg: str, thread_id: int):
+class McpSupervisor:
+    """
+    MCP 连接守护。
+    - 在后台任务中维持到 MCP 服务的持久会话，连接失败时指数退避重试，MCP 服务未启动时 Agent 也能先启动；
+    - 定期 ping 会话，MCP 服务重启导致会话失效时重新连接，并按新的工具列表重建 Agent；
+    - 工具调用经 route_tool_call 拦截器走持久会话 (traceparent 放在 MCP 调用的 _meta 中)，
+      避免每次调用都重新建立连接和初始化会话；尚未建立会话时回退到按次建立连接；
+    - 有工具调用在执行时心跳超时不视为断线 (同步工具会阻塞 MCP 服务)，只有连接真正断开才重连；
+    - prompt.txt 修改后自动重建 Agent。
+    Agent 重建时沿用同一个 checkpointer，已有对话的历史不会丢失。
+    持久会话由单独的 _hold_session 任务持有 (anyio 要求在同一任务中进入和退出会话)，
+    传输层出错时只会结束该任务，不会影响 run() 循环。
+    """
+
+    def __init__(self, mcp_url: str, server_name: str, prompt_path: str):
+        self.server_name = server_name
+        self.prompt_path = prompt_path
+        self.client = MultiServerMCPClient(
+            {
+                server_name: {
+                    "transport": "streamable_http",
+                    "url": f"{mcp_url}"
+                }
+            },
+            tool_interceptors=[trace_tool_call, self.route_tool_call],
+        )
+        self.checkpointer = InMemorySaver()
+        self.session = None
+        self.agent = None
+        self.tool_names: List[str] = []
+        self.prompt_mtime: Optional[float] = None
+        self.connected_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.reconnects = 0
+        self._inflight = 0
+        self._session_task: Optional[asyncio.Task] = None
+        self._closing = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    def _load_prompt(self) -> str:
+        """读取 prompt.txt 并记录修改时间。"""
+        try:
+            self.prompt_mtime = os.stat(self.prompt_path).st_mtime
+            with open(self.prompt_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            print("警告：prompt.txt 未找到！将使用默认空 Prompt。")
+            self.prompt_mtime = None
+            return "You are a helpful assistant."
+
+    def _prompt_changed(self) -> bool:
+        """prompt.txt 的修改时间与上次加载时不同 (包括被删除或新建) 时返回 True。"""
+        try:
+            mtime = os.stat(self.prompt_path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        return mtime != self.prompt_mtime
+
+    async def _build_agent(self) -> None:
+        """按当前工具列表与 prompt.txt 重建 Agent。"""
+        tools_list = await self.client.get_tools(server_name=self.server_name)
+        names = sorted(t.name for t in tools_list)
+        if self.tool_names and names != self.tool_names:
+            print(f"MCP 工具列表已更新: {names}")
+        self.tool_names = names
+
+        self.agent = SetAgent(
+            model="deepseek-chat",
+            tools=tools_list,
+            response_format=ResponseFormat,
+            checkpointer=self.checkpointer,
+            system_prompt=self._load_prompt(),
+            middleware=[ContextBudgetMiddleware(
+                budget_tokens=AGENT_CONTEXT_BUDGET,
+                keep_recent=AGENT_KEEP_TOOL_RESULTS,
+                max_tool_chars=AGENT_TOOL_RESULT_MAX_CHARS,
+            )],
+        )
+        self._ready.set()
+
+    @staticmethod
+    def _describe(error: BaseException) -> str:
+        """展开 ExceptionGroup，返回最内层的错误描述。"""
+        while isinstance(error, BaseExceptionGroup) and error.exceptions:
+            error = error.exceptions[0]
+        return f"{type(error).__name__}: {error}"
+
+    async def _hold_session(self, connected: asyncio.Future) -> None:
+        """持有持久会话直到 _disconnect 或连接断开。"""
+        try:
+            async with self.client.session(self.server_name) as session:
+                self.session = session
+                connected.set_result(session)
+                await self._closing.wait()
+        except Exception as e:
+            if not connected.done():
+                connected.set_exception(e)
+            else:
+                self.last_error = self._describe(e)
+                print(f"MCP 会话已断开: {self.last_error}")
+        finally:
+            self.session = None
+            if not connected.done():
+                connected.set_exception(anyio.ClosedResourceError("MCP session closed"))
+
+    async def _connect(self) -> None:
+        """建立持久会话并构建 Agent。"""
+        self._closing = asyncio.Event()
+        connected = asyncio.get_running_loop().create_future()
+        self._session_task = asyncio.create_task(self._hold_session(connected))
+        try:
+            await connected
+            await self._build_agent()
+        except BaseException:
+            await self._disconnect()
+            raise
+        self.connected_at = time.time()
+        self.last_error = None
+        print(f"MCP 已连接，获取到工具: {self.tool_names}")
+
+    async def _disconnect(self) -> None:
+        """关闭持久会话 (Agent 保留，工具调用回退到按次建立连接)。"""
+        task, self._session_task = self._session_task, None
+        if task is None:
+            return
+        self._closing.set()
+        try:
+            await asyncio.wait_for(task, timeout=AGENT_MCP_PING_TIMEOUT)
+        except asyncio.TimeoutError:
+            task.cancel()
+        except Exception as e:
+            print(f"关闭 MCP 会话时出错: {self._describe(e)}")
+
+    async def _in_session(self, coro, timeout: Optional[float] = None):
+        """
+        在持久会话上等待请求结果；会话任务先结束 (连接断开) 时立即抛出 ClosedResourceError，
+        避免请求一直等到超时。
+        """
+        request = asyncio.ensure_future(coro)
+        watched = {request}
+        if self._session_task is not None:
+            watched.add(self._session_task)
+        done, _ = await asyncio.wait(watched, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if request in done:
+            return request.result()
+        request.cancel()
+        if not done:
+            raise asyncio.TimeoutError("MCP request timed out")
+        raise anyio.ClosedResourceError("MCP session closed")
+
+    async def _handle_failure(self, error: str, delay: float) -> tuple:
+        """记录错误并关闭会话，返回本次等待时间与下一次的退避间隔。"""
+        self.last_error = error
+        print(f"MCP 连接不可用，{delay:.0f} 秒后重试。错误信息: {error}")
+        await self._disconnect()
+        return delay, min(delay * 2, AGENT_MCP_RETRY_MAX_DELAY)
+
+    async def run(self) -> None:
+        """后台任务：连接、心跳检查、断线重连与 prompt 热加载。"""
+        delay = AGENT_MCP_RETRY_INITIAL_DELAY
+        try:
+            while True:
+                try:
+                    if self.session is None or self._session_task is None or self._session_task.done():
+                        await self._disconnect()
+                        await self._connect()
+                        if self.reconnects:
+                            print("MCP 服务已重新连接，Agent 已按新的工具列表重建。")
+                        self.reconnects += 1
+                    else:
+                        await self._in_session(self.session.send_ping(), timeout=AGENT_MCP_PING_TIMEOUT)
+                        if self._prompt_changed():
+                            print("prompt.txt 已修改，正在重建 Agent...")
+                            await self._build_agent()
+                    delay = AGENT_MCP_RETRY_INITIAL_DELAY
+                    wait = AGENT_MCP_PING_INTERVAL
+                except asyncio.TimeoutError:
+                    # 耗时较长的工具调用可能让服务暂时无法响应心跳，会话仍在时不断开
+                    if self._inflight and self._session_task is not None and not self._session_task.done():
+                        print("MCP 心跳超时，但仍有工具调用在执行，保留当前会话。")
+                        wait = AGENT_MCP_PING_INTERVAL
+                    else:
+                        wait, delay = await self._handle_failure("MCP request timed out", delay)
+                except Exception as e:
+                    wait, delay = await self._handle_failure(self._describe(e), delay)
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self._disconnect()
+
+    async def get_agent(self):
+        """
+        返回可用的 Agent。尚未初始化时唤醒后台任务立即重试，最多等待 AGENT_MCP_CONNECT_TIMEOUT 秒；
+        prompt.txt 修改后同样唤醒后台任务重建。
+        """
+        if self.agent is None or self._prompt_changed():
+            self._ready.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=AGENT_MCP_CONNECT_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        return self.agent
+
+    async def route_tool_call(self, request, handler):
+        """
+        MCP 工具调用拦截器：通过持久会话调用工具，traceparent 放在 _meta 中传给 MCP 服务。
+        只有尚未建立会话时才回退到按次建立连接；请求一旦发出，会话中途断开也不会重试
+        (工具可能已经执行，重试会重复创建或删除虚拟机)，而是唤醒后台任务重连并把错误返回给模型。
+        MCP 协议错误 (McpError) 原样抛出，不重试。
+        """
+        session = self.session
+        if session is None:
+            return await handler(request)
+
+        traceparent = (request.headers or {}).get("traceparent")
+        self._inflight += 1
+        try:
+            return await self._in_session(
+                session.call_tool(
+                    request.name,
+                    request.args,
+                    meta={"traceparent": traceparent} if traceparent else None,
+                )
+            )
+        except (anyio.ClosedResourceError, anyio.BrokenResourceError, httpx.TransportError) as e:
+            print(f"MCP 会话在工具 {request.name} 执行期间断开: {self._describe(e)}")
+            self._wakeup.set()
+            return CallToolResult(content=[TextContent(
+                type="text",
+                text=f"ERROR: MCP connection was lost while {request.name} was running; the tool may or may not "
+                     f"have completed. Check the current state before retrying.",
+            )])
+        finally:
+            self._inflight -= 1
+
+    def status(self) -> Dict[str, Any]:
+        """返回连接状态，用于 /status 接口。"""
+        return {
+            "connected": self.session is not None,
+            "agent_ready": self.agent is not None,
+            "connected_at": self.connected_at,
+            "connections": self.reconnects,
+            "last_error": self.last_error,
+            "tools": self.tool_names,
+            "prompt_mtime": self.prompt_mtime,
+        }
+
+class DashboardCache:
+    """
+    监控面板数据缓存。
+    - 只在有订阅者时由后台任务每 DASHBOARD_INTERVAL 秒执行一次 DASHBOARD_QUERIES，查询量与打开的面板数量无关；
+    - 新订阅者先收到完整快照，之后只收到发生变化 (changed) 与消失 (removed) 的节点；
+    - 订阅者队列积压 (浏览器标签页处于后台等) 时丢弃积压的增量，改为推送一次完整快照。
+    """
+
+    def __init__(self, prometheus_url: str, interval: float):
+        self.prometheus_url = prometheus_url
+        self.interval = interval
+        self.client = httpx.AsyncClient(timeout=10.0)
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.version = 0
+        self.updated_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.subscribers: List[asyncio.Queue] = []
+        self._history: Dict[tuple, tuple] = {}
+        self._lock = asyncio.Lock()
+        self._history_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+    async def _query(self, query: str) -> List[Dict[str, Any]]:
+        """执行一条 PromQL 即时查询，返回 result 列表。"""
+        response = await self.client.get(f"{self.prometheus_url}/api/v1/query", params={"query": query})
+        response.raise_for_status()
+        body = response.json()
+        if body.get("status") != "success":
+            raise RuntimeError(body.get("error") or "Query failed")
+        return body["data"]["result"]
+
+    async def _collect(self) -> Dict[str, Dict[str, Any]]:
+        """并发执行三条查询并按 instance 合并 (与 panel.html 原有的合并逻辑一致)。"""
+        up_res, cpu_res, mem_res = await asyncio.gather(
+            *(self._query(DASHBOARD_QUERIES[key]) for key in ("up", "cpu", "memory"))
+        )
+
+        nodes: Dict[str, Dict[str, Any]] = {}
+        for item in up_res:
+            instance = item["metric"].get("instance")
+            if not instance:
+                continue
+            nodes[instance] = {
+                "instance": instance,
+                "job": item["metric"].get("job"),
+                "up": item["value"][1] == "1",
+                "cpu": 0.0,
+                "mem": 0.0,
+                "labels": item["metric"],
+            }
+        # 数值保留两位小数 (面板的显示精度)，避免无意义的抖动产生增量
+        for res, key in ((cpu_res, "cpu"), (mem_res, "mem")):
+            for item in res:
+                node = nodes.get(item["metric"].get("instance"))
+                if node is not None:
+                    node[key] = round(float(item["value"][1]), 2)
+        return nodes
+
+    def snapshot(self) -> Dict[str, Any]:
+        """完整快照事件。"""
+        return {
+            "type": "snapshot",
+            "version": self.version,
+            "updated_at": self.updated_at,
+            "error": self.error,
+            "nodes": list(self.nodes.values()),
+        }
+
+    def _publish(self, event: Dict[str, Any]) -> None:
+        for q in self.subscribers:
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(self.snapshot())
+
+    async def refresh(self, max_age: float = 0.0) -> None:
+        """
+        查询 Prometheus 并向订阅者推送增量。缓存未超过 max_age 秒时直接返回，
+        并发的刷新请求 (后台任务与 GET /dashboard) 由锁合并为一次查询。
+        """
+        async with self._lock:
+            if self.updated_at is not None and time.time() - self.updated_at < max_age:
+                return
+            try:
+                nodes = await self._collect()
+            except Exception as e:
+                self.updated_at = time.time()
+                self.error = f"{type(e).__name__}: {e}"
+                self.version += 1
+                self._publish({"type": "error", "version": self.version, "updated_at": self.updated_at, "error": self.error})
+                return
+
+            changed = {k: v for k, v in nodes.items() if self.nodes.get(k) != v}
+            removed = [k for k in self.nodes if k not in nodes]
+            self.nodes = nodes
+            self.updated_at = time.time()
+            self.error = None
+            self.version += 1
+            self._publish({
+                "type": "delta",
+                "version": self.version,
+                "updated_at": self.updated_at,
+                "changed": list(changed.values()),
+                "removed": removed,
+            })
+
+    async def history(self, instance: str, metric: str, minutes: int) -> List[list]:
+        """
+        详情图表数据 (query_range)，同一 instance/指标/时间范围的结果缓存 DASHBOARD_INTERVAL 秒，
+        多个面板打开同一图表时只查询一次。
+        """
+        key = (instance, metric, minutes)
+        async with self._history_lock:
+            now = time.time()
+            self._history = {k: v for k, v in self._history.items() if now - v[0] < self.interval}
+            if key in self._history:
+                return self._history[key][1]
+
+            escaped = instance.replace("\\", "\\\\").replace('"', '\\"')
+            response = await self.client.get(
+                f"{self.prometheus_url}/api/v1/query_range",
+                params={
+                    "query": DASHBOARD_HISTORY_QUERIES[metric].format(instance=escaped),
+                    "start": now - minutes * 60,
+                    "end": now,
+                    "step": DASHBOARD_HISTORY_STEPS[minutes],
+                },
+            )
+            response.raise_for_status()
+            result = response.json().get("data", {}).get("result", [])
+            values = result[0]["values"] if result else []
+            self._history[key] = (now, values)
+            return values
+
+    def subscribe(self) -> asyncio.Queue:
+        """注册订阅者，先放入当前快照，并唤醒后台任务开始轮询。"""
+        q = asyncio.Queue(maxsize=DASHBOARD_QUEUE_SIZE)
+        if self.updated_at is not None:
+            q.put_nowait(self.snapshot())
+        self.subscribers.append(q)
+        self._wakeup.set()
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        if q in self.subscribers:
+            self.subscribers.remove(q)
+
+    async def run(self) -> None:
+        """后台任务：有订阅者时按间隔刷新，没有订阅者时不查询 Prometheus。"""
+        try:
+            while True:
+                if not self.subscribers:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    # 缓存仍然新鲜时不必立即查询，新订阅者已收到快照
+                    await self.refresh(max_age=self.interval)
+                else:
+                    await self.refresh()
+                await asyncio.sleep(self.interval)
+        finally:
+            await self.client.aclose()
+
+async def sse_generator(agent, msg: str, thread_id: int, span: trace.Span):
     """
     将 LangGraph 的输出转换为 SSE (Server-Sent Events) 格式流。
+    span 为本次请求的 agent.chat span，流结束时关闭；所有事件都带上 trace_id。
     """
-    print(f"--- 收到请求: {msg} (Thread: {thread_id}) ---")
+    trace_id = format(span.get_span_context().trace_id, "032x")
+    carrier = {}
+    propagate.inject(carrier, context=trace.set_span_in_context(span))
+    print(f"--- 收到请求: {msg} (Thread: {thread_id}, Trace: {trace_id}) ---")
     
     # 广播开始事件
     await broadcast_event({
         "timestamp": time.time(),
         "thread_id": thread_id,
+        "trace_id": trace_id,
         "type": "start",
         "content": f"New Request: {msg}"
     })
@@ -71,7 +721,7 @@ async def sse_generator(agent, msg: str, thread_id: int):
     try:
         async for step in agent.astream(
             {"messages": [{"role": "user", "content": msg}]},
-            {"configurable": {"thread_id": thread_id}},
+            {"configurable": {"thread_id": thread_id, "traceparent": carrier.get("traceparent")}},
         ):
             for update in step.values():
                 
@@ -85,13 +735,14 @@ async def sse_generator(agent, msg: str, thread_id: int):
                                 continue
 
                             # 构造 JSON 数据
-                            payload = json.dumps({"type": "thought", "content": message.content}, ensure_ascii=False)
+                            payload = json.dumps({"type": "thought", "content": message.content, "trace_id": trace_id}, ensure_ascii=False)
                             yield f"data: {payload}\n\n"
                             
                             # 广播思考事件
                             await broadcast_event({
                                 "timestamp": time.time(),
                                 "thread_id": thread_id,
+                                "trace_id": trace_id,
                                 "type": "thought",
                                 "content": message.content
                             })
@@ -102,7 +753,8 @@ async def sse_generator(agent, msg: str, thread_id: int):
                                 "type": "tool_result",
                                 "name": message.name,
                                 "content": message.content,
-                                "tool_call_id": message.tool_call_id
+                                "tool_call_id": message.tool_call_id,
+                                "trace_id": trace_id
                             }, ensure_ascii=False)
                             yield f"data: {payload}\n\n"
 
@@ -110,6 +762,7 @@ async def sse_generator(agent, msg: str, thread_id: int):
                             await broadcast_event({
                                 "timestamp": time.time(),
                                 "thread_id": thread_id,
+                                "trace_id": trace_id,
                                 "type": "tool_result",
                                 "name": message.name,
                                 "content": message.content,
@@ -119,13 +772,14 @@ async def sse_generator(agent, msg: str, thread_id: int):
                 # 3. 处理工具调用
                 if "tool_calls" in update:
                     for call in update["tool_calls"]:
-                        payload = json.dumps({"type": "tool_call", "name": call['name'], "args": call['args']}, ensure_ascii=False)
+                        payload = json.dumps({"type": "tool_call", "name": call['name'], "args": call['args'], "trace_id": trace_id}, ensure_ascii=False)
                         yield f"data: {payload}\n\n"
                         
                         # 广播工具调用事件
                         await broadcast_event({
                             "timestamp": time.time(),
                             "thread_id": thread_id,
+                            "trace_id": trace_id,
                             "type": "tool_call",
                             "name": call['name'],
                             "args": call['args']
@@ -134,36 +788,43 @@ async def sse_generator(agent, msg: str, thread_id: int):
                 # 4. 处理最终结构化响应
                 if "structured_response" in update:
                     answer = update["structured_response"].Answer
-                    payload = json.dumps({"type": "answer", "content": answer}, ensure_ascii=False)
+                    payload = json.dumps({"type": "answer", "content": answer, "trace_id": trace_id}, ensure_ascii=False)
                     yield f"event: result\ndata: {payload}\n\n"
                     
                     # 广播最终答案事件
                     await broadcast_event({
                         "timestamp": time.time(),
                         "thread_id": thread_id,
+                        "trace_id": trace_id,
                         "type": "answer",
                         "content": answer
                     })
 
     except Exception as e:
-        error_msg = json.dumps({"type": "error", "content": str(e)}, ensure_ascii=False)
+        span.record_exception(e)
+        span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)[:200]))
+        error_msg = json.dumps({"type": "error", "content": str(e), "trace_id": trace_id}, ensure_ascii=False)
         yield f"event: error\ndata: {error_msg}\n\n"
         
         # 广播错误事件
         await broadcast_event({
             "timestamp": time.time(),
             "thread_id": thread_id,
+            "trace_id": trace_id,
             "type": "error",
             "content": str(e)
         })
 
+    finally:
+        span.end()
+
     # 5. 发送结束信号
     yield "event: done\ndata: [DONE]\n\n"
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global agent_instance
-    global mcp_client
+    global supervisor
+    global dashboard
 
     DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
     if not DEEPSEEK_API_KEY:
@@ -176,42 +837,22 @@ async def lifespan(app: FastAPI):
     
     print(f"正在使用 MCP URL: {MCP_URL}")
     
-    mcp_client = MultiServerMCPClient(
-        {
-            "pve_tool": {
-                "transport": "streamable_http",
-                "url": f"{MCP_URL}"
-            }
-        }
-    )
-    
-    print("正在连接 MCP 工具...")
-    try:
-        tools_list = await mcp_client.get_tools()
-        print(f"获取到工具: {[t.name for t in tools_list]}")
-        
-        # 从 prompt.txt 读取 System Prompt
-        try:
-            with open("prompt.txt", "r", encoding="utf-8") as f:
-                system_prompt = f.read()
-        except FileNotFoundError:
-             print("警告：prompt.txt 未找到！将使用默认空 Prompt。")
-             system_prompt = "You are a helpful assistant."
+    # MCP 服务尚未启动时不阻塞启动，由 McpSupervisor 在后台连接并重试
+    supervisor = McpSupervisor(MCP_URL, "pve_tool", PROMPT_PATH)
+    supervisor_task = asyncio.create_task(supervisor.run())
 
-        agent_instance = SetAgent(
-            model="deepseek-chat",
-            tools=tools_list,
-            response_format=ResponseFormat,
-            checkpointer=InMemorySaver(),
-            system_prompt=system_prompt
-        )
-        print("Agent 初始化成功！")
-    except Exception as e:
-        print(f"Agent 初始化失败，可能无法连接到 MCP 服务 ({MCP_URL})。错误信息: {e}")
+    dashboard = DashboardCache(PROMETHEUS_URL, DASHBOARD_INTERVAL)
+    dashboard_task = asyncio.create_task(dashboard.run())
     
     yield
     
     print("服务正在关闭...")
+    for task in (supervisor_task, dashboard_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
 # --- 初始化 FastAPI ---
 app = FastAPI(lifespan=lifespan, title="PVE Agent API")
@@ -221,22 +862,39 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
 # --- 定义 API 端点 ---
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
     SSE 流式对话接口
+    请求头中带有 traceparent (例如来自 prometheus_pusher) 时沿用上游的 trace，响应头 X-Trace-Id 返回 trace_id。
     """
+    agent_instance = await supervisor.get_agent()
     if not agent_instance:
-        return JSONResponse({"error": "Agent not initialized. Check server logs for MCP connection failure."}, status_code=503)
+        return JSONResponse({"error": f"Agent not initialized, MCP is unreachable ({supervisor.last_error}). Retrying in background."}, status_code=503)
 
+    span = tracer.start_span(
+        "agent.chat",
+        context=propagate.extract(http_request.headers),
+        kind=trace.SpanKind.SERVER,
+        attributes={"agent.thread_id": request.thread_id},
+    )
     return StreamingResponse(
-        sse_generator(agent_instance, request.message, request.thread_id),
-        media_type="text/event-stream"
+        sse_generator(agent_instance, request.message, request.thread_id, span),
+        media_type="text/event-stream",
+        headers={"X-Trace-Id": format(span.get_span_context().trace_id, "032x")},
     )
 
+@app.get("/status")
+async def status_endpoint():
+    """
+    MCP 连接与 Agent 状态
+    """
+    return JSONResponse(supervisor.status())
+
 async def monitor_generator(q: asyncio.Queue):
     try:
         while True:
@@ -254,6 +912,43 @@ async def monitor_endpoint():
     MONITOR_QUEUES.append(q)
     return StreamingResponse(monitor_generator(q), media_type="text/event-stream")
 
+async def dashboard_generator(q: asyncio.Queue):
+    try:
+        while True:
+            data = await q.get()
+            yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    finally:
+        dashboard.unsubscribe(q)
+
+@app.get("/dashboard")
+async def dashboard_snapshot():
+    """
+    监控面板快照，缓存超过 DASHBOARD_INTERVAL 秒时重新查询
+    """
+    await dashboard.refresh(max_age=dashboard.interval)
+    return JSONResponse(dashboard.snapshot())
+
+@app.get("/dashboard/history")
+async def dashboard_history(instance: str, metric: str, minutes: int = 5):
+    """
+    监控面板详情图表数据：metric 为 cpu 或 memory，minutes 为 1、5 或 30
+    """
+    if metric not in DASHBOARD_HISTORY_QUERIES or minutes not in DASHBOARD_HISTORY_STEPS:
+        return JSONResponse({"error": f"metric must be one of {list(DASHBOARD_HISTORY_QUERIES)}, minutes one of {list(DASHBOARD_HISTORY_STEPS)}"}, status_code=400)
+    try:
+        values = await dashboard.history(instance, metric, minutes)
+    except Exception as e:
+        return JSONResponse({"error": f"{type(e).__name__}: {e}"}, status_code=502)
+    return JSONResponse({"instance": instance, "metric": metric, "values": values})
+
+@app.get("/dashboard/stream")
+async def dashboard_stream():
+    """
+    监控面板 SSE 接口：首条为完整快照 (snapshot)，之后为增量 (delta) 或查询失败 (error) 事件
+    """
+    q = dashboard.subscribe()
+    return StreamingResponse(dashboard_generator(q), media_type="text/event-stream")
+
 async def main():
     print("🚀 启动 PVE Agent HTTP 服务器...")
     print("📡 监听地址: http://0.0.0.0:9999")
@@ -0,0 +1,497 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastmcp import Client
+
+PROMETHEUS_URL = os.getenv("PROMETHEUS_URL", "http://prometheus:9090")
+AUTOSCALER_MCP_URL = os.getenv("AUTOSCALER_MCP_URL", "http://pve-mcp:8000/mcp")
+PVE_AGENT_ALERT_URL = os.getenv("PVE_AGENT_ALERT_URL", "http://agent:9999/chat")
+
+AUTOSCALER_ENABLED = os.getenv("AUTOSCALER_ENABLED", "false").lower() == "true"
+AUTOSCALER_INTERVAL = int(os.getenv("AUTOSCALER_INTERVAL", "30"))
+AUTOSCALER_STATE_FILE = os.getenv("AUTOSCALER_STATE_FILE", "/app/data/autoscaler_state.json")
+
+# 集群压力查询 (0~1), 默认取所有 k3s 节点 (AUTOSCALER_NODE_SELECTOR 选中的抓取目标) 的平均 CPU 使用率与总体内存使用率
+NODE_SELECTOR = os.getenv("AUTOSCALER_NODE_SELECTOR", 'job="k3s-nodes"')
+CPU_QUERY = os.getenv(
+    "AUTOSCALER_CPU_QUERY",
+    f'1 - avg(rate(node_cpu_seconds_total{{mode="idle",{NODE_SELECTOR}}}[1m]))',
+)
+MEM_QUERY = os.getenv(
+    "AUTOSCALER_MEM_QUERY",
+    f"1 - sum(node_memory_MemAvailable_bytes{{{NODE_SELECTOR}}}) / sum(node_memory_MemTotal_bytes{{{NODE_SELECTOR}}})",
+)
+
+# 滞回阈值: 高于 SCALE_OUT_* 连续 SCALE_OUT_PERIODS 次扩容, 低于 SCALE_IN_* 连续 SCALE_IN_PERIODS 次缩容
+SCALE_OUT_CPU = float(os.getenv("AUTOSCALER_SCALE_OUT_CPU", "0.75"))
+SCALE_OUT_MEM = float(os.getenv("AUTOSCALER_SCALE_OUT_MEM", "0.80"))
+SCALE_IN_CPU = float(os.getenv("AUTOSCALER_SCALE_IN_CPU", "0.30"))
+SCALE_IN_MEM = float(os.getenv("AUTOSCALER_SCALE_IN_MEM", "0.40"))
+SCALE_OUT_PERIODS = int(os.getenv("AUTOSCALER_SCALE_OUT_PERIODS", "3"))
+SCALE_IN_PERIODS = int(os.getenv("AUTOSCALER_SCALE_IN_PERIODS", "10"))
+
+# 冷却时间 (秒): 任意扩缩容后, 下一次扩容/缩容至少间隔的时间
+SCALE_OUT_COOLDOWN = int(os.getenv("AUTOSCALER_SCALE_OUT_COOLDOWN", "300"))
+SCALE_IN_COOLDOWN = int(os.getenv("AUTOSCALER_SCALE_IN_COOLDOWN", "900"))
+
+# 自动扩容的工作节点数量上限, 以及允许放置的 PVE 节点 (为空表示所有在线节点)
+AUTOSCALER_MAX_WORKERS = int(os.getenv("AUTOSCALER_MAX_WORKERS", "5"))
+AUTOSCALER_NODES = [n.strip() for n in os.getenv("AUTOSCALER_NODES", "").split(",") if n.strip()]
+
+# 等待排队中的克隆任务完成的最长时间 (秒) 与查询间隔
+AUTOSCALER_CLONE_TIMEOUT = int(os.getenv("AUTOSCALER_CLONE_TIMEOUT", "1800"))
+CLONE_POLL_INTERVAL = 5
+
+# 缩容前通过 k3s API Server 隔离 (cordon)、驱逐 (drain) 工作节点并删除其 Node 对象;
+# Token 由 deploy/cloud_init/autoscaler 中的 ServiceAccount 签发, 未配置时拒绝缩容
+K8S_API_URL = os.getenv("AUTOSCALER_K8S_API_URL", "https://192.168.10.101:6443")
+K8S_TOKEN_FILE = os.getenv("AUTOSCALER_K8S_TOKEN_FILE", "/app/data/k8s_token")
+AUTOSCALER_DRAIN_TIMEOUT = int(os.getenv("AUTOSCALER_DRAIN_TIMEOUT", "300"))
+DRAIN_POLL_INTERVAL = 5
+
+WORKER_ROLE = "work"
+UPID_PATTERN = re.compile(r"UPID: (\S+?)\.(?:\s|$)")
+CLONE_JOB_PATTERN = re.compile(r"queued as clone job (\d+)")
+
+
+class WorkerAutoscaler:
+    """
+    WorkerAutoscaler k3s 工作节点自动扩缩容控制器
+    周期性查询 Prometheus 中的集群 CPU/内存压力, 经过滞回与冷却判断后,
+    直接调用 MCP 工具扩容或回收工作节点, 无需经过 LLM 决策; 仅在动作完成后通知 Agent 做记录。
+    """
+    def __init__(self):
+        # __init__ 初始化控制器并加载已管理的工作节点列表
+        # @return None
+        self.high_streak = 0
+        self.low_streak = 0
+        self.last_scale_at = 0.0
+        self.last_metrics: Dict[str, Optional[float]] = {"cpu": None, "memory": None}
+        self.last_action: Optional[Dict[str, Any]] = None
+        state = self._load_state()
+        self.managed: List[Dict[str, Any]] = state.get("managed", [])
+        self.stale_nodes: List[str] = state.get("stale_nodes", [])
+        self._background: set = set()
+
+    def _load_state(self) -> Dict[str, Any]:
+        # _load_state 从状态文件读取由自动扩缩容创建的工作节点与待删除的 Node 对象
+        # @note 状态文件不存在或损坏时返回空字典
+        # @return 状态字典, managed 中每项包含 node、vmid、name, stale_nodes 为虚拟机已删除但 Node 对象仍残留的节点名
+        try:
+            with open(AUTOSCALER_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        # _save_state 将由自动扩缩容创建的工作节点写入状态文件
+        # @return None
+        try:
+            os.makedirs(os.path.dirname(AUTOSCALER_STATE_FILE) or ".", exist_ok=True)
+            with open(AUTOSCALER_STATE_FILE, "w", encoding="utf-8") as f:
+                json.dump({"managed": self.managed, "stale_nodes": self.stale_nodes}, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"自动扩缩容状态保存失败: {e}")
+
+    async def query_prometheus(self, client: httpx.AsyncClient, query: str) -> Optional[float]:
+        # query_prometheus 执行一条 PromQL 即时查询并返回第一个标量结果
+        # @param client: 复用的 httpx 异步客户端
+        # @param query: PromQL 查询语句
+        # @return 查询结果数值, 无数据时返回 None
+        response = await client.get(f"{PROMETHEUS_URL}/api/v1/query", params={"query": query})
+        response.raise_for_status()
+        result = response.json().get("data", {}).get("result", [])
+        if not result:
+            return None
+        return float(result[0]["value"][1])
+
+    async def call_tool(self, mcp: Client, name: str, arguments: Dict[str, Any]) -> str:
+        # call_tool 调用 MCP 工具并返回文本结果
+        # @param mcp: 已连接的 fastmcp Client
+        # @param name: 工具名称
+        # @param arguments: 工具参数
+        # @return 工具返回的文本
+        result = await mcp.call_tool(name, arguments, raise_on_error=False)
+        return "".join(getattr(block, "text", "") for block in result.content)
+
+    async def wait_task(self, mcp: Client, node: str, text: str) -> bool:
+        # wait_task 从工具返回文本中提取 UPID 并等待任务完成
+        # @param mcp: 已连接的 fastmcp Client
+        # @param node: 任务所在 PVE 节点
+        # @param text: 返回 UPID 的工具结果文本
+        # @note 同步操作 (不含 UPID) 视为已完成
+        # @return 任务成功返回 True
+        if not text.startswith("SUCCESS"):
+            return False
+        match = UPID_PATTERN.search(text)
+        if not match:
+            return True
+        return await self.wait_upid(mcp, node, match.group(1))
+
+    async def wait_upid(self, mcp: Client, node: str, upid: str, timeout: int = 300) -> bool:
+        # wait_upid 等待 PVE 任务结束
+        # @param mcp: 已连接的 fastmcp Client
+        # @param node: 任务所在 PVE 节点
+        # @param upid: 任务 UPID
+        # @param timeout: (可选) 最大等待时间, 单位秒
+        # @return 任务成功返回 True
+        status = await self.call_tool(mcp, "monitor_pve_task", {"node": node, "upid": upid, "timeout": timeout})
+        return status.startswith("SUCCESS")
+
+    async def wait_clone(self, mcp: Client, node: str, text: str) -> bool:
+        # wait_clone 等待克隆真正完成
+        # @param mcp: 已连接的 fastmcp Client
+        # @param node: 克隆所在 PVE 节点
+        # @param text: clone_from_template 返回的文本
+        # @note 存储繁忙时克隆先在 CloneScheduler 中排队, 返回的是调度任务 id 而不是 UPID,
+        #       此时轮询 get_clone_queue_status 直到拿到 UPID 或任务失败
+        # @return 克隆成功返回 True
+        if not text.startswith("SUCCESS"):
+            return False
+        match = CLONE_JOB_PATTERN.search(text)
+        if not match:
+            upid = UPID_PATTERN.search(text)
+            return upid is not None and await self.wait_upid(mcp, node, upid.group(1), AUTOSCALER_CLONE_TIMEOUT)
+
+        job_id = int(match.group(1))
+        deadline = time.time() + AUTOSCALER_CLONE_TIMEOUT
+        while time.time() < deadline:
+            status = json.loads(await self.call_tool(mcp, "get_clone_queue_status", {}))
+            jobs = {job["id"]: job for key in ("queued", "running", "recent") for job in status.get(key, [])}
+            job = jobs.get(job_id)
+            if job is None or job["state"] == "failed":
+                return False
+            if job["upid"]:
+                remaining = max(int(deadline - time.time()), 1)
+                return await self.wait_upid(mcp, node, job["upid"], remaining)
+            await asyncio.sleep(CLONE_POLL_INTERVAL)
+        return False
+
+    async def pick_node(self, mcp: Client) -> Optional[str]:
+        # pick_node 选择内存占用率最低的在线 PVE 节点放置新工作节点
+        # @param mcp: 已连接的 fastmcp Client
+        # @return PVE 节点名称, 没有可用节点时返回 None
+        nodes = json.loads(await self.call_tool(mcp, "list_nodes", {}))
+        candidates = [
+            n for n in nodes
+            if n.get("status") == "online" and (not AUTOSCALER_NODES or n.get("node") in AUTOSCALER_NODES)
+        ]
+        if not candidates:
+            return None
+        best = min(candidates, key=lambda n: n["mem_used_gb"] / max(n["maxmem_gb"], 0.01))
+        return best["node"]
+
+    async def next_worker_name(self, mcp: Client, node: str) -> str:
+        # next_worker_name 按命名规范生成下一个工作节点名称
+        # @param mcp: 已连接的 fastmcp Client
+        # @param node: PVE 节点名称
+        # @return 形如 'pve-1-k3s-work3' 的名称
+        vms = json.loads(await self.call_tool(mcp, "list_vms_on_node", {"node": node}))
+        pattern = re.compile(rf"^{re.escape(node)}-k3s-work(\d+)$")
+        numbers = [int(m.group(1)) for vm in vms if (m := pattern.match(vm.get("name") or ""))]
+        return f"{node}-k3s-work{max(numbers, default=0) + 1}"
+
+    async def scale_out(self, mcp: Client) -> Dict[str, Any]:
+        # scale_out 新增一个工作节点: 优先从预热池领取, 否则从本地模板克隆
+        # @param mcp: 已连接的 fastmcp Client
+        # @note 虚拟机一经创建 (领取或克隆完成) 立即记入 managed, 之后的配置或启动失败时仍可被缩容回收;
+        #       cloud-init 片段由 apply_vm_snippet 按虚拟机渲染 (含一次性加入票据)
+        # @return 描述扩容结果的字典
+        node = await self.pick_node(mcp)
+        if node is None:
+            return {"action": "scale_out", "ok": False, "detail": "没有可用的 PVE 节点"}
+        name = await self.next_worker_name(mcp, node)
+
+        text = await self.call_tool(mcp, "claim_warm_vm", {"node": node, "new_name": name, "start": False})
+        if not text.startswith("ERROR"):
+            vmid = int(json.loads(text)["vmid"])
+            source = "从预热池领取"
+        else:
+            text = await self.call_tool(mcp, "clone_from_template", {"node": node, "new_name": name})
+            match = re.search(r"VMID (\d+)", text)
+            if not match or not await self.wait_clone(mcp, node, text):
+                return {"action": "scale_out", "ok": False, "node": node, "name": name, "detail": text}
+            vmid = int(match.group(1))
+            source = "从模板克隆"
+
+        worker = {"node": node, "vmid": vmid, "name": name}
+        self.managed.append(worker)
+        self._save_state()
+
+        text = await self.call_tool(mcp, "apply_vm_snippet", {"node": node, "vmid": vmid, "role": WORKER_ROLE})
+        if text.startswith("ERROR"):
+            return {"action": "scale_out", "ok": False, **worker, "detail": text}
+
+        text = await self.call_tool(mcp, "start_vm", {"node": node, "vmid": vmid})
+        ok = await self.wait_task(mcp, node, text)
+        return {"action": "scale_out", "ok": ok, **worker, "detail": source if ok else text}
+
+    def k8s_client(self) -> Optional[httpx.AsyncClient]:
+        # k8s_client 创建访问 k3s API Server 的客户端
+        # @note 与 Prometheus 的 kubernetes_sd 一致, 跳过 API Server 自签名证书校验
+        # @return httpx 异步客户端, Token 文件不存在或为空时返回 None
+        try:
+            with open(K8S_TOKEN_FILE, "r", encoding="utf-8") as f:
+                token = f.read().strip()
+        except OSError:
+            return None
+        if not token:
+            return None
+        return httpx.AsyncClient(
+            base_url=K8S_API_URL, headers={"Authorization": f"Bearer {token}"}, verify=False, timeout=30.0
+        )
+
+    async def cordon(self, k8s: httpx.AsyncClient, name: str, unschedulable: bool = True) -> bool:
+        # cordon 将 k3s 节点标记为不可调度 (或恢复可调度)
+        # @param k8s: k8s_client 创建的客户端
+        # @param name: k3s 节点名称, 即虚拟机名称
+        # @param unschedulable: (可选) False 时取消隔离
+        # @return 节点存在返回 True, 节点从未加入集群 (404) 返回 False
+        response = await k8s.patch(
+            f"/api/v1/nodes/{name}",
+            content=json.dumps({"spec": {"unschedulable": unschedulable}}),
+            headers={"Content-Type": "application/merge-patch+json"},
+        )
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    @staticmethod
+    def _evictable(pod: Dict[str, Any], running: bool) -> bool:
+        # _evictable 判断节点上的 Pod 是否仍需驱逐
+        # @param pod: Pod 对象
+        # @param running: 虚拟机是否在运行
+        # @note 与 kubectl drain 一致, 忽略 DaemonSet 管理的 Pod、静态 (mirror) Pod 与已结束的 Pod;
+        #       虚拟机未运行时 kubelet 无法完成终止, 已进入删除流程的 Pod 视为驱逐完成
+        # @return 需要驱逐或等待其终止时返回 True
+        meta = pod.get("metadata", {})
+        if any(owner.get("kind") == "DaemonSet" for owner in meta.get("ownerReferences", [])):
+            return False
+        if "kubernetes.io/config.mirror" in meta.get("annotations", {}):
+            return False
+        if pod.get("status", {}).get("phase") in ("Succeeded", "Failed"):
+            return False
+        return running or not meta.get("deletionTimestamp")
+
+    async def drain(self, k8s: httpx.AsyncClient, name: str, running: bool) -> Optional[str]:
+        # drain 通过 Eviction API 驱逐节点上的 Pod 并等待其终止
+        # @param k8s: k8s_client 创建的客户端
+        # @param name: k3s 节点名称
+        # @param running: 虚拟机是否在运行
+        # @note 驱逐遵守 PodDisruptionBudget, 被拒绝 (429) 的 Pod 在下一轮重试
+        # @return 驱逐完成返回 None, 超时返回错误描述
+        deadline = time.time() + AUTOSCALER_DRAIN_TIMEOUT
+        while True:
+            response = await k8s.get("/api/v1/pods", params={"fieldSelector": f"spec.nodeName={name}"})
+            response.raise_for_status()
+            pods = [pod for pod in response.json().get("items", []) if self._evictable(pod, running)]
+            if not pods:
+                return None
+            if time.time() >= deadline:
+                remaining = ", ".join(f"{p['metadata']['namespace']}/{p['metadata']['name']}" for p in pods)
+                return f"驱逐超时 ({AUTOSCALER_DRAIN_TIMEOUT} 秒), 剩余 Pod: {remaining}"
+
+            for pod in pods:
+                meta = pod["metadata"]
+                if meta.get("deletionTimestamp"):
+                    continue
+                eviction = {
+                    "apiVersion": "policy/v1",
+                    "kind": "Eviction",
+                    "metadata": {"name": meta["name"], "namespace": meta["namespace"]},
+                }
+                response = await k8s.post(
+                    f"/api/v1/namespaces/{meta['namespace']}/pods/{meta['name']}/eviction", json=eviction
+                )
+                if response.status_code not in (404, 429):
+                    response.raise_for_status()
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+    async def delete_node(self, k8s: httpx.AsyncClient, name: str) -> bool:
+        # delete_node 删除 k3s 中的 Node 对象
+        # @param k8s: k8s_client 创建的客户端
+        # @param name: k3s 节点名称
+        # @return 删除成功或节点已不存在返回 True
+        try:
+            response = await k8s.delete(f"/api/v1/nodes/{name}")
+        except httpx.HTTPError as e:
+            print(f"删除 k3s 节点 {name} 失败: {e}")
+            return False
+        if response.status_code != 404 and response.is_error:
+            print(f"删除 k3s 节点 {name} 失败: HTTP {response.status_code}")
+            return False
+        return True
+
+    async def cleanup_stale_nodes(self) -> None:
+        # cleanup_stale_nodes 重试删除缩容后残留的 Node 对象
+        # @return None
+        k8s = self.k8s_client()
+        if k8s is None:
+            return
+        async with k8s:
+            remaining = [name for name in self.stale_nodes if not await self.delete_node(k8s, name)]
+        if remaining != self.stale_nodes:
+            self.stale_nodes = remaining
+            self._save_state()
+
+    async def scale_in(self, mcp: Client) -> Dict[str, Any]:
+        # scale_in 回收最近一次自动扩容的工作节点
+        # @param mcp: 已连接的 fastmcp Client
+        # @note 只回收由自动扩缩容创建的虚拟机; 依次隔离节点、驱逐 Pod、关机并删除虚拟机, 最后删除 Node 对象;
+        #       驱逐失败时取消隔离并放弃本次缩容, Node 对象删除失败时记入 stale_nodes 在后续评估中重试
+        # @return 描述缩容结果的字典
+        worker = self.managed[-1]
+        node, vmid, name = worker["node"], worker["vmid"], worker["name"]
+
+        k8s = self.k8s_client()
+        if k8s is None:
+            detail = f"未配置 k3s API Token ({K8S_TOKEN_FILE}), 无法驱逐节点上的 Pod, 拒绝缩容"
+            return {"action": "scale_in", "ok": False, **worker, "detail": detail}
+
+        async with k8s:
+            # 扩容中途失败的虚拟机可能从未启动, 此时跳过关机直接删除
+            text = await self.call_tool(mcp, "get_vm_status", {"node": node, "vmid": vmid})
+            running = '"status": "stopped"' not in text
+
+            try:
+                registered = await self.cordon(k8s, name)
+                error = await self.drain(k8s, name, running) if registered else None
+            except httpx.HTTPError as e:
+                registered, error = True, f"隔离或驱逐 k3s 节点失败: {e}"
+            if error:
+                try:
+                    await self.cordon(k8s, name, unschedulable=False)
+                except httpx.HTTPError as e:
+                    error += f"; 取消隔离失败: {e}"
+                return {"action": "scale_in", "ok": False, **worker, "detail": error}
+
+            if running:
+                text = await self.call_tool(mcp, "shutdown_vm", {"node": node, "vmid": vmid})
+                if not await self.wait_task(mcp, node, text):
+                    return {"action": "scale_in", "ok": False, **worker, "detail": text}
+
+            text = await self.call_tool(mcp, "delete_vm", {"node": node, "vmid": vmid})
+            ok = await self.wait_task(mcp, node, text)
+            if ok:
+                self.managed.pop()
+                if registered and not await self.delete_node(k8s, name):
+                    self.stale_nodes.append(name)
+                self._save_state()
+        return {"action": "scale_in", "ok": ok, **worker, "detail": text}
+
+    def decide(self, cpu: Optional[float], memory: Optional[float]) -> Optional[str]:
+        # decide 根据最新指标更新滞回计数并判断是否需要扩缩容
+        # @param cpu: 集群 CPU 使用率 (0~1), 无数据时为 None
+        # @param memory: 集群内存使用率 (0~1), 无数据时为 None
+        # @note 任一指标超过扩容阈值即视为高压; 两个指标都低于缩容阈值才视为低压
+        # @return 'scale_out'、'scale_in' 或 None
+        if cpu is None or memory is None:
+            self.high_streak = self.low_streak = 0
+            return None
+
+        if cpu >= SCALE_OUT_CPU or memory >= SCALE_OUT_MEM:
+            self.high_streak += 1
+            self.low_streak = 0
+        elif cpu <= SCALE_IN_CPU and memory <= SCALE_IN_MEM:
+            self.low_streak += 1
+            self.high_streak = 0
+        else:
+            self.high_streak = self.low_streak = 0
+
+        since_last = time.time() - self.last_scale_at
+        if (self.high_streak >= SCALE_OUT_PERIODS and since_last >= SCALE_OUT_COOLDOWN
+                and len(self.managed) < AUTOSCALER_MAX_WORKERS):
+            return "scale_out"
+        if self.low_streak >= SCALE_IN_PERIODS and since_last >= SCALE_IN_COOLDOWN and self.managed:
+            return "scale_in"
+        return None
+
+    async def notify_agent(self, outcome: Dict[str, Any]) -> None:
+        # notify_agent 将扩缩容结果发送给 Agent, 仅用于记录与报告
+        # @param outcome: scale_out/scale_in 返回的结果字典
+        # @return None
+        action = "扩容" if outcome["action"] == "scale_out" else "缩容"
+        result = "成功" if outcome.get("ok") else "失败"
+        payload = {
+            "message": (
+                f"【自动扩缩容报告】自动扩缩容控制器已执行{action}，结果：{result}。"
+                f" 指标: CPU {self.last_metrics['cpu']:.1%}，内存 {self.last_metrics['memory']:.1%}。"
+                f" 详情: {json.dumps(outcome, ensure_ascii=False)}。"
+                " 该操作已由控制器完成，请仅做记录和汇总报告，不要调用任何工具。"
+            ),
+            "thread_id": 998,
+        }
+        try:
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                await client.post(PVE_AGENT_ALERT_URL, json=payload)
+        except httpx.HTTPError as e:
+            print(f"自动扩缩容报告发送失败: {e}")
+
+    async def evaluate_once(self, client: httpx.AsyncClient) -> Optional[Dict[str, Any]]:
+        # evaluate_once 执行一次 "查询指标 -> 判断 -> 执行" 循环
+        # @param client: 复用的 httpx 异步客户端
+        # @return 执行了扩缩容时返回结果字典, 否则返回 None
+        if self.stale_nodes:
+            await self.cleanup_stale_nodes()
+
+        cpu = await self.query_prometheus(client, CPU_QUERY)
+        memory = await self.query_prometheus(client, MEM_QUERY)
+        self.last_metrics = {"cpu": cpu, "memory": memory}
+
+        decision = self.decide(cpu, memory)
+        if decision is None:
+            return None
+
+        print(f"自动扩缩容触发 {decision}: CPU={cpu:.2f}, 内存={memory:.2f}")
+        async with Client(AUTOSCALER_MCP_URL) as mcp:
+            if decision == "scale_out":
+                outcome = await self.scale_out(mcp)
+            else:
+                outcome = await self.scale_in(mcp)
+
+        self.last_scale_at = time.time()
+        self.high_streak = self.low_streak = 0
+        self.last_action = {"timestamp": self.last_scale_at, **outcome}
+        task = asyncio.create_task(self.notify_agent(outcome))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return outcome
+
+    async def run(self) -> None:
+        # run 控制器主循环, 每 AUTOSCALER_INTERVAL 秒评估一次
+        # @note 单次评估失败只打印错误, 不会终止循环
+        # @return None
+        print(f"自动扩缩容控制器已启动, Prometheus: {PROMETHEUS_URL}, MCP: {AUTOSCALER_MCP_URL}")
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            while True:
+                try:
+                    await self.evaluate_once(client)
+                except Exception as e:
+                    print(f"自动扩缩容评估失败: {e}")
+                await asyncio.sleep(AUTOSCALER_INTERVAL)
+
+    def status(self) -> Dict[str, Any]:
+        # status 返回控制器当前状态, 供 /autoscaler/status 接口使用
+        # @return 状态字典
+        return {
+            "enabled": AUTOSCALER_ENABLED,
+            "metrics": self.last_metrics,
+            "high_streak": self.high_streak,
+            "low_streak": self.low_streak,
+            "last_action": self.last_action,
+            "managed_workers": self.managed,
+            "stale_nodes": self.stale_nodes,
+            "thresholds": {
+                "scale_out": {"cpu": SCALE_OUT_CPU, "memory": SCALE_OUT_MEM, "periods": SCALE_OUT_PERIODS,
+                              "cooldown_seconds": SCALE_OUT_COOLDOWN},
+                "scale_in": {"cpu": SCALE_IN_CPU, "memory": SCALE_IN_MEM, "periods": SCALE_IN_PERIODS,
+                             "cooldown_seconds": SCALE_IN_COOLDOWN},
+                "max_workers": AUTOSCALER_MAX_WORKERS,
+            },
+        }
@@ -1,13 +1,58 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 import httpx
 import json
 import uvicorn
 import os
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+from autoscaler import WorkerAutoscaler, AUTOSCALER_ENABLED
 
 PVE_AGENT_ALERT_URL = os.getenv("PVE_AGENT_ALERT_URL", "http://agent:9999/chat")
+# 追踪配置: span 以 JSON Lines (OpenTelemetry span JSON) 追加写入 TRACE_EXPORT_PATH, 为空时只传播不导出
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SERVICE_NAME = "prometheus-pusher"
+
+
+def setup_tracing(service_name: str, export_path: str) -> trace.Tracer:
+    # setup_tracing 初始化 OpenTelemetry TracerProvider
+    # @param service_name: 写入 span resource 的 service.name
+    # @param export_path: JSON Lines 导出文件路径, 为空时不导出
+    # @return 本服务使用的 Tracer
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if export_path:
+        os.makedirs(os.path.dirname(export_path) or ".", exist_ok=True)
+        exporter = ConsoleSpanExporter(
+            out=open(export_path, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer(service_name)
+
+
+tracer = setup_tracing(TRACE_SERVICE_NAME, TRACE_EXPORT_PATH)
+
+autoscaler = WorkerAutoscaler()
 
-app = FastAPI(title="Prometheus Alert Pusher")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # lifespan 服务生命周期: 启用时在后台运行自动扩缩容控制器
+    # @param app: FastAPI 应用实例
+    # @return None
+    task = asyncio.create_task(autoscaler.run()) if AUTOSCALER_ENABLED else None
+    yield
+    if task:
+        task.cancel()
+
+
+app = FastAPI(title="Prometheus Alert Pusher", lifespan=lifespan)
 
 def format_alert_for_agent(alert_data: dict) -> str:
     # format_alert_for_agent 将 Prometheus Webhook 格式的告警数据转换为 Agent 可理解的中文描述
@@ -44,29 +89,45 @@ def format_alert_for_agent(alert_data: dict) -> str:
 async def receive_alert(request: Request):
     # receive_alert 接收来自 Alertmanager 的 Webhook 告警并转发至 PVE Agent
     # @param request: FastAPI 的 Request 对象，用于获取原始请求体
-    # @note 函数内部使用 httpx 异步客户端向 Agent 服务发起 POST 请求，模拟用户消息
-    # @return 返回一个 JSONResponse，指示告警转发的成功或失败状态
-    try:
-        alert_data = await request.json()
+    # @note 函数内部使用 httpx 异步客户端向 Agent 服务发起 POST 请求，模拟用户消息;
+    #       整个处理过程记录为 pusher.receive_alert span, 并通过 traceparent 请求头传给 Agent
+    # @return 返回一个 JSONResponse，指示告警转发的成功或失败状态 (包含 trace_id)
+    with tracer.start_as_current_span("pusher.receive_alert", context=propagate.extract(request.headers),
+                                      kind=trace.SpanKind.SERVER) as span:
+        trace_id = format(span.get_span_context().trace_id, "032x")
+        try:
+            alert_data = await request.json()
 
-        formatted_msg = format_alert_for_agent(alert_data)
+            formatted_msg = format_alert_for_agent(alert_data)
+            span.set_attribute("alert.count", len(alert_data.get('alerts', [])))
 
-        payload = {
-            "message": f"紧急告警通知，请注意:\n{formatted_msg}",
-            "thread_id": 999 
-        }
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(PVE_AGENT_ALERT_URL, json=payload)
-            response.raise_for_status() 
+            payload = {
+                "message": f"紧急告警通知，请注意:\n{formatted_msg}",
+                "thread_id": 999 
+            }
+
+            headers = {}
+            propagate.inject(headers)
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                response = await client.post(PVE_AGENT_ALERT_URL, json=payload, headers=headers)
+                response.raise_for_status() 
+
+            return JSONResponse({"status": "success", "message": "Alert forwarded to PVE Agent.", "trace_id": trace_id}, status_code=200)
 
-        return JSONResponse({"status": "success", "message": "Alert forwarded to PVE Agent."}, status_code=200)
+        except httpx.HTTPStatusError as e:
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)[:200]))
+            return JSONResponse({"status": "error", "message": f"PVE Agent returned error: {e}", "trace_id": trace_id}, status_code=500)
+        except Exception as e:
+            print(f"处理告警时发生错误 (Trace: {trace_id}): {e}")
+            span.record_exception(e)
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)[:200]))
+            return JSONResponse({"status": "error", "message": f"Internal server error: {e}", "trace_id": trace_id}, status_code=500)
 
-    except httpx.HTTPStatusError as e:
-        return JSONResponse({"status": "error", "message": f"PVE Agent returned error: {e}"}, status_code=500)
-    except Exception as e:
-        print(f"处理告警时发生错误: {e}")
-        return JSONResponse({"status": "error", "message": f"Internal server error: {e}"}, status_code=500)
+@app.get("/autoscaler/status")
+async def autoscaler_status():
+    # autoscaler_status 查询自动扩缩容控制器的状态
+    # @return 包含最新指标、滞回计数、最近动作与已管理工作节点的 JSONResponse
+    return JSONResponse(autoscaler.status())
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=9095)